@@ -0,0 +1,514 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import shutil
+import time
+import zlib
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from busca_lexical import IndiceLexico, construir_lexico, fundir_rrf
+from metricas import medir
+
+FORMATO = "trechos-v1"
+ARQUIVO_CONFIG = "config.json"
+ARQUIVO_MANIFESTO = "manifest.json"
+PREFIXOS_VERSIONADOS = (
+    "vetores-",
+    "trechos-",
+    "lexico-",
+    "dicionario-",
+    "metadados-",
+    "exatos-",
+)
+# Metadados repetidos entre trechos viram codigos int32 em tabelas de strings.
+COLUNAS_METADADOS = ("arquivo", "titulo")
+# O deflate so alcanca os ultimos 32 KB do dicionario.
+TAMANHO_DICIONARIO = 32 * 1024
+AMOSTRAS_DICIONARIO = 256
+NIVEL_COMPRESSAO = 6
+# Fracao de ids removidos a partir da qual a reindexacao incremental refaz tudo:
+# ids removidos seguem ocupando linhas nos offsets e na copia float32.
+LIMIAR_COMPACTACAO = 0.25
+
+
+def nova_versao() -> str:
+    return f"{time.time_ns() // 1_000_000:x}"
+
+
+def carregar_json(caminho: Path) -> Dict[str, Any]:
+    if not caminho.exists():
+        return {}
+    try:
+        return json.loads(caminho.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+
+
+def ler_config(pasta_indice: Path) -> Dict[str, Any]:
+    return carregar_json(pasta_indice / ARQUIVO_CONFIG)
+
+
+def salvar_json(caminho: Path, dados: Dict[str, Any]) -> None:
+    temporario = caminho.with_suffix(caminho.suffix + ".tmp")
+    with open(temporario, "w", encoding="utf-8") as f:
+        json.dump(dados, f, ensure_ascii=True, indent=2)
+    os.replace(temporario, caminho)
+
+
+def formato_atual(config: Dict[str, Any]) -> bool:
+    return config.get("formato") == FORMATO
+
+
+def fracao_removida(pasta_indice: Path, config: Dict[str, Any], vivos: int) -> float:
+    # Cada id ja alocado tem um par int64 (inicio, tamanho) nos offsets.
+    alocados = (pasta_indice / config["arquivos"]["offsets"]).stat().st_size // 16
+    return 1 - vivos / alocados if alocados else 0.0
+
+
+def envolver_ids(index: faiss.Index) -> faiss.Index:
+    # IVF guarda ids proprios e remove por id; nos demais o IDMap2 faz o mapeamento.
+    try:
+        faiss.extract_index_ivf(index)
+        return index
+    except RuntimeError:
+        return faiss.IndexIDMap2(index)
+
+
+def ler_vetores(caminho: Path, tipo: str) -> faiss.Index:
+    if tipo in ("ivf", "ivfpq"):
+        flags = faiss.IO_FLAG_MMAP
+    else:
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(str(caminho), flags | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(str(caminho))
+
+
+def mapear_leitura(arquivo: Any, aleatorio: bool = False) -> mmap.mmap | bytes:
+    if not os.fstat(arquivo.fileno()).st_size:
+        return b""
+    mapa = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+    if aleatorio and hasattr(mmap, "MADV_RANDOM"):
+        # Sem readahead o worker so carrega as paginas dos trechos consultados.
+        mapa.madvise(mmap.MADV_RANDOM)
+    return mapa
+
+
+def mapear_array(
+    caminho: Path, dtype: Any, colunas: int, aleatorio: bool = False
+) -> np.ndarray:
+    with open(caminho, "rb") as arquivo:
+        mapa = mapear_leitura(arquivo, aleatorio)
+    return np.frombuffer(mapa, dtype=dtype).reshape(-1, colunas)
+
+
+def treinar_dicionario(blocos: List[bytes]) -> bytes:
+    # Amostras espalhadas pelo primeiro lote; o vocabulario e o estilo dos
+    # documentos se repetem entre trechos, entao servem de historico comum.
+    passo = max(1, len(blocos) // AMOSTRAS_DICIONARIO)
+    return b"".join(blocos[::passo])[-TAMANHO_DICIONARIO:]
+
+
+def comprimir_bloco(bloco: bytes, dicionario: bytes) -> bytes:
+    compressor = zlib.compressobj(NIVEL_COMPRESSAO, zdict=dicionario)
+    return compressor.compress(bloco) + compressor.flush()
+
+
+def descomprimir_bloco(bloco: bytes, dicionario: bytes) -> bytes:
+    return zlib.decompressobj(zdict=dicionario).decompress(bloco)
+
+
+def repontuar_exato(
+    consultas: np.ndarray, ids: np.ndarray, exatos: np.ndarray, limite: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    distancias = np.full(
+        (len(ids), limite), np.finfo(np.float32).max, dtype=np.float32
+    )
+    rotulos = np.full((len(ids), limite), -1, dtype=np.int64)
+    for i, (consulta, linha) in enumerate(zip(consultas, ids)):
+        # Ids ordenados leem o arquivo mapeado em ordem crescente.
+        candidatos = np.unique(linha[linha >= 0])
+        if not len(candidatos):
+            continue
+        diferencas = exatos[candidatos] - consulta
+        exatas = np.einsum("ij,ij->i", diferencas, diferencas)
+        melhores = np.argsort(exatas, kind="stable")[:limite]
+        distancias[i, : len(melhores)] = exatas[melhores]
+        rotulos[i, : len(melhores)] = candidatos[melhores]
+    return distancias, rotulos
+
+
+class LeitorTrechos:
+    def __init__(self, pasta_indice: Path, arquivos: Dict[str, str]) -> None:
+        self.offsets = mapear_array(pasta_indice / arquivos["offsets"], np.int64, 2)
+        self._arquivo = open(pasta_indice / arquivos["trechos"], "rb")
+        self._mapa = mapear_leitura(self._arquivo, aleatorio=True)
+        # Indices anteriores guardam cada trecho como JSON completo, sem compressao.
+        self._dicionario: bytes | None = None
+        if "dicionario" in arquivos:
+            self._dicionario = (pasta_indice / arquivos["dicionario"]).read_bytes()
+        self._colunas: np.ndarray | None = None
+        self._tabelas: Dict[str, List[str]] = {}
+        if "metadados" in arquivos:
+            self._colunas = mapear_array(
+                pasta_indice / arquivos["metadados"], np.int32, len(COLUNAS_METADADOS)
+            )
+            self._tabelas = carregar_json(pasta_indice / arquivos["tabelas"])
+
+    def trecho(self, id_vetor: int) -> Dict[str, Any]:
+        inicio, tamanho = self.offsets[id_vetor]
+        bloco = self._mapa[inicio : inicio + tamanho]
+        if self._dicionario is not None:
+            bloco = descomprimir_bloco(bloco, self._dicionario)
+        trecho = json.loads(bloco)
+        if self._colunas is not None:
+            codigos = self._colunas[id_vetor].tolist()
+            for coluna, codigo in zip(COLUNAS_METADADOS, codigos):
+                trecho[coluna] = self._tabelas[coluna][codigo]
+        return trecho
+
+    def iterar(self) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for id_vetor in np.flatnonzero(self.offsets[:, 1]).tolist():
+            yield id_vetor, self.trecho(id_vetor)
+
+    def fechar(self) -> None:
+        if isinstance(self._mapa, mmap.mmap):
+            self._mapa.close()
+        self._arquivo.close()
+
+
+def iterar_trechos(
+    pasta_indice: Path, arquivos: Dict[str, str]
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    leitor = LeitorTrechos(pasta_indice, arquivos)
+    try:
+        yield from leitor.iterar()
+    finally:
+        leitor.fechar()
+
+
+class IndiceTrechos:
+    def __init__(self, pasta_indice: Path, config: Dict[str, Any]) -> None:
+        arquivos = config["arquivos"]
+        self.pasta_indice = pasta_indice
+        self.config = config
+        self.versao = config.get("versao", "")
+        self.index = ler_vetores(
+            pasta_indice / arquivos["vetores"], config.get("tipo_indice", "flat")
+        )
+        self.trechos = LeitorTrechos(pasta_indice, arquivos)
+        # Copia float32 dos vetores comprimidos, lida so nos candidatos repontuados.
+        self._exatos: np.ndarray | None = None
+        if "exatos" in arquivos:
+            self._exatos = mapear_array(
+                pasta_indice / arquivos["exatos"],
+                np.float32,
+                self.index.d,
+                aleatorio=True,
+            )
+        self.repontuar = int(config.get("parametros_indice", {}).get("repontuar", 0))
+        self.lexico: IndiceLexico | None = None
+        if "lexico_termos" in arquivos:
+            self.lexico = IndiceLexico(pasta_indice, arquivos)
+
+    @property
+    def total(self) -> int:
+        return int(self.index.ntotal)
+
+    def trecho(self, id_vetor: int) -> Dict[str, Any]:
+        return self.trechos.trecho(id_vetor)
+
+    def documento(self, id_vetor: int) -> Document:
+        trecho = self.trecho(id_vetor)
+        return Document(
+            id=trecho["id"],
+            page_content=trecho["texto"],
+            metadata={
+                "arquivo": trecho["arquivo"],
+                "titulo": trecho["titulo"],
+                "id": trecho["id"],
+            },
+        )
+
+    def buscar_vetores(
+        self, vetores: np.ndarray, limite: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        if self._exatos is None or self.repontuar <= 1:
+            with medir("busca_faiss"):
+                return self.index.search(vetores, limite)
+        with medir("busca_faiss"):
+            _, ids = self.index.search(vetores, limite * self.repontuar)
+        with medir("repontuar_exato"):
+            return repontuar_exato(vetores, ids, self._exatos, limite)
+
+    def buscar(self, vetores: np.ndarray, limite: int) -> List[List[Document]]:
+        _, ids = self.buscar_vetores(vetores, limite)
+        return [[self.documento(int(i)) for i in linha if i >= 0] for linha in ids]
+
+    def buscar_lexico(self, consulta: str, limite: int) -> List[int]:
+        return self.buscar_lexico_notas(consulta, limite)[0]
+
+    def buscar_lexico_notas(
+        self, consulta: str, limite: int, idf: Dict[str, float] | None = None
+    ) -> Tuple[List[int], List[float]]:
+        if self.lexico is None:
+            return [], []
+        with medir("busca_bm25"):
+            return self.lexico.buscar_notas(consulta, limite, idf)
+
+    def buscar_hibrido(
+        self,
+        vetores: np.ndarray,
+        consultas: List[str],
+        limite: int,
+        candidatos: int,
+    ) -> List[List[Document]]:
+        _, ids = self.buscar_vetores(vetores, candidatos)
+        resultados = []
+        for linha, consulta in zip(ids, consultas):
+            vetoriais = [int(i) for i in linha if i >= 0]
+            lexicos = self.buscar_lexico(consulta, candidatos)
+            fundidos = fundir_rrf([vetoriais, lexicos], limite)
+            resultados.append([self.documento(i) for i in fundidos])
+        return resultados
+
+
+class EscritorIndice:
+    def __init__(
+        self,
+        pasta_indice: Path,
+        config_anterior: Dict[str, Any] | None,
+        exatos: bool = False,
+    ) -> None:
+        self.pasta_indice = pasta_indice
+        self.versao = nova_versao()
+        self.index: faiss.Index | None = None
+        self.offsets = array("q")
+        self.colunas = array("i")
+        self.tabelas: Dict[str, List[str]] = {c: [] for c in COLUNAS_METADADOS}
+        self.dicionario: bytes | None = b""
+        self.nome_trechos = f"trechos-{self.versao}.bin"
+        self.nome_exatos = f"exatos-{self.versao}.f32" if exatos else ""
+        self._anteriores: Dict[str, str] = {}
+        if config_anterior:
+            arquivos = config_anterior["arquivos"]
+            self.index = faiss.read_index(str(pasta_indice / arquivos["vetores"]))
+            self.offsets.frombytes((pasta_indice / arquivos["offsets"]).read_bytes())
+            self._anteriores = arquivos
+            if not arquivos.get("exatos"):
+                self.nome_exatos = ""
+            if "dicionario" in arquivos:
+                self.nome_dicionario = arquivos["dicionario"]
+                self.dicionario = (pasta_indice / self.nome_dicionario).read_bytes()
+                self.colunas.frombytes(
+                    (pasta_indice / arquivos["metadados"]).read_bytes()
+                )
+                self.tabelas.update(carregar_json(pasta_indice / arquivos["tabelas"]))
+            else:
+                # Indice sem compressao continua no formato em que foi criado.
+                self.dicionario = None
+        self._codigos = {
+            coluna: {valor: codigo for codigo, valor in enumerate(valores)}
+            for coluna, valores in self.tabelas.items()
+        }
+        self._arquivo: BinaryIO | None = None
+        self._exatos: BinaryIO | None = None
+        self._posicao = 0
+
+    def _abrir(self) -> None:
+        if self._arquivo is not None:
+            return
+        # Leitores em uso mapeiam os arquivos da versao anterior: a nova versao
+        # nunca anexa a eles. Abre depois das remocoes para nao copiar trechos mortos.
+        destino = self.pasta_indice / self.nome_trechos
+        if self._anteriores:
+            self._copiar_trechos(self.pasta_indice / self._anteriores["trechos"])
+            if self.nome_exatos:
+                shutil.copyfile(
+                    self.pasta_indice / self._anteriores["exatos"],
+                    self.pasta_indice / self.nome_exatos,
+                )
+        self._arquivo = open(destino, "ab")
+        self._posicao = self._arquivo.tell()
+        if self.nome_exatos:
+            self._exatos = open(self.pasta_indice / self.nome_exatos, "ab")
+
+    def _copiar_trechos(self, anterior: Path) -> None:
+        posicao = 0
+        with open(anterior, "rb") as origem, open(
+            self.pasta_indice / self.nome_trechos, "wb"
+        ) as destino:
+            mapa = mapear_leitura(origem)
+            try:
+                for i in range(0, len(self.offsets), 2):
+                    inicio, tamanho = self.offsets[i], self.offsets[i + 1]
+                    self.offsets[i] = posicao if tamanho else 0
+                    if tamanho:
+                        destino.write(mapa[inicio : inicio + tamanho])
+                        posicao += tamanho
+            finally:
+                if isinstance(mapa, mmap.mmap):
+                    mapa.close()
+
+    @property
+    def total(self) -> int:
+        return 0 if self.index is None else int(self.index.ntotal)
+
+    def iniciar(self, index: faiss.Index) -> None:
+        self.index = envolver_ids(index)
+
+    def remover(self, ids: Iterable[int]) -> None:
+        ids = np.fromiter(ids, dtype=np.int64)
+        if not len(ids) or self.index is None:
+            return
+        self.index.remove_ids(ids)
+        for id_vetor in ids.tolist():
+            self.offsets[2 * id_vetor + 1] = 0
+
+    def _codificar(self, trechos: List[Dict[str, Any]]) -> List[bytes]:
+        if self.dicionario is None:
+            return [
+                json.dumps(trecho, ensure_ascii=False).encode("utf-8")
+                for trecho in trechos
+            ]
+        blocos = []
+        for trecho in trechos:
+            for coluna in COLUNAS_METADADOS:
+                codigos = self._codigos[coluna]
+                valor = trecho[coluna]
+                if valor not in codigos:
+                    codigos[valor] = len(self.tabelas[coluna])
+                    self.tabelas[coluna].append(valor)
+                self.colunas.append(codigos[valor])
+            resto = {c: v for c, v in trecho.items() if c not in COLUNAS_METADADOS}
+            blocos.append(json.dumps(resto, ensure_ascii=False).encode("utf-8"))
+        if not self.dicionario:
+            self.dicionario = treinar_dicionario(blocos)
+            self.nome_dicionario = f"dicionario-{self.versao}.bin"
+            (self.pasta_indice / self.nome_dicionario).write_bytes(self.dicionario)
+        return [comprimir_bloco(bloco, self.dicionario) for bloco in blocos]
+
+    def adicionar(
+        self, trechos: List[Dict[str, Any]], vetores: np.ndarray
+    ) -> List[int]:
+        primeiro = len(self.offsets) // 2
+        ids = list(range(primeiro, primeiro + len(trechos)))
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        with medir("comprimir_trechos"):
+            blocos = self._codificar(trechos)
+        self._abrir()
+        for bloco in blocos:
+            self.offsets.extend((self._posicao, len(bloco)))
+            self._posicao += len(bloco)
+        self._arquivo.write(b"".join(blocos))
+        if self._exatos is not None:
+            # Linha i do arquivo e o vetor do id i, como nos offsets.
+            self._exatos.write(vetores.tobytes())
+        self.index.add_with_ids(vetores, np.asarray(ids, dtype=np.int64))
+        return ids
+
+    def salvar(
+        self, config: Dict[str, Any], manifesto: Dict[str, Any] | None = None
+    ) -> Dict[str, Any]:
+        self._abrir()
+        self.descartar()
+        arquivos = {
+            "vetores": f"vetores-{self.versao}.faiss",
+            "offsets": f"trechos-{self.versao}.idx",
+            "trechos": self.nome_trechos,
+        }
+        if self.nome_exatos:
+            arquivos["exatos"] = self.nome_exatos
+        faiss.write_index(self.index, str(self.pasta_indice / arquivos["vetores"]))
+        (self.pasta_indice / arquivos["offsets"]).write_bytes(self.offsets.tobytes())
+        if self.dicionario:
+            arquivos.update(
+                dicionario=self.nome_dicionario,
+                metadados=f"metadados-{self.versao}.i32",
+                tabelas=f"metadados-{self.versao}.json",
+            )
+            caminho = self.pasta_indice / arquivos["metadados"]
+            caminho.write_bytes(self.colunas.tobytes())
+            salvar_json(self.pasta_indice / arquivos["tabelas"], self.tabelas)
+        textos = (
+            (id_vetor, f"{trecho['titulo']}\n{trecho['texto']}")
+            for id_vetor, trecho in iterar_trechos(self.pasta_indice, arquivos)
+        )
+        with medir("construir_bm25"):
+            arquivos.update(
+                construir_lexico(
+                    self.pasta_indice, self.versao, textos, len(self.offsets) // 2
+                )
+            )
+
+        config = dict(config, formato=FORMATO, versao=self.versao, arquivos=arquivos)
+        if manifesto is not None:
+            manifesto = dict(manifesto, versao=self.versao)
+            salvar_json(self.pasta_indice / ARQUIVO_MANIFESTO, manifesto)
+        # config.json e o ponto de troca: leitores so veem a versao nova a partir daqui.
+        salvar_json(self.pasta_indice / ARQUIVO_CONFIG, config)
+        limpar_versoes_antigas(self.pasta_indice, arquivos.values())
+        return config
+
+    def descartar(self) -> None:
+        for arquivo in (self._arquivo, self._exatos):
+            if arquivo is not None:
+                arquivo.close()
+
+
+def limpar_versoes_antigas(pasta_indice: Path, em_uso: Iterable[str]) -> None:
+    em_uso = set(em_uso)
+    for caminho in pasta_indice.iterdir():
+        if caminho.name in em_uso:
+            continue
+        if not caminho.name.startswith(PREFIXOS_VERSIONADOS):
+            continue
+        try:
+            caminho.unlink()
+        except OSError:
+            # Outro processo ainda mapeia o arquivo (Windows); fica para a proxima.
+            pass
+
+
+def converter_legado(pasta_indice: Path, embeddings: Embeddings) -> Dict[str, Any]:
+    from langchain_community.vectorstores import FAISS
+
+    legado = FAISS.load_local(
+        str(pasta_indice), embeddings, allow_dangerous_deserialization=True
+    )
+    try:
+        faiss.extract_index_ivf(legado.index).make_direct_map()
+    except RuntimeError:
+        pass
+    escritor = EscritorIndice(pasta_indice, None)
+    escritor.iniciar(faiss.IndexFlatL2(legado.index.d))
+    total = legado.index.ntotal
+    for inicio in range(0, total, 1024):
+        fim = min(inicio + 1024, total)
+        trechos = []
+        for posicao in range(inicio, fim):
+            doc = legado.docstore.search(legado.index_to_docstore_id[posicao])
+            trechos.append(
+                {
+                    "id": doc.metadata.get("id", ""),
+                    "arquivo": doc.metadata.get("arquivo", "desconhecido"),
+                    "titulo": doc.metadata.get("titulo", "Sem titulo"),
+                    "texto": doc.page_content,
+                }
+            )
+        escritor.adicionar(trechos, legado.index.reconstruct_n(inicio, fim - inicio))
+
+    config = ler_config(pasta_indice)
+    config.update(tipo_indice="flat", total_trechos=total)
+    return escritor.salvar(config)
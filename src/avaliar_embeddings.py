@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from armazenamento import iterar_trechos, ler_config
+from cache_embeddings import criar_modelo_embeddings
+from embeddings_onnx import EmbeddingsOnnx
+
+
+def carregar_textos(pasta_indice: Path, amostras: int) -> List[str]:
+    trechos = iterar_trechos(pasta_indice, ler_config(pasta_indice)["arquivos"])
+    return [trecho["texto"] for _, trecho in islice(trechos, amostras)]
+
+
+def normalizar(vetores: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores / np.clip(normas, 1e-12, None)
+
+
+def vizinhos(vetores: np.ndarray, k: int) -> np.ndarray:
+    similaridades = vetores @ vetores.T
+    np.fill_diagonal(similaridades, -np.inf)
+    return np.argsort(-similaridades, axis=1)[:, :k]
+
+
+def medir_backend(modelo: Any, textos: List[str], consultas: int) -> Dict[str, Any]:
+    modelo.embed_query(textos[0])
+    inicio = time.perf_counter()
+    vetores = normalizar(np.asarray(modelo.embed_documents(textos), dtype=np.float32))
+    duracao = time.perf_counter() - inicio
+    tempos = []
+    for texto in textos[:consultas]:
+        inicio = time.perf_counter()
+        modelo.embed_query(texto[:200])
+        tempos.append(time.perf_counter() - inicio)
+    return {
+        "vetores": vetores,
+        "docs_por_seg": round(len(textos) / max(duracao, 1e-9), 1),
+        "consulta_p50_ms": round(1000 * float(np.median(tempos)), 2),
+    }
+
+
+def avaliar(
+    modelo: str, textos: List[str], threads: int, k: int, consultas: int
+) -> List[Dict[str, Any]]:
+    backends = {
+        "torch": lambda: criar_modelo_embeddings(modelo, "torch"),
+        "onnx_fp32": lambda: EmbeddingsOnnx(modelo, threads, quantizar=False),
+        "onnx_int8": lambda: EmbeddingsOnnx(modelo, threads, quantizar=True),
+    }
+    linhas = []
+    referencia: Dict[str, Any] = {}
+    for nome, criar in backends.items():
+        inicio = time.perf_counter()
+        resultado = medir_backend(criar(), textos, consultas)
+        carga = time.perf_counter() - inicio
+        vetores = resultado.pop("vetores")
+        if not referencia:
+            referencia = {"vetores": vetores, "vizinhos": vizinhos(vetores, k)}
+        # Deriva do cosseno contra os vetores do PyTorch para o mesmo texto.
+        cossenos = np.sum(vetores * referencia["vetores"], axis=1)
+        proximos = vizinhos(vetores, k)
+        iguais = sum(
+            len(set(a.tolist()) & set(b.tolist()))
+            for a, b in zip(proximos, referencia["vizinhos"])
+        )
+        linhas.append(
+            {
+                "backend": nome,
+                "carga_e_medicao_seg": round(carga, 2),
+                **resultado,
+                "cosseno_medio": round(float(np.mean(cossenos)), 5),
+                "cosseno_minimo": round(float(np.min(cossenos)), 5),
+                f"vizinhos@{k}": round(iguais / max(proximos.size, 1), 4),
+            }
+        )
+    return linhas
+
+
+def imprimir(linhas: List[Dict[str, Any]]) -> None:
+    if not linhas:
+        return
+    colunas = list(linhas[0].keys())
+    print(" | ".join(colunas))
+    for linha in linhas:
+        print(" | ".join(str(linha[c]) for c in colunas))
+
+
+def ler_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Paridade e velocidade dos backends de embeddings (PyTorch x ONNX)"
+    )
+    parser.add_argument("--index-dir", default="index", help="Pasta do indice")
+    parser.add_argument(
+        "--model",
+        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        help="Modelo de embeddings",
+    )
+    parser.add_argument("--amostras", type=int, default=512)
+    parser.add_argument("--consultas", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--saida", default="", help="Arquivo JSON com o relatorio")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = ler_args()
+    textos = carregar_textos(Path(args.index_dir), args.amostras)
+    linhas = avaliar(args.model, textos, args.threads, args.k, args.consultas)
+    imprimir(linhas)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(linhas, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cache_embeddings import carregar_tokenizador
+from extracao import extrair_texto
+from indexar import iterar_documentos
+from texto_utils import (
+    LOTE_TOKENIZACAO,
+    fatiar_secoes,
+    fatiar_secoes_tokens,
+    limpar_texto,
+    separar_secoes,
+)
+
+
+# Fatiamento anterior, mantido so como referencia de saida e de tempo.
+def separar_secoes_original(texto: str) -> List[Tuple[str, str]]:
+    linhas = [linha.strip() for linha in texto.split("\n")]
+    secoes: List[Tuple[str, str]] = []
+    titulo_atual = "Sem titulo"
+    linhas_atuais: List[str] = []
+
+    def flush():
+        nonlocal linhas_atuais
+        conteudo = "\n".join([l for l in linhas_atuais if l])
+        if conteudo:
+            secoes.append((titulo_atual, conteudo))
+        linhas_atuais = []
+
+    heading_re = re.compile(r"^(clausula|capitulo|secao|titulo)\b", re.IGNORECASE)
+
+    for linha in linhas:
+        if not linha:
+            linhas_atuais.append("")
+            continue
+        e_titulo = bool(heading_re.match(linha)) or (
+            len(linha) <= 80 and linha.isupper()
+        )
+        if e_titulo:
+            flush()
+            titulo_atual = linha
+        else:
+            linhas_atuais.append(linha)
+
+    flush()
+    return secoes or [("Sem titulo", texto)]
+
+
+def fatiar_secoes_original(
+    secoes: List[Tuple[str, str]],
+    max_caracteres: int = 1200,
+    sobreposicao: int = 200,
+) -> List[dict]:
+    chunks: List[dict] = []
+    buffer = ""
+    buffer_titulo = ""
+
+    def flush():
+        nonlocal buffer
+        if buffer.strip():
+            chunks.append(
+                {"title": buffer_titulo or "Sem titulo", "text": buffer.strip()}
+            )
+            if sobreposicao > 0 and len(buffer) > sobreposicao:
+                buffer = buffer[-sobreposicao:]
+            else:
+                buffer = ""
+
+    for titulo, conteudo in secoes:
+        paragrafos = [p.strip() for p in re.split(r"\n{2,}", conteudo) if p.strip()]
+        for p in paragrafos:
+            candidato = (buffer + "\n\n" + p).strip() if buffer else p
+            if len(candidato) > max_caracteres:
+                flush()
+                if len(p) > max_caracteres:
+                    for i in range(0, len(p), max_caracteres - sobreposicao):
+                        parte = p[i : i + max_caracteres]
+                        chunks.append({"title": titulo, "text": parte})
+                    buffer = ""
+                else:
+                    buffer = p
+                    buffer_titulo = titulo
+            else:
+                buffer = candidato
+                buffer_titulo = titulo
+
+    flush()
+    return chunks
+
+
+def carregar_textos(pasta_entrada: Path) -> Tuple[List[str], List[Dict[str, str]]]:
+    textos, falhas = [], []
+    for caminho in iterar_documentos(pasta_entrada):
+        try:
+            textos.append(limpar_texto(extrair_texto(caminho)))
+        except Exception as exc:
+            falhas.append({"arquivo": caminho.name, "erro": str(exc)})
+    return textos, falhas
+
+
+def cronometrar_fatiamento(
+    textos: List[str], fatiar: Callable[[str], List[dict]], repeticoes: int
+) -> Tuple[float, List[List[dict]]]:
+    melhor = float("inf")
+    resultados: List[List[dict]] = []
+    for _ in range(max(repeticoes, 1)):
+        inicio = time.perf_counter()
+        resultados = [fatiar(texto) for texto in textos]
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultados
+
+
+def corta_palavra(texto: str, trecho: str) -> bool:
+    posicao = texto.find(trecho)
+    if posicao < 0:
+        return False
+    fim = posicao + len(trecho)
+    return fim < len(texto) and trecho[-1:].isalnum() and texto[fim].isalnum()
+
+
+def contar_tokens(tokenizador: Any, textos: List[str]) -> List[int]:
+    contagens: List[int] = []
+    for inicio in range(0, len(textos), LOTE_TOKENIZACAO):
+        codificado = tokenizador(
+            textos[inicio : inicio + LOTE_TOKENIZACAO],
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        contagens.extend(len(ids) for ids in codificado["input_ids"])
+    return contagens
+
+
+def avaliar(
+    textos: List[str],
+    max_caracteres: int,
+    sobreposicao: int,
+    repeticoes: int,
+    tokenizador: Optional[Any] = None,
+    limite_tokens: int = 0,
+    max_tokens: int = 0,
+    sobreposicao_tokens: int = 0,
+) -> List[Dict[str, Any]]:
+    fatiadores: Dict[str, Callable[[str], List[dict]]] = {
+        "original": lambda texto: fatiar_secoes_original(
+            separar_secoes_original(texto), max_caracteres, sobreposicao
+        ),
+        "compativel": lambda texto: fatiar_secoes(
+            separar_secoes(texto), max_caracteres, sobreposicao, "compativel"
+        ),
+        "frases": lambda texto: fatiar_secoes(
+            separar_secoes(texto), max_caracteres, sobreposicao, "frases"
+        ),
+    }
+    if tokenizador is not None and max_tokens > 0:
+        fatiadores["tokens"] = lambda texto: fatiar_secoes_tokens(
+            separar_secoes(texto), tokenizador, max_tokens, sobreposicao_tokens
+        )
+    caracteres = sum(len(texto) for texto in textos)
+    referencia: List[List[dict]] = []
+    linhas = []
+    for nome, fatiar in fatiadores.items():
+        duracao, resultados = cronometrar_fatiamento(textos, fatiar, repeticoes)
+        if nome == "original":
+            referencia = resultados
+        trechos = [trecho for resultado in resultados for trecho in resultado]
+        cortes = sum(
+            corta_palavra(texto, trecho["text"])
+            for texto, resultado in zip(textos, resultados)
+            for trecho in resultado
+        )
+        linha: Dict[str, Any] = {}
+        if tokenizador is not None:
+            # Tokens alem do limite do modelo sao cortados no embedding.
+            contagens = contar_tokens(tokenizador, [t["text"] for t in trechos])
+            linha["tokens_truncados_pct"] = round(
+                100
+                * sum(max(0, n - limite_tokens) for n in contagens)
+                / max(sum(contagens), 1),
+                1,
+            )
+        linhas.append(
+            {
+                "modo": nome,
+                "segundos": round(duracao, 4),
+                "mb_por_seg": round(caracteres / max(duracao, 1e-9) / 1e6, 2),
+                "trechos": len(trechos),
+                "media_caracteres": round(
+                    sum(len(t["text"]) for t in trechos) / max(len(trechos), 1), 1
+                ),
+                "cortes_no_meio_da_palavra": cortes,
+                "igual_ao_original": resultados == referencia,
+                **linha,
+            }
+        )
+    return linhas
+
+
+def imprimir(linhas: List[Dict[str, Any]]) -> None:
+    if not linhas:
+        return
+    colunas = list(linhas[0].keys())
+    print(" | ".join(colunas))
+    for linha in linhas:
+        print(" | ".join(str(linha[c]) for c in colunas))
+
+
+def ler_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmark do fatiamento de documentos em trechos"
+    )
+    parser.add_argument("--input", default="data/raw", help="Pasta com .doc/.docx")
+    parser.add_argument("--max-caracteres", type=int, default=1200)
+    parser.add_argument("--sobreposicao", type=int, default=200)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument(
+        "--model",
+        default="",
+        help="Modelo de embeddings; mede tokens truncados e o fatiamento por tokens",
+    )
+    parser.add_argument("--max-tokens", type=int, default=0)
+    parser.add_argument("--sobreposicao-tokens", type=int, default=16)
+    parser.add_argument("--saida", default="", help="Arquivo JSON com o relatorio")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = ler_args()
+    textos, falhas = carregar_textos(Path(args.input))
+    for falha in falhas:
+        print(f"Falha ao ler {falha['arquivo']}: {falha['erro']}")
+    print(f"{len(textos)} documentos, {sum(len(t) for t in textos)} caracteres")
+    tokenizador, limite = carregar_tokenizador(args.model) if args.model else (None, 0)
+    linhas = avaliar(
+        textos,
+        args.max_caracteres,
+        args.sobreposicao,
+        args.repeticoes,
+        tokenizador,
+        limite,
+        min(args.max_tokens or limite, limite),
+        args.sobreposicao_tokens,
+    )
+    imprimir(linhas)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(linhas, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from armazenamento import ler_config, mapear_array, repontuar_exato
+from indexar import criar_indice_faiss, vetores_comprimidos
+from opcoes import PARAMETROS_INDICE, adicionar_args_indice, parametros_dos_args
+from particoes import fundir_vetores, obter_executor
+from servico_busca import aplicar_parametros_busca
+
+VARREDURA = {
+    "flat": [None],
+    "ivf": [1, 2, 4, 8, 16, 32, 64],
+    "ivfpq": [1, 2, 4, 8, 16, 32, 64],
+    "hnsw": [16, 32, 64, 128, 256],
+}
+
+
+def carregar_vetores(pasta_indice: Path) -> np.ndarray:
+    config = ler_config(pasta_indice)
+    arquivos = config["arquivos"]
+    offsets = np.fromfile(pasta_indice / arquivos["offsets"], dtype=np.int64)
+    ids = np.flatnonzero(offsets.reshape(-1, 2)[:, 1] > 0)
+    if "exatos" in arquivos:
+        # Vetores comprimidos reconstruiriam aproximados; a copia float32 e exata.
+        index = faiss.read_index(str(pasta_indice / arquivos["vetores"]))
+        exatos = mapear_array(pasta_indice / arquivos["exatos"], np.float32, index.d)
+        return np.ascontiguousarray(exatos[ids])
+    index = faiss.read_index(str(pasta_indice / arquivos["vetores"]))
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    except RuntimeError:
+        pass
+    return index.reconstruct_batch(ids)
+
+
+def buscar(
+    index: faiss.Index,
+    consultas: np.ndarray,
+    k: int,
+    exatos: np.ndarray | None = None,
+    repontuar: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    if exatos is not None and repontuar > 1:
+        _, candidatos = index.search(consultas, k * repontuar)
+        return repontuar_exato(consultas, candidatos, exatos, k)
+    return index.search(consultas, k)
+
+
+def particionar(
+    tipo: str,
+    parametros: Dict[str, int],
+    vetores: np.ndarray,
+    codificacao: str,
+    shards: int,
+) -> Tuple[List[faiss.Index], List[int]]:
+    # Fatias contiguas: os vetores seguem a ordem dos documentos no indice.
+    partes = np.array_split(vetores, shards)
+    deslocamentos = np.cumsum([0] + [len(parte) for parte in partes[:-1]]).tolist()
+    indices = []
+    for parte in partes:
+        index = criar_indice_faiss(tipo, parametros, parte, codificacao)
+        index.add(parte)
+        indices.append(index)
+    return indices, deslocamentos
+
+
+def medir(
+    indices: List[faiss.Index],
+    consultas: np.ndarray,
+    k: int,
+    exatos: np.ndarray | None = None,
+    repontuar: int = 0,
+    deslocamentos: List[int] | None = None,
+) -> Tuple[np.ndarray, List[float]]:
+    deslocamentos = deslocamentos or [0]
+    fins = deslocamentos[1:] + [None]
+    partes = [
+        None if exatos is None else exatos[inicio:fim]
+        for inicio, fim in zip(deslocamentos, fins)
+    ]
+    executor = obter_executor()
+    rotulos = np.empty((len(consultas), k), dtype=np.int64)
+    tempos = []
+    for i, consulta in enumerate(consultas):
+        inicio = time.perf_counter()
+        if len(indices) == 1:
+            _, encontrados = buscar(indices[0], consulta[None, :], k, exatos, repontuar)
+        else:
+            futuros = [
+                executor.submit(buscar, index, consulta[None, :], k, parte, repontuar)
+                for index, parte in zip(indices, partes)
+            ]
+            _, encontrados = fundir_vetores(
+                [futuro.result() for futuro in futuros], deslocamentos, k
+            )
+        tempos.append(time.perf_counter() - inicio)
+        rotulos[i] = encontrados[0]
+    return rotulos, tempos
+
+
+def recall(aproximado: np.ndarray, exato: np.ndarray) -> float:
+    acertos = sum(
+        len(set(a[a >= 0].tolist()) & set(e.tolist()))
+        for a, e in zip(aproximado, exato)
+    )
+    return acertos / exato.size
+
+
+def avaliar(
+    vetores: np.ndarray,
+    consultas: np.ndarray,
+    tipos: List[str],
+    parametros: Dict[str, int],
+    k: int,
+    codificacoes: List[str],
+    particoes: List[int] | None = None,
+) -> List[Dict[str, Any]]:
+    referencia = faiss.IndexFlatL2(vetores.shape[1])
+    referencia.add(vetores)
+    exato, _ = medir([referencia], consultas, k)
+
+    linhas = []
+    combinacoes = [
+        (tipo, codificacao, shards)
+        for tipo in tipos
+        for codificacao in (["float32"] if tipo == "ivfpq" else codificacoes)
+        for shards in particoes or [1]
+    ]
+    for tipo, codificacao, shards in combinacoes:
+        inicio = time.perf_counter()
+        indices, deslocamentos = particionar(
+            tipo, parametros, vetores, codificacao, shards
+        )
+        construcao = time.perf_counter() - inicio
+        tamanho = sum(
+            faiss.serialize_index(index).nbytes for index in indices
+        ) / max(len(vetores), 1)
+        repontuacoes = [0]
+        if vetores_comprimidos(tipo, codificacao) and parametros["repontuar"] > 1:
+            repontuacoes.append(parametros["repontuar"])
+        for valor in VARREDURA[tipo]:
+            ajustes = dict(parametros)
+            if tipo in ("ivf", "ivfpq"):
+                ajustes["nprobe"] = valor
+            elif tipo == "hnsw":
+                ajustes["ef_search"] = valor
+            for index in indices:
+                aplicar_parametros_busca(index, tipo, ajustes)
+            for repontuar in repontuacoes:
+                aproximado, tempos = medir(
+                    indices, consultas, k, vetores, repontuar, deslocamentos
+                )
+                tempos_ms = 1000 * np.asarray(tempos)
+                linhas.append(
+                    {
+                        "tipo": tipo,
+                        "codificacao": codificacao,
+                        "shards": shards,
+                        "parametro": valor,
+                        "repontuar": repontuar,
+                        f"recall@{k}": round(recall(aproximado, exato), 4),
+                        "latencia_media_ms": round(float(np.mean(tempos_ms)), 3),
+                        "latencia_p50_ms": round(
+                            float(np.percentile(tempos_ms, 50)), 3
+                        ),
+                        "latencia_p95_ms": round(
+                            float(np.percentile(tempos_ms, 95)), 3
+                        ),
+                        "construcao_seg": round(construcao, 3),
+                        # Residente por worker; a copia float32 fica so em disco.
+                        "bytes_por_vetor": round(tamanho, 1),
+                    }
+                )
+    return linhas
+
+
+def imprimir(linhas: List[Dict[str, Any]]) -> None:
+    if not linhas:
+        return
+    colunas = list(linhas[0].keys())
+    print(" | ".join(colunas))
+    for linha in linhas:
+        print(" | ".join(str(linha[c]) for c in colunas))
+
+
+def ler_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Relatorio recall x latencia dos tipos de indice contra o flat"
+    )
+    parser.add_argument("--index-dir", default="index", help="Pasta do indice")
+    parser.add_argument(
+        "--tipos",
+        default="flat,ivf,hnsw,ivfpq",
+        help="Tipos de indice avaliados, separados por virgula",
+    )
+    parser.add_argument(
+        "--codificacoes",
+        default="float32",
+        help="Codificacoes dos vetores (float32,float16,sq8), separadas por virgula",
+    )
+    parser.add_argument(
+        "--shards",
+        default="1",
+        help="Numeros de particoes buscadas em paralelo, separados por virgula",
+    )
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--saida", default="", help="Arquivo JSON com o relatorio")
+    adicionar_args_indice(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = ler_args()
+    vetores = carregar_vetores(Path(args.index_dir))
+    rng = np.random.default_rng(0)
+    total = min(args.consultas, len(vetores))
+    amostra = rng.choice(len(vetores), size=total, replace=False)
+    ruido = rng.normal(scale=0.01, size=(len(amostra), vetores.shape[1]))
+    consultas = (vetores[amostra] + ruido).astype(np.float32)
+
+    parametros = dict(PARAMETROS_INDICE, **parametros_dos_args(args))
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    codificacoes = [c.strip() for c in args.codificacoes.split(",") if c.strip()]
+    particoes = [int(n) for n in args.shards.split(",") if n.strip()]
+    linhas = avaliar(
+        vetores, consultas, tipos, parametros, args.k, codificacoes, particoes
+    )
+    imprimir(linhas)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(linhas, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,77 @@
 from __future__ import annotations
 
 import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 from pathlib import Path
+from typing import Dict, List
+
+import requests
 
 from configuracao import carregar_propriedades
-from drive_api import baixar_arquivo, extrair_id_pasta, listar_arquivos_pasta
+from drive_api import (
+    baixar_para_arquivo,
+    criar_sessao,
+    extrair_id_pasta,
+    listar_arquivos_pasta,
+    md5_arquivo,
+)
 from observabilidade import registrar_evento
 
 
-def baixar_pasta_drive(url_pasta: str, pasta_saida: Path) -> None:
+def data_modificacao(item: Dict[str, str]) -> float | None:
+    valor = item.get("modifiedTime", "")
+    if not valor:
+        return None
+    return datetime.fromisoformat(valor.replace("Z", "+00:00")).timestamp()
+
+
+def arquivo_atualizado(destino: Path, item: Dict[str, str]) -> bool:
+    if not destino.exists():
+        return False
+    stat = destino.stat()
+    if item.get("size") and int(item["size"]) != stat.st_size:
+        return False
+    if item.get("md5Checksum"):
+        return md5_arquivo(destino) == item["md5Checksum"]
+    modificado = data_modificacao(item)
+    if modificado is not None:
+        return abs(stat.st_mtime - modificado) < 1
+    return False
+
+
+def baixar_item(
+    item: Dict[str, str], destino: Path, sessao: requests.Session
+) -> int:
+    tamanho = baixar_para_arquivo(item, destino, sessao)
+    modificado = data_modificacao(item)
+    if modificado is not None:
+        # Guarda o modifiedTime do Drive para pular o arquivo na proxima execucao.
+        os.utime(destino, (modificado, modificado))
+    return tamanho
+
+
+def baixar_pasta_drive(url_pasta: str, pasta_saida: Path, workers: int = 8) -> None:
+    inicio = time.time()
     pasta_saida.mkdir(parents=True, exist_ok=True)
     pasta_id = extrair_id_pasta(url_pasta)
-    arquivos = listar_arquivos_pasta(pasta_id)
+    sessao = criar_sessao(conexoes=max(workers, 1))
+    arquivos = listar_arquivos_pasta(pasta_id, sessao)
 
     registrar_evento(
         "download_inicio",
         url_pasta=url_pasta,
         pasta_saida=str(pasta_saida),
         total=len(arquivos),
+        workers=workers,
     )
 
+    # O Drive aceita arquivos com o mesmo nome na pasta; como todos iriam para o
+    # mesmo destino, fica so o modificado por ultimo.
+    por_destino: Dict[Path, Dict[str, str]] = {}
+    duplicados: List[str] = []
     for item in arquivos:
         nome = item.get("name", "")
         arquivo_id = item.get("id", "")
@@ -29,20 +81,61 @@ def baixar_pasta_drive(url_pasta: str, pasta_saida: Path) -> None:
         if extensao not in {".doc", ".docx"}:
             continue
         destino = pasta_saida / nome
-        conteudo = baixar_arquivo(arquivo_id)
-        destino.write_bytes(conteudo)
+        anterior = por_destino.get(destino)
+        if anterior is not None:
+            duplicados.append(nome)
+            if anterior.get("modifiedTime", "") >= item.get("modifiedTime", ""):
+                continue
+        por_destino[destino] = item
+    if duplicados:
+        registrar_evento(
+            "download_duplicados", url_pasta=url_pasta, arquivos=sorted(duplicados)
+        )
+
+    pendentes = []
+    ignorados = 0
+    for destino, item in por_destino.items():
+        if arquivo_atualizado(destino, item):
+            ignorados += 1
+            continue
+        pendentes.append((item, destino))
+
+    baixados = 0
+    total_bytes = 0
+    falhas: List[Dict[str, str]] = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futuros = {
+            executor.submit(baixar_item, item, destino, sessao): item
+            for item, destino in pendentes
+        }
+        for futuro in as_completed(futuros):
+            item = futuros[futuro]
+            try:
+                total_bytes += futuro.result()
+                baixados += 1
+            except Exception as exc:
+                falhas.append({"arquivo": item["name"], "erro": str(exc)})
 
     registrar_evento(
         "download_fim",
         url_pasta=url_pasta,
         pasta_saida=str(pasta_saida),
+        baixados=baixados,
+        ignorados=ignorados,
+        bytes=total_bytes,
+        duracao_seg=round(time.time() - inicio, 3),
     )
+    if falhas:
+        registrar_evento("download_falhas", url_pasta=url_pasta, falhas=falhas)
 
 
 def ler_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Baixar documentos do Drive")
     parser.add_argument("--folder-url", default="", help="URL da pasta do Drive")
     parser.add_argument("--output", default="data/raw", help="Pasta de destino")
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Downloads simultaneos"
+    )
     return parser.parse_args()
 
 
@@ -52,7 +145,7 @@ def main() -> None:
     url_pasta = args.folder_url.strip() or propriedades.get("DRIVE_URL", "").strip()
     if not url_pasta:
         raise RuntimeError("DRIVE_URL nao configurada em config.properties.")
-    baixar_pasta_drive(url_pasta, Path(args.output))
+    baixar_pasta_drive(url_pasta, Path(args.output), args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import json
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from texto_utils import tokenizar
+
+K1 = 1.2
+B = 0.75
+K_RRF = 60
+
+
+def nomes_lexico(versao: str) -> Dict[str, str]:
+    return {
+        "lexico_termos": f"lexico-{versao}.json",
+        "lexico_inicios": f"lexico-{versao}-inicios.npy",
+        "lexico_docs": f"lexico-{versao}-docs.npy",
+        "lexico_pesos": f"lexico-{versao}-pesos.npy",
+    }
+
+
+def calcular_idf(df: Any, docs_validos: int) -> Any:
+    return np.log1p((docs_validos - df + 0.5) / (df + 0.5))
+
+
+def construir_lexico(
+    pasta_indice: Path,
+    versao: str,
+    textos: Iterable[Tuple[int, str]],
+    total_ids: int,
+) -> Dict[str, str]:
+    termos: Dict[str, int] = {}
+    ids_termo = array("i")
+    ids_doc = array("i")
+    frequencias = array("f")
+    comprimentos = np.zeros(total_ids, dtype=np.float32)
+    for id_vetor, texto in textos:
+        contagem = Counter(tokenizar(texto))
+        comprimentos[id_vetor] = sum(contagem.values())
+        for termo, frequencia in contagem.items():
+            ids_termo.append(termos.setdefault(termo, len(termos)))
+            ids_doc.append(id_vetor)
+            frequencias.append(frequencia)
+
+    ids_termo = np.frombuffer(ids_termo, dtype=np.int32)
+    ids_doc = np.frombuffer(ids_doc, dtype=np.int32)
+    frequencias = np.frombuffer(frequencias, dtype=np.float32)
+    docs_validos = max(int(np.count_nonzero(comprimentos)), 1)
+    media = float(comprimentos.sum()) / docs_validos or 1.0
+
+    # O peso BM25 de cada par termo/trecho ja sai pronto; a consulta so soma.
+    df = np.bincount(ids_termo, minlength=len(termos))
+    idf = calcular_idf(df, docs_validos).astype(np.float32)
+    normalizacao = K1 * (1 - B + B * comprimentos[ids_doc] / media)
+    pesos = idf[ids_termo] * frequencias * (K1 + 1) / (frequencias + normalizacao)
+
+    ordem = np.lexsort((ids_doc, ids_termo))
+    inicios = np.zeros(len(termos) + 1, dtype=np.int64)
+    np.cumsum(df, out=inicios[1:])
+
+    nomes = nomes_lexico(versao)
+    (pasta_indice / nomes["lexico_termos"]).write_text(
+        json.dumps(
+            {"total_ids": total_ids, "docs_validos": docs_validos, "termos": termos},
+            ensure_ascii=True,
+        ),
+        encoding="utf-8",
+    )
+    np.save(pasta_indice / nomes["lexico_inicios"], inicios)
+    np.save(pasta_indice / nomes["lexico_docs"], ids_doc[ordem])
+    # float16 basta para somar notas BM25; a soma em bincount e feita em float64.
+    np.save(pasta_indice / nomes["lexico_pesos"], pesos[ordem].astype(np.float16))
+    return nomes
+
+
+class IndiceLexico:
+    def __init__(self, pasta_indice: Path, arquivos: Dict[str, str]) -> None:
+        caminho_termos = pasta_indice / arquivos["lexico_termos"]
+        dados = json.loads(caminho_termos.read_text(encoding="utf-8"))
+        self.termos: Dict[str, int] = dados["termos"]
+        self.total_ids = int(dados["total_ids"])
+        self.docs_validos = int(dados.get("docs_validos", self.total_ids))
+        self.inicios = np.load(pasta_indice / arquivos["lexico_inicios"])
+        self.docs = np.load(pasta_indice / arquivos["lexico_docs"], mmap_mode="r")
+        self.pesos = np.load(pasta_indice / arquivos["lexico_pesos"], mmap_mode="r")
+
+    def frequencias(self, termos: Iterable[str]) -> Dict[str, int]:
+        return {
+            termo: int(self.inicios[i + 1] - self.inicios[i])
+            for termo, i in ((t, self.termos.get(t)) for t in termos)
+            if i is not None
+        }
+
+    def pontuar(
+        self, consulta: str, idf: Dict[str, float] | None = None
+    ) -> np.ndarray:
+        termos = {t: self.termos[t] for t in tokenizar(consulta) if t in self.termos}
+        if not termos:
+            return np.zeros(self.total_ids, dtype=np.float64)
+        fatias = [slice(self.inicios[i], self.inicios[i + 1]) for i in termos.values()]
+        docs = np.concatenate([self.docs[f] for f in fatias])
+        pesos = np.concatenate([self.pesos[f] for f in fatias])
+        if idf is not None:
+            # Troca o IDF desta particao pelo IDF do conjunto, termo a termo.
+            tamanhos = [f.stop - f.start for f in fatias]
+            escalas = [
+                idf[termo] / calcular_idf(tamanho, self.docs_validos)
+                for termo, tamanho in zip(termos, tamanhos)
+            ]
+            pesos = pesos * np.repeat(escalas, tamanhos)
+        return np.bincount(docs, weights=pesos, minlength=self.total_ids)
+
+    def buscar_notas(
+        self, consulta: str, limite: int, idf: Dict[str, float] | None = None
+    ) -> Tuple[List[int], List[float]]:
+        pontos = self.pontuar(consulta, idf)
+        candidatos = np.flatnonzero(pontos)
+        if len(candidatos) > limite:
+            melhores = np.argpartition(-pontos[candidatos], limite - 1)[:limite]
+            candidatos = candidatos[melhores]
+        ordem = candidatos[np.argsort(-pontos[candidatos], kind="stable")]
+        return ordem.tolist(), pontos[ordem].tolist()
+
+    def buscar(self, consulta: str, limite: int) -> List[int]:
+        return self.buscar_notas(consulta, limite)[0]
+
+
+def idf_conjunto(lexicos: Sequence[IndiceLexico], consulta: str) -> Dict[str, float]:
+    # Frequencias somadas entre particoes: as notas BM25 ficam comparaveis na fusao.
+    termos = set(tokenizar(consulta))
+    docs_validos = sum(lexico.docs_validos for lexico in lexicos)
+    df: Counter = Counter()
+    for lexico in lexicos:
+        df.update(lexico.frequencias(termos))
+    return {termo: float(calcular_idf(n, docs_validos)) for termo, n in df.items()}
+
+
+def fundir_rrf(listas: Sequence[Sequence[int]], limite: int) -> List[int]:
+    pontos: Dict[int, float] = {}
+    for lista in listas:
+        for posicao, id_vetor in enumerate(lista):
+            pontos[id_vetor] = pontos.get(id_vetor, 0.0) + 1.0 / (K_RRF + posicao + 1)
+    return sorted(pontos, key=lambda i: -pontos[i])[:limite]
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import re
+import threading
+import unicodedata
+from pathlib import Path
+from functools import lru_cache, partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metricas import incrementar, medir
+from observabilidade import registrar_evento
+from opcoes import BACKENDS_EMBEDDINGS
+
+PASTA_CACHE = Path("cache/embeddings")
+TAMANHO_CHAVE = 20
+CAPACIDADE_INICIAL = 1024
+LIMITE_TOKENS_PADRAO = 512
+
+
+def normalizar_texto(texto: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", texto).split())
+
+
+class CacheEmbeddings(Embeddings):
+    def __init__(
+        self,
+        criar_base: Callable[[], Embeddings],
+        modelo: str,
+        pasta: Path = PASTA_CACHE,
+        max_itens: int = 200_000,
+        salvar_a_cada: int = 256,
+    ) -> None:
+        self._criar_base = criar_base
+        self._base: Optional[Embeddings] = None
+        self.modelo = modelo
+        self.pasta = pasta / re.sub(r"[^A-Za-z0-9_.-]+", "_", modelo)
+        self.max_itens = max_itens
+        self.salvar_a_cada = salvar_a_cada
+        self.acertos = 0
+        self.falhas = 0
+        self._novos = 0
+        self._trava = threading.RLock()
+        self._posicoes: Dict[bytes, int] = {}
+        self._dimensao = 0
+        self._capacidade = 0
+        self._relogio = 0
+        self._vetores: Optional[np.memmap] = None
+        self._chaves: Optional[np.memmap] = None
+        self._acessos: Optional[np.memmap] = None
+        self._carregar()
+        atexit.register(self.salvar)
+
+    @property
+    def base(self) -> Embeddings:
+        with self._trava:
+            if self._base is None:
+                with medir("carregar_modelo"):
+                    self._base = self._criar_base()
+            return self._base
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "documento")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "consulta")[0]
+
+    def embed_consultas(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "consulta")
+
+    def _chave(self, tipo: str, texto: str) -> bytes:
+        conteudo = f"{self.modelo}\0{tipo}\0{normalizar_texto(texto)}"
+        return hashlib.sha1(conteudo.encode("utf-8")).digest()
+
+    def _embed(self, textos: List[str], tipo: str) -> List[List[float]]:
+        chaves = [self._chave(tipo, texto) for texto in textos]
+        resultado: List[List[float]] = [[] for _ in textos]
+        ausentes: Dict[bytes, List[int]] = {}
+
+        with self._trava:
+            for i, chave in enumerate(chaves):
+                posicao = self._posicoes.get(chave)
+                if posicao is not None:
+                    vetor = self._vetores[posicao].tolist()
+                    # Outro processo pode ter reutilizado a posicao; a chave confirma.
+                    if self._chaves[posicao].tobytes() != chave:
+                        del self._posicoes[chave]
+                        posicao = None
+                if posicao is None:
+                    ausentes.setdefault(chave, []).append(i)
+                    continue
+                self._relogio += 1
+                self._acessos[posicao] = self._relogio
+                resultado[i] = vetor
+            falhas = sum(len(v) for v in ausentes.values())
+            self.acertos += len(textos) - falhas
+            self.falhas += falhas
+        incrementar("cache_embeddings_total", len(textos) - falhas, resultado="acerto")
+        incrementar("cache_embeddings_total", falhas, resultado="falha")
+
+        if ausentes:
+            pendentes = list(ausentes.items())
+            textos_ausentes = [textos[indices[0]] for _, indices in pendentes]
+            base = self.base
+            with medir(f"modelo_embedding_{tipo}"):
+                # O modelo codifica consultas e documentos igual; varias vao num encode.
+                if tipo == "consulta" and len(textos_ausentes) == 1:
+                    novos = [base.embed_query(textos_ausentes[0])]
+                else:
+                    novos = base.embed_documents(textos_ausentes)
+            with self._trava:
+                self._guardar([chave for chave, _ in pendentes], novos)
+            for (_, indices), vetor in zip(pendentes, novos):
+                for i in indices:
+                    resultado[i] = list(vetor)
+            if self._novos >= self.salvar_a_cada:
+                self.salvar()
+
+        return resultado
+
+    def _guardar(self, chaves: List[bytes], vetores: List[List[float]]) -> None:
+        matriz = np.asarray(vetores, dtype=np.float32)
+        if not self._dimensao:
+            self._dimensao = matriz.shape[1]
+        if matriz.shape[1] != self._dimensao:
+            return
+        chaves = chaves[: self.max_itens]
+        matriz = matriz[: self.max_itens]
+        novos = [i for i, chave in enumerate(chaves) if chave not in self._posicoes]
+        chaves = [chaves[i] for i in novos]
+        posicoes = self._reservar(len(chaves))
+        for chave, posicao, vetor in zip(chaves, posicoes, matriz[novos]):
+            self._relogio += 1
+            self._chaves[posicao] = 0
+            self._vetores[posicao] = vetor
+            self._chaves[posicao] = np.frombuffer(chave, dtype=np.uint8)
+            self._acessos[posicao] = self._relogio
+            self._posicoes[chave] = posicao
+        self._novos += len(chaves)
+
+    def _reservar(self, quantidade: int) -> List[int]:
+        livres = self._capacidade - len(self._posicoes)
+        if livres < quantidade and self._capacidade < self.max_itens:
+            nova = max(CAPACIDADE_INICIAL, self._capacidade * 2)
+            nova = min(self.max_itens, max(nova, len(self._posicoes) + quantidade))
+            self._redimensionar(nova)
+            livres = self._capacidade - len(self._posicoes)
+
+        if livres < quantidade:
+            self._despejar(quantidade - livres)
+        return np.flatnonzero(self._acessos == 0)[:quantidade].tolist()
+
+    def _despejar(self, quantidade: int) -> None:
+        acessos = np.asarray(self._acessos)
+        usados = np.flatnonzero(acessos > 0)
+        quantidade = min(max(quantidade, self._capacidade // 10), len(usados))
+        if quantidade <= 0:
+            return
+        ordem = np.argpartition(acessos[usados], quantidade - 1)[:quantidade]
+        for posicao in usados[ordem].tolist():
+            self._posicoes.pop(self._chaves[posicao].tobytes(), None)
+            self._chaves[posicao] = 0
+            self._acessos[posicao] = 0
+
+    def _arquivos(self) -> Dict[str, Path]:
+        return {
+            "vetores": self.pasta / "vetores.f32",
+            "chaves": self.pasta / "chaves.bin",
+            "acessos": self.pasta / "acessos.i64",
+            "meta": self.pasta / "meta.json",
+        }
+
+    def _carregar(self) -> None:
+        arquivos = self._arquivos()
+        if not arquivos["meta"].exists():
+            return
+        try:
+            meta = json.loads(arquivos["meta"].read_text(encoding="utf-8"))
+            self._dimensao = int(meta["dimensao"])
+            self._abrir(int(meta["capacidade"]))
+        except (OSError, ValueError, KeyError):
+            self._dimensao = 0
+            self._capacidade = 0
+            return
+        usados = np.flatnonzero(np.asarray(self._acessos) > 0)
+        for posicao in usados.tolist():
+            self._posicoes[self._chaves[posicao].tobytes()] = posicao
+        self._relogio = int(np.max(self._acessos)) if len(usados) else 0
+
+    def _abrir(self, capacidade: int) -> None:
+        arquivos = self._arquivos()
+        self._vetores = np.memmap(
+            arquivos["vetores"],
+            dtype=np.float32,
+            mode="r+",
+            shape=(capacidade, self._dimensao),
+        )
+        self._chaves = np.memmap(
+            arquivos["chaves"],
+            dtype=np.uint8,
+            mode="r+",
+            shape=(capacidade, TAMANHO_CHAVE),
+        )
+        self._acessos = np.memmap(
+            arquivos["acessos"], dtype=np.int64, mode="r+", shape=(capacidade,)
+        )
+        self._capacidade = capacidade
+
+    def _redimensionar(self, capacidade: int) -> None:
+        self.pasta.mkdir(parents=True, exist_ok=True)
+        self._fechar()
+        arquivos = self._arquivos()
+        tamanhos = {
+            "vetores": capacidade * self._dimensao * 4,
+            "chaves": capacidade * TAMANHO_CHAVE,
+            "acessos": capacidade * 8,
+        }
+        for nome, tamanho in tamanhos.items():
+            with open(arquivos[nome], "ab") as f:
+                if arquivos[nome].stat().st_size < tamanho:
+                    f.truncate(tamanho)
+        self._abrir(capacidade)
+        self._gravar_meta()
+
+    def _fechar(self) -> None:
+        for mapa in (self._vetores, self._chaves, self._acessos):
+            if mapa is not None:
+                mapa.flush()
+        self._vetores = self._chaves = self._acessos = None
+
+    def _gravar_meta(self) -> None:
+        meta = {
+            "modelo": self.modelo,
+            "dimensao": self._dimensao,
+            "capacidade": self._capacidade,
+        }
+        self._arquivos()["meta"].write_text(json.dumps(meta), encoding="utf-8")
+
+    def salvar(self) -> None:
+        with self._trava:
+            if not self.acertos and not self.falhas:
+                return
+            for mapa in (self._vetores, self._chaves, self._acessos):
+                if mapa is not None:
+                    mapa.flush()
+            registrar_evento(
+                "cache_embeddings",
+                modelo=self.modelo,
+                acertos=self.acertos,
+                falhas=self.falhas,
+                itens=len(self._posicoes),
+                capacidade=self._capacidade,
+            )
+            self.acertos = 0
+            self.falhas = 0
+            self._novos = 0
+
+
+def criar_modelo_embeddings(
+    modelo: str, backend: str = "torch", threads: int = 0
+) -> Embeddings:
+    if backend == "onnx":
+        from embeddings_onnx import EmbeddingsOnnx
+
+        return EmbeddingsOnnx(modelo, threads=threads)
+    if backend != "torch":
+        raise ValueError(f"Backend de embeddings invalido: {backend}")
+    # Importado so aqui: carregar o PyTorch domina o tempo de inicio da CLI.
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    return HuggingFaceEmbeddings(model_name=modelo)
+
+
+def criar_embeddings(
+    modelo: str,
+    pasta_cache: Optional[Path] = PASTA_CACHE,
+    backend: str = "torch",
+    threads: int = 0,
+) -> Embeddings:
+    if backend not in BACKENDS_EMBEDDINGS:
+        raise ValueError(f"Backend de embeddings invalido: {backend}")
+    if pasta_cache is None:
+        with medir("carregar_modelo"):
+            return criar_modelo_embeddings(modelo, backend, threads)
+    # Vetores de backends diferentes nao se misturam no cache.
+    nome = modelo if backend == "torch" else f"{modelo}@{backend}-int8"
+    return CacheEmbeddings(
+        partial(criar_modelo_embeddings, modelo, backend, threads), nome, pasta_cache
+    )
+
+
+def limite_tokens(modelo: str, tokenizador: Any) -> int:
+    # O sentence-transformers trunca em max_seq_length (128 no MiniLM multilingue),
+    # abaixo do model_max_length do tokenizador.
+    limite = min(int(tokenizador.model_max_length), LIMITE_TOKENS_PADRAO)
+    try:
+        if Path(modelo).is_dir():
+            caminho = Path(modelo) / "sentence_bert_config.json"
+        else:
+            from huggingface_hub import hf_hub_download
+
+            caminho = Path(hf_hub_download(modelo, "sentence_bert_config.json"))
+        limite = int(json.loads(caminho.read_text(encoding="utf-8"))["max_seq_length"])
+    except (ImportError, OSError, ValueError, KeyError):
+        pass
+    return limite - tokenizador.num_special_tokens_to_add()
+
+
+@lru_cache(maxsize=None)
+def carregar_tokenizador(modelo: str) -> Tuple[Any, int]:
+    from transformers import AutoTokenizer
+
+    with medir("carregar_tokenizador"):
+        tokenizador = AutoTokenizer.from_pretrained(modelo, use_fast=True)
+    return tokenizador, limite_tokens(modelo, tokenizador)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+
+from texto_utils import normalizar_pergunta
+
+LIMIAR_SIMILARIDADE = 0.95
+TTL_SEG = 3600.0
+MAX_ITENS = 1000
+
+
+class EntradaResposta:
+    __slots__ = ("id", "pergunta", "resposta", "fontes", "criada_em")
+
+    def __init__(
+        self,
+        id_entrada: int,
+        pergunta: str,
+        resposta: str,
+        fontes: List[Dict[str, Any]],
+    ) -> None:
+        self.id = id_entrada
+        self.pergunta = pergunta
+        self.resposta = resposta
+        self.fontes = fontes
+        self.criada_em = time.monotonic()
+
+
+class CacheRespostas:
+    def __init__(
+        self,
+        limiar: float = LIMIAR_SIMILARIDADE,
+        ttl_seg: float = TTL_SEG,
+        max_itens: int = MAX_ITENS,
+    ) -> None:
+        self.limiar = limiar
+        self.ttl_seg = ttl_seg
+        self.max_itens = max_itens
+        self.versao = ""
+        self._trava = threading.Lock()
+        self._entradas: OrderedDict[int, EntradaResposta] = OrderedDict()
+        self._exatas: Dict[str, int] = {}
+        self._index: faiss.Index | None = None
+        self._proximo_id = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    def buscar(
+        self, versao: str, pergunta: str, vetor: np.ndarray | None = None
+    ) -> Tuple[str, EntradaResposta | None]:
+        normalizada = normalizar_pergunta(pergunta)
+        with self._trava:
+            self._verificar_versao(versao)
+            entrada = self._valida(self._exatas.get(normalizada))
+            if entrada is not None:
+                return "exato", entrada
+            if vetor is None or self._index is None or not self._index.ntotal:
+                return "falha", None
+            similaridades, ids = self._index.search(normalizar_vetor(vetor), 1)
+            if similaridades[0][0] >= self.limiar:
+                entrada = self._valida(int(ids[0][0]))
+                if entrada is not None:
+                    return "semantico", entrada
+        return "falha", None
+
+    def guardar(
+        self,
+        versao: str,
+        pergunta: str,
+        resposta: str,
+        fontes: List[Dict[str, Any]],
+        vetor: np.ndarray | None = None,
+    ) -> None:
+        normalizada = normalizar_pergunta(pergunta)
+        with self._trava:
+            self._verificar_versao(versao)
+            self._remover(self._exatas.get(normalizada))
+            while len(self._entradas) >= self.max_itens:
+                self._remover(next(iter(self._entradas)))
+
+            entrada = EntradaResposta(self._proximo_id, normalizada, resposta, fontes)
+            self._proximo_id += 1
+            self._entradas[entrada.id] = entrada
+            self._exatas[normalizada] = entrada.id
+            if vetor is not None:
+                vetor = normalizar_vetor(vetor)
+                if self._index is None:
+                    self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vetor.shape[1]))
+                self._index.add_with_ids(vetor, np.asarray([entrada.id], np.int64))
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._limpar()
+
+    def _verificar_versao(self, versao: str) -> None:
+        # Respostas valem so para a versao do indice em que foram geradas.
+        if versao != self.versao:
+            self._limpar()
+            self.versao = versao
+
+    def _limpar(self) -> None:
+        self._entradas.clear()
+        self._exatas.clear()
+        self._index = None
+
+    def _valida(self, id_entrada: int | None) -> EntradaResposta | None:
+        if id_entrada is None:
+            return None
+        entrada = self._entradas.get(id_entrada)
+        if entrada is None:
+            return None
+        if time.monotonic() - entrada.criada_em > self.ttl_seg:
+            self._remover(id_entrada)
+            return None
+        self._entradas.move_to_end(id_entrada)
+        return entrada
+
+    def _remover(self, id_entrada: int | None) -> None:
+        if id_entrada is None:
+            return
+        entrada = self._entradas.pop(id_entrada, None)
+        if entrada is None:
+            return
+        if self._exatas.get(entrada.pergunta) == id_entrada:
+            del self._exatas[entrada.pergunta]
+        if self._index is not None:
+            self._index.remove_ids(np.asarray([id_entrada], dtype=np.int64))
+
+
+def normalizar_vetor(vetor: np.ndarray) -> np.ndarray:
+    vetor = np.array(vetor, dtype=np.float32).reshape(1, -1)
+    faiss.normalize_L2(vetor)
+    return vetor
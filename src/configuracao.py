@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import threading
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Tuple
 
 
 def carregar_propriedades(caminho: Path = Path("config.properties")) -> Dict[str, str]:
@@ -16,3 +17,23 @@ def carregar_propriedades(caminho: Path = Path("config.properties")) -> Dict[str
         chave, valor = linha.split("=", 1)
         propriedades[chave.strip()] = valor.strip()
     return propriedades
+
+
+_propriedades: Dict[Path, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+_trava = threading.Lock()
+
+
+def obter_propriedades(caminho: Path = Path("config.properties")) -> Dict[str, str]:
+    try:
+        stat = caminho.stat()
+        assinatura = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        assinatura = (0, 0)
+    carregado = _propriedades.get(caminho)
+    if carregado is not None and carregado[0] == assinatura:
+        return carregado[1]
+    # Arquivo mudou (ou primeiro uso): relê e publica o dicionario novo.
+    with _trava:
+        propriedades = carregar_propriedades(caminho)
+        _propriedades[caminho] = (assinatura, propriedades)
+        return propriedades
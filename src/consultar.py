@@ -1,18 +1,55 @@
 from __future__ import annotations
 
 import argparse
+import csv
+import json
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterator, List, Set, TextIO, Tuple
+
+import numpy as np
 
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.documents import Document
 
-from configuracao import carregar_propriedades
+from cache_respostas import (
+    LIMIAR_SIMILARIDADE,
+    MAX_ITENS,
+    TTL_SEG,
+    CacheRespostas,
+    EntradaResposta,
+)
+from configuracao import obter_propriedades
+from gerador_respostas import obter_gerador, resolver_modelo_llm
+from metricas import incrementar, medir, rastrear, resumir_etapas
 from observabilidade import registrar_evento
+from opcoes import adicionar_args_consulta
+from servico_busca import obter_servico
+
+
+_caches_respostas: Dict[Tuple[str, ...], CacheRespostas] = {}
+_trava_caches = threading.Lock()
+
+
+def obter_cache_respostas(*contexto: str) -> CacheRespostas | None:
+    with _trava_caches:
+        if contexto not in _caches_respostas:
+            propriedades = obter_propriedades()
+            ativo = propriedades.get("CACHE_RESPOSTAS_ATIVO", "true").strip().lower()
+            # CACHE_RESPOSTAS_MAX=0 tambem desliga o cache.
+            max_itens = int(propriedades.get("CACHE_RESPOSTAS_MAX", MAX_ITENS))
+            cache = None
+            if ativo not in ("0", "false", "nao", "off") and max_itens > 0:
+                cache = CacheRespostas(
+                    limiar=float(
+                        propriedades.get("CACHE_RESPOSTAS_LIMIAR", LIMIAR_SIMILARIDADE)
+                    ),
+                    ttl_seg=float(propriedades.get("CACHE_RESPOSTAS_TTL_SEG", TTL_SEG)),
+                    max_itens=max_itens,
+                )
+            _caches_respostas[contexto] = cache
+        return _caches_respostas[contexto]
 
 
 def buscar(
@@ -20,6 +57,8 @@ def buscar(
     pasta_indice: Path,
     modelo_embeddings: str,
     limite: int,
+    modo: str = "vector",
+    vetor: np.ndarray | None = None,
 ) -> List[Document]:
     inicio = time.time()
     registrar_evento(
@@ -27,26 +66,274 @@ def buscar(
         pasta_indice=str(pasta_indice),
         modelo_embeddings=modelo_embeddings,
         limite=limite,
+        modo=modo,
     )
 
-    embeddings = HuggingFaceEmbeddings(model_name=modelo_embeddings)
-    indice = FAISS.load_local(
-        str(pasta_indice), embeddings, allow_dangerous_deserialization=True
-    )
-    recuperador = indice.as_retriever(search_kwargs={"k": limite})
-    documentos = recuperador.invoke(consulta)
+    with rastrear() as etapas, medir("busca"):
+        servico = obter_servico(pasta_indice, modelo_embeddings)
+        documentos = servico.buscar(consulta, limite, modo, vetor)
 
     registrar_evento(
         "consulta_fim",
         pasta_indice=str(pasta_indice),
         modelo_embeddings=modelo_embeddings,
         limite=limite,
+        modo=modo,
         resultados=len(documentos),
+        etapas=resumir_etapas(etapas),
         duracao_seg=round(time.time() - inicio, 3),
     )
     return documentos
 
 
+class ConsultaCacheada:
+    def __init__(self, cache: CacheRespostas | None, consulta: str) -> None:
+        self.cache = cache
+        self.consulta = consulta
+        self.versao = ""
+        self.vetor: np.ndarray | None = None
+        self.resultado = "desativado"
+        self.entrada: EntradaResposta | None = None
+
+    def guardar(self, resposta: str, fontes: List[dict]) -> None:
+        if self.cache is not None and resposta.strip():
+            self.cache.guardar(self.versao, self.consulta, resposta, fontes, self.vetor)
+
+
+def consultar_cache(
+    consulta: str,
+    pasta_indice: Path,
+    modelo_embeddings: str,
+    limite: int,
+    modelo_llm: str | None = None,
+    modo: str = "vector",
+) -> ConsultaCacheada:
+    # O modelo resolvido entra no contexto: trocar GEMINI_MODEL nao reaproveita
+    # respostas do modelo anterior.
+    cache = obter_cache_respostas(
+        str(pasta_indice.resolve()),
+        modelo_embeddings,
+        resolver_modelo_llm(modelo_llm),
+        str(limite),
+        modo,
+    )
+    consultada = ConsultaCacheada(cache, consulta)
+    if cache is None:
+        return consultada
+    servico = obter_servico(pasta_indice, modelo_embeddings)
+    with medir("cache_respostas"):
+        consultada.versao = servico.indice().versao
+        consultada.vetor = servico.vetorizar(consulta)
+        consultada.resultado, consultada.entrada = cache.buscar(
+            consultada.versao, consulta, consultada.vetor
+        )
+    incrementar("cache_respostas_total", resultado=consultada.resultado)
+    return consultada
+
+
+def responder_em_partes(
+    consulta: str,
+    pasta_indice: Path,
+    modelo_embeddings: str,
+    limite: int,
+    modelo_llm: str | None = None,
+    modo: str = "vector",
+    transmitir: bool = True,
+) -> Iterator[Tuple[str, Any]]:
+    consultada = consultar_cache(
+        consulta, pasta_indice, modelo_embeddings, limite, modelo_llm, modo
+    )
+    if consultada.entrada is not None:
+        yield "fontes", consultada.entrada.fontes
+        yield "token", consultada.entrada.resposta
+        yield "fim", consultada.resultado
+        return
+
+    documentos = buscar(
+        consulta, pasta_indice, modelo_embeddings, limite, modo, consultada.vetor
+    )
+    fontes = montar_fontes(documentos)
+    # Fontes saem antes da geracao: o cliente ja ve o contexto usado.
+    yield "fontes", fontes
+    if transmitir:
+        partes = []
+        for parte in gerar_resposta_stream(consulta, documentos, modelo_llm):
+            partes.append(parte)
+            yield "token", parte
+        resposta = "".join(partes).strip()
+    else:
+        resposta = gerar_resposta(consulta, documentos, modelo_llm)
+        yield "token", resposta
+    consultada.guardar(resposta, fontes)
+    yield "fim", consultada.resultado
+
+
+def responder(
+    consulta: str,
+    pasta_indice: Path,
+    modelo_embeddings: str,
+    limite: int,
+    modelo_llm: str | None = None,
+    modo: str = "vector",
+) -> Tuple[str, List[dict], str]:
+    partes: List[str] = []
+    fontes: List[dict] = []
+    resultado = ""
+    for tipo, valor in responder_em_partes(
+        consulta,
+        pasta_indice,
+        modelo_embeddings,
+        limite,
+        modelo_llm,
+        modo,
+        transmitir=False,
+    ):
+        if tipo == "fontes":
+            fontes = valor
+        elif tipo == "token":
+            partes.append(valor)
+        else:
+            resultado = valor
+    return "".join(partes), fontes, resultado
+
+
+def buscar_lote(
+    consultas: List[str],
+    pasta_indice: Path,
+    modelo_embeddings: str,
+    limite: int,
+    modo: str = "vector",
+) -> List[List[Document]]:
+    inicio = time.time()
+    with medir("busca_lote"):
+        servico = obter_servico(pasta_indice, modelo_embeddings)
+        resultados = servico.buscar_lote(consultas, limite, modo)
+    registrar_evento(
+        "consulta_lote",
+        pasta_indice=str(pasta_indice),
+        modelo_embeddings=modelo_embeddings,
+        limite=limite,
+        modo=modo,
+        consultas=len(consultas),
+        duracao_seg=round(time.time() - inicio, 3),
+    )
+    return resultados
+
+
+def ler_consultas(caminho: Path) -> List[Dict[str, Any]]:
+    consultas = []
+    with caminho.open(encoding="utf-8-sig", newline="") as f:
+        if caminho.suffix.lower() == ".csv":
+            for i, linha in enumerate(csv.DictReader(f), start=1):
+                texto = linha.get("consulta") or next(iter(linha.values()), "")
+                consultas.append({"id": linha.get("id") or i, "consulta": texto})
+        else:
+            for i, linha in enumerate(f, start=1):
+                if not linha.strip():
+                    continue
+                registro = json.loads(linha)
+                if isinstance(registro, str):
+                    registro = {"consulta": registro}
+                if not isinstance(registro, dict) or not registro.get("consulta"):
+                    # Registro sem consulta e ignorado; o resto do lote segue.
+                    registrar_evento("consulta_ignorada", arquivo=str(caminho), linha=i)
+                    continue
+                consultas.append(
+                    {"id": registro.get("id", i), "consulta": registro["consulta"]}
+                )
+    return [c for c in consultas if str(c["consulta"] or "").strip()]
+
+
+def responder_item(
+    item: Dict[str, Any],
+    documentos: List[Document],
+    modelo_llm: str | None,
+    busca_seg: float,
+) -> Dict[str, Any]:
+    inicio = time.perf_counter()
+    resultado = dict(item, fontes=montar_fontes(documentos), busca_seg=busca_seg)
+    if modelo_llm is not None:
+        try:
+            resultado["resposta"] = gerar_resposta(
+                item["consulta"], documentos, modelo_llm
+            )
+        except Exception as exc:
+            resultado["erro"] = str(exc)
+        resultado["llm_seg"] = round(time.perf_counter() - inicio, 4)
+    return resultado
+
+
+def escrever_resultado(saida: TextIO, resultado: Dict[str, Any]) -> None:
+    saida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+    saida.flush()
+
+
+def responder_arquivo(
+    arquivo_consultas: Path,
+    arquivo_saida: Path,
+    pasta_indice: Path,
+    modelo_embeddings: str,
+    limite: int,
+    modo: str = "vector",
+    modelo_llm: str | None = "",
+    tamanho_lote: int = 64,
+    concorrencia_llm: int = 4,
+) -> int:
+    inicio = time.time()
+    consultas = ler_consultas(arquivo_consultas)
+    arquivo_saida.parent.mkdir(parents=True, exist_ok=True)
+    concorrencia_llm = max(concorrencia_llm, 1)
+    pendentes: Set[Future] = set()
+
+    def esvaziar(maximo: int) -> None:
+        nonlocal pendentes
+        while len(pendentes) > maximo:
+            prontos, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in prontos:
+                escrever_resultado(saida, futuro.result())
+
+    with arquivo_saida.open("w", encoding="utf-8") as saida, ThreadPoolExecutor(
+        max_workers=concorrencia_llm
+    ) as executor:
+        for posicao in range(0, len(consultas), tamanho_lote):
+            lote = consultas[posicao : posicao + tamanho_lote]
+            inicio_lote = time.perf_counter()
+            resultados = buscar_lote(
+                [item["consulta"] for item in lote],
+                pasta_indice,
+                modelo_embeddings,
+                limite,
+                modo,
+            )
+            # Busca em lote: cada consulta recebe a sua parte do tempo do lote.
+            busca_seg = round((time.perf_counter() - inicio_lote) / len(lote), 4)
+            for item, documentos in zip(lote, resultados):
+                if modelo_llm is None:
+                    escrever_resultado(
+                        saida, responder_item(item, documentos, None, busca_seg)
+                    )
+                    continue
+                pendentes.add(
+                    executor.submit(
+                        responder_item, item, documentos, modelo_llm, busca_seg
+                    )
+                )
+                # Limita respostas em memoria enquanto a LLM processa.
+                esvaziar(2 * concorrencia_llm)
+        esvaziar(0)
+
+    registrar_evento(
+        "consulta_arquivo_fim",
+        arquivo_consultas=str(arquivo_consultas),
+        arquivo_saida=str(arquivo_saida),
+        consultas=len(consultas),
+        modo=modo,
+        llm=modelo_llm is not None,
+        duracao_seg=round(time.time() - inicio, 3),
+    )
+    return len(consultas)
+
+
 def formatar_fontes(documentos: List[Document]) -> str:
     linhas = []
     for i, doc in enumerate(documentos, start=1):
@@ -77,67 +364,51 @@ def gerar_resposta(
     documentos: List[Document],
     modelo_llm: str | None,
 ) -> str:
-    propriedades = carregar_propriedades()
-    api_key = propriedades.get("GEMINI_API_KEY", "").strip()
-    modelo = (modelo_llm or propriedades.get("GEMINI_MODEL", "")).strip()
-    temperatura = propriedades.get("TEMPERATURA", "0.2").strip()
+    return obter_gerador(modelo_llm).gerar(consulta, documentos)
 
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY nao encontrado em config.properties.")
-    if not modelo:
-        raise RuntimeError("GEMINI_MODEL nao definido em config.properties.")
 
-    try:
-        temperatura_float = float(temperatura)
-    except ValueError:
-        temperatura_float = 0.2
+def gerar_resposta_stream(
+    consulta: str,
+    documentos: List[Document],
+    modelo_llm: str | None,
+) -> Iterator[str]:
+    return obter_gerador(modelo_llm).gerar_stream(consulta, documentos)
 
-    fontes = []
-    for i, doc in enumerate(documentos, start=1):
-        fontes.append(f"[{i}] {doc.page_content}")
-
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            (
-                "system",
-                "Voce e um assistente de RAG. Responda em portugues simples.",
-            ),
-            (
-                "user",
-                "Responda usando apenas as fontes. Se nao houver evidencia, "
-                "diga que nao encontrou.\n\nPergunta: {consulta}\n\nFontes:\n{fontes}",
-            ),
-        ]
-    )
 
-    llm = ChatGoogleGenerativeAI(
-        google_api_key=api_key, model=modelo, temperature=temperatura_float
-    )
-    mensagem = prompt.format_messages(consulta=consulta, fontes="\n\n".join(fontes))
-    resposta = llm.invoke(mensagem)
-    return resposta.content.strip()
+def processar_consulta(args: argparse.Namespace, base: Path = Path(".")) -> str:
+    # base e a pasta de trabalho de quem pediu (o daemon roda em outra).
+    pasta_indice = base / args.index_dir
+    if args.arquivo_consultas:
+        total = responder_arquivo(
+            base / args.arquivo_consultas,
+            base / args.saida,
+            pasta_indice,
+            args.model,
+            args.limite,
+            modo=args.modo,
+            modelo_llm=None if args.sem_llm else args.modelo_llm,
+            tamanho_lote=args.tamanho_lote,
+            concorrencia_llm=args.concorrencia_llm,
+        )
+        return f"{total} consultas gravadas em {args.saida}"
+
+    documentos = buscar(args.consulta, pasta_indice, args.model, args.limite, args.modo)
+    resposta = gerar_resposta(args.consulta, documentos, args.modelo_llm)
+    return f"{resposta}\n\nFontes:\n{formatar_fontes(documentos)}"
+
+
+def executar_consulta(args: argparse.Namespace) -> None:
+    print(processar_consulta(args))
 
 
 def ler_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Consulta RAG simples")
-    parser.add_argument("--index-dir", default="index", help="Pasta do indice")
-    parser.add_argument(
-        "--model",
-        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-        help="Modelo de embeddings",
-    )
-    parser.add_argument("--consulta", required=True)
-    parser.add_argument("--limite", type=int, default=5)
-    parser.add_argument("--modelo-llm", default="")
+    adicionar_args_consulta(parser)
     return parser.parse_args()
 
 
 def main() -> None:
-    args = ler_args()
-    documentos = buscar(args.consulta, Path(args.index_dir), args.model, args.limite)
-    resposta = gerar_resposta(args.consulta, documentos, args.modelo_llm)
-    print(resposta)
-    print("\nFontes:\n" + formatar_fontes(documentos))
+    executar_consulta(ler_args())
 
 
 if __name__ == "__main__":
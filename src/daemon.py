@@ -0,0 +1,181 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from metricas import incrementar, medir, observar
+from observabilidade import descarregar_metricas, registrar_evento
+
+SOCKET_PADRAO = Path("cache/daemon.sock")
+TIMEOUT_CONEXAO_SEG = 0.5
+# Campos do parser do pipeline que nao fazem parte da consulta.
+CAMPOS_CLIENTE = ("command", "socket", "sem_daemon")
+
+
+def conectar(caminho: Path) -> socket.socket | None:
+    if not hasattr(socket, "AF_UNIX") or not caminho.exists():
+        return None
+    conexao = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conexao.settimeout(TIMEOUT_CONEXAO_SEG)
+    try:
+        conexao.connect(str(caminho))
+    except OSError:
+        # Socket orfao de um daemon que caiu: a consulta roda no proprio processo.
+        conexao.close()
+        return None
+    conexao.settimeout(None)
+    return conexao
+
+
+def consultar_daemon(caminho: Path, args: argparse.Namespace) -> str | None:
+    if args.arquivo_consultas:
+        # O modo em lote grava a saida: roda no processo de quem pediu, nunca no daemon.
+        return None
+    conexao = conectar(caminho)
+    if conexao is None:
+        return None
+    pedido = {c: v for c, v in vars(args).items() if c not in CAMPOS_CLIENTE}
+    pedido["base"] = os.getcwd()
+    with conexao, conexao.makefile("rb") as leitor:
+        conexao.sendall(json.dumps(pedido, ensure_ascii=False).encode("utf-8") + b"\n")
+        linha = leitor.readline()
+    if not linha:
+        raise RuntimeError("O daemon encerrou a conexao sem responder.")
+    resposta = json.loads(linha)
+    if "erro" in resposta:
+        raise RuntimeError(resposta["erro"])
+    return resposta["saida"]
+
+
+class ManipuladorConsulta(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        linha = self.rfile.readline()
+        if not linha:
+            return
+        inicio = time.perf_counter()
+        try:
+            pedido = json.loads(linha)
+            if pedido.get("arquivo_consultas"):
+                raise RuntimeError("O daemon so responde consultas avulsas.")
+            base = Path(pedido.pop("base", "."))
+            saida = self.server.processar(argparse.Namespace(**pedido), base)
+            resposta = {"saida": saida}
+        except Exception as exc:
+            incrementar("erros_total", etapa="daemon")
+            resposta = {"erro": str(exc)}
+        observar("daemon_consulta", time.perf_counter() - inicio)
+        corpo = json.dumps(resposta, ensure_ascii=False).encode("utf-8")
+        self.wfile.write(corpo + b"\n")
+
+
+class ServidorDaemon(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self, caminho: Path, processar: Callable[[argparse.Namespace, Path], str]
+    ) -> None:
+        self.processar = processar
+        # So o dono do processo consulta (o daemon usa a chave da LLM dele): o socket
+        # ja nasce 0600, sem janela entre o bind e um chmod.
+        mascara = os.umask(0o077)
+        try:
+            super().__init__(str(caminho), ManipuladorConsulta)
+        finally:
+            os.umask(mascara)
+
+
+def aquecer(pasta_indice: Path, modelo: str) -> None:
+    from servico_busca import obter_servico
+
+    servico = obter_servico(pasta_indice, modelo)
+    servico.indice()
+    servico.vetorizar("aquecimento")
+    if servico.reordenador is not None:
+        servico.reordenador.modelo
+
+
+def interromper(*_: Any) -> None:
+    raise KeyboardInterrupt
+
+
+def servir(caminho: Path, pasta_indice: Path, modelo: str) -> None:
+    if not hasattr(socket, "AF_UNIX"):
+        raise RuntimeError("Daemon requer sockets unix; use o modo sem daemon.")
+    conexao = conectar(caminho)
+    if conexao is not None:
+        conexao.close()
+        raise RuntimeError(f"Ja existe um daemon ativo em {caminho}.")
+
+    from consultar import processar_consulta
+
+    inicio = time.perf_counter()
+    with medir("daemon_aquecer"):
+        aquecer(pasta_indice, modelo)
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    caminho.unlink(missing_ok=True)
+    servidor = ServidorDaemon(caminho, processar_consulta)
+    registrar_evento(
+        "daemon_inicio",
+        socket=str(caminho),
+        pasta_indice=str(pasta_indice),
+        modelo=modelo,
+        aquecimento_seg=round(time.perf_counter() - inicio, 3),
+    )
+    # SIGTERM encerra como Ctrl+C, removendo o socket.
+    signal.signal(signal.SIGTERM, interromper)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        caminho.unlink(missing_ok=True)
+        registrar_evento("daemon_fim", socket=str(caminho))
+        descarregar_metricas()
+
+
+def adicionar_args_cliente(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--socket",
+        default=str(SOCKET_PADRAO),
+        help="Socket do daemon; sem daemon ativo a consulta roda no proprio processo",
+    )
+    parser.add_argument(
+        "--sem-daemon",
+        action="store_true",
+        help="Consulta no proprio processo mesmo com um daemon ativo",
+    )
+
+
+def adicionar_args_daemon(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--socket", default=str(SOCKET_PADRAO), help="Socket unix")
+    parser.add_argument("--index-dir", default="index", help="Pasta do indice")
+    parser.add_argument(
+        "--model",
+        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        help="Modelo de embeddings carregado na partida",
+    )
+
+
+def ler_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Daemon local que mantem modelo e indice carregados"
+    )
+    adicionar_args_daemon(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = ler_args()
+    servir(Path(args.socket), Path(args.index_dir), args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,37 @@
 from __future__ import annotations
 
+import hashlib
+import os
 import re
+from pathlib import Path
 from typing import Dict, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+URL_API_DRIVE = "https://www.googleapis.com/drive/v3/files"
+URL_DOWNLOAD_PUBLICO = "https://drive.google.com/uc"
+TAMANHO_BLOCO = 1 << 20
+STATUS_REPETIR = (429, 500, 502, 503, 504)
+
+
+def criar_sessao(conexoes: int = 8, tentativas: int = 5) -> requests.Session:
+    repetir = Retry(
+        total=tentativas,
+        backoff_factor=0.5,
+        status_forcelist=STATUS_REPETIR,
+        allowed_methods=("GET",),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adaptador = HTTPAdapter(
+        pool_connections=conexoes, pool_maxsize=conexoes, max_retries=repetir
+    )
+    sessao = requests.Session()
+    sessao.mount("https://", adaptador)
+    sessao.mount("http://", adaptador)
+    return sessao
 
 
 def extrair_id_pasta(url: str) -> str:
@@ -14,11 +42,16 @@ def extrair_id_pasta(url: str) -> str:
     return match.group(1)
 
 
-def listar_arquivos_pasta(pasta_id: str) -> List[Dict[str, str]]:
-    base = "https://www.googleapis.com/drive/v3/files"
+def listar_arquivos_pasta(
+    pasta_id: str, sessao: Optional[requests.Session] = None
+) -> List[Dict[str, str]]:
+    sessao = sessao or requests.Session()
+    base = URL_API_DRIVE
     params = {
         "q": f"'{pasta_id}' in parents and trashed=false",
-        "fields": "nextPageToken, files(id, name, mimeType)",
+        "fields": (
+            "nextPageToken, files(id, name, mimeType, size, md5Checksum, modifiedTime)"
+        ),
         "pageSize": 1000,
     }
     arquivos: List[Dict[str, str]] = []
@@ -26,7 +59,7 @@ def listar_arquivos_pasta(pasta_id: str) -> List[Dict[str, str]]:
     while True:
         if pagina:
             params["pageToken"] = pagina
-        resposta = requests.get(base, params=params, timeout=60)
+        resposta = sessao.get(base, params=params, timeout=60)
         if resposta.status_code == 403:
             raise RuntimeError("Acesso negado ao Drive para listagem publica.")
         resposta.raise_for_status()
@@ -38,56 +71,128 @@ def listar_arquivos_pasta(pasta_id: str) -> List[Dict[str, str]]:
     return arquivos
 
 
-def baixar_arquivo(arquivo_id: str) -> bytes:
-    url = f"https://www.googleapis.com/drive/v3/files/{arquivo_id}"
-    params = {"alt": "media"}
-    resposta = requests.get(url, params=params, timeout=120)
-    if resposta.status_code == 403:
-        return baixar_arquivo_publico(arquivo_id)
-    resposta.raise_for_status()
-    conteudo = resposta.content
-    content_type = resposta.headers.get("content-type", "")
-    prefixo = conteudo[:200].lstrip().lower()
-    if "text/html" in content_type or prefixo.startswith(b"<!doctype html") or prefixo.startswith(b"<html"):
-        return baixar_arquivo_publico(arquivo_id)
-    return conteudo
+def e_html(resposta: requests.Response, inicio: bytes = b"") -> bool:
+    if "text/html" in resposta.headers.get("content-type", ""):
+        return True
+    prefixo = inicio[:200].lstrip().lower()
+    return prefixo.startswith(b"<!doctype html") or prefixo.startswith(b"<html")
 
 
-def baixar_arquivo_publico(arquivo_id: str) -> bytes:
-    url = "https://drive.google.com/uc"
-    params = {"export": "download", "id": arquivo_id}
-    resposta = requests.get(url, params=params, timeout=120)
-    if resposta.status_code != 200:
-        resposta.raise_for_status()
+def token_confirmacao(resposta: requests.Response) -> Optional[str]:
+    for chave, valor in resposta.cookies.items():
+        if chave.startswith("download_warning"):
+            return valor
+    match = re.search(r"confirm=([0-9A-Za-z_]+)", resposta.text)
+    return match.group(1) if match else None
 
-    if "text/html" in resposta.headers.get("content-type", ""):
-        token = None
-        for chave, valor in resposta.cookies.items():
-            if chave.startswith("download_warning"):
-                token = valor
-                break
-        if not token:
-            try:
-                html = resposta.text
-                match = re.search(r"confirm=([0-9A-Za-z_]+)", html)
-                if match:
-                    token = match.group(1)
-            except Exception:
-                token = None
-        if token:
-            params["confirm"] = token
-            resposta = requests.get(url, params=params, timeout=120)
+
+def gravar_resposta(
+    resposta: requests.Response, parcial: Path, inicio: bytes, anexar: bool
+) -> None:
+    with open(parcial, "ab" if anexar else "wb") as f:
+        f.write(inicio)
+        for bloco in resposta.iter_content(TAMANHO_BLOCO):
+            f.write(bloco)
+
+
+def md5_arquivo(caminho: Path) -> str:
+    resumo = hashlib.md5()
+    with caminho.open("rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO), b""):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def confere_com_item(caminho: Path, item: Dict[str, str]) -> bool:
+    if item.get("size") and int(item["size"]) != caminho.stat().st_size:
+        return False
+    if item.get("md5Checksum"):
+        return md5_arquivo(caminho) == item["md5Checksum"]
+    return True
+
+
+def arquivo_parcial(item: Dict[str, str], destino: Path) -> Path:
+    # Id e versao no nome: arquivos com o mesmo nome nao dividem o .part e um .part
+    # de outra versao do arquivo nunca e retomado.
+    versao = item.get("md5Checksum") or item.get("modifiedTime", "")
+    versao = re.sub(r"\W", "", versao)
+    return destino.with_name(f"{destino.name}.{item['id']}.{versao}.part")
+
+
+def baixar_parcial(arquivo_id: str, parcial: Path, sessao: requests.Session) -> None:
+    ja_baixado = parcial.stat().st_size if parcial.exists() else 0
+    cabecalhos = {"Range": f"bytes={ja_baixado}-"} if ja_baixado else {}
+
+    url = f"{URL_API_DRIVE}/{arquivo_id}"
+    with sessao.get(
+        url, params={"alt": "media"}, headers=cabecalhos, stream=True, timeout=120
+    ) as resposta:
+        if resposta.status_code == 416:
+            # Range alem do fim: o .part ja estaria completo; a conferencia decide.
+            return
+        if resposta.status_code != 403:
             resposta.raise_for_status()
-    if "text/html" in resposta.headers.get("content-type", ""):
-        raise RuntimeError(
-            "Resposta HTML recebida no download publico do Drive. "
-            "Verifique se o arquivo e publico ou use GOOGLE_API_KEY/OAuth."
-        )
-    return resposta.content
+            blocos = resposta.iter_content(TAMANHO_BLOCO)
+            inicio = next(blocos, b"")
+            if not e_html(resposta, inicio):
+                # Servidor que ignora o Range (200) ou devolve outra faixa regrava
+                # o .part do inicio.
+                faixa = resposta.headers.get("content-range", "")
+                anexar = resposta.status_code == 206 and faixa.startswith(
+                    f"bytes {ja_baixado}-"
+                )
+                gravar_resposta(resposta, parcial, inicio, anexar)
+                return
+
+    baixar_publico_para_arquivo(arquivo_id, parcial, sessao)
+
+
+def baixar_para_arquivo(
+    item: Dict[str, str], destino: Path, sessao: requests.Session
+) -> int:
+    parcial = arquivo_parcial(item, destino)
+    for tentativa in range(2):
+        if tentativa:
+            # O .part retomado nao bate com o Drive: baixa de novo do zero.
+            parcial.unlink(missing_ok=True)
+        baixar_parcial(item["id"], parcial, sessao)
+        if parcial.exists() and confere_com_item(parcial, item):
+            os.replace(parcial, destino)
+            return destino.stat().st_size
+    parcial.unlink(missing_ok=True)
+    raise RuntimeError(
+        f"Download de {destino.name} nao confere com o tamanho/md5 do Drive."
+    )
+
+
+def baixar_publico_para_arquivo(
+    arquivo_id: str, parcial: Path, sessao: requests.Session
+) -> None:
+    params = {"export": "download", "id": arquivo_id}
+    resposta = sessao.get(URL_DOWNLOAD_PUBLICO, params=params, stream=True, timeout=120)
+    try:
+        resposta.raise_for_status()
+        if e_html(resposta):
+            token = token_confirmacao(resposta)
+            if token:
+                resposta.close()
+                params["confirm"] = token
+                resposta = sessao.get(
+                    URL_DOWNLOAD_PUBLICO, params=params, stream=True, timeout=120
+                )
+                resposta.raise_for_status()
+        if e_html(resposta):
+            raise RuntimeError(
+                "Resposta HTML recebida no download publico do Drive. "
+                "Verifique se o arquivo e publico ou use GOOGLE_API_KEY/OAuth."
+            )
+        gravar_resposta(resposta, parcial, b"", False)
+    finally:
+        resposta.close()
 
 
 def exportar_texto_plano(arquivo_id: str) -> str:
-    url = f"https://www.googleapis.com/drive/v3/files/{arquivo_id}/export"
+    url = f"{URL_API_DRIVE}/{arquivo_id}/export"
     params = {"mimeType": "text/plain"}
     resposta = requests.get(url, params=params, timeout=120)
     if resposta.status_code == 403:
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from metricas import medir
+from observabilidade import registrar_evento
+
+PASTA_ONNX = Path("cache/onnx")
+ARQUIVO_FP32 = "modelo.onnx"
+ARQUIVO_INT8 = "modelo-int8.onnx"
+ARQUIVO_TOKENIZADOR = "tokenizer.json"
+ARQUIVO_META = "meta.json"
+VERSAO_OPSET = 14
+TAMANHO_LOTE = 64
+
+
+def pasta_modelo(modelo: str, pasta: Path = PASTA_ONNX) -> Path:
+    return pasta / re.sub(r"[^A-Za-z0-9_.-]+", "_", modelo)
+
+
+def exportar_onnx(modelo: str, destino: Path) -> Dict[str, Any]:
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    from cache_embeddings import carregar_tokenizador
+
+    destino.mkdir(parents=True, exist_ok=True)
+    tokenizador = AutoTokenizer.from_pretrained(modelo, use_fast=True)
+    rede = AutoModel.from_pretrained(modelo).eval()
+    exemplo = tokenizador(["exemplo de texto"], return_tensors="pt")
+    entradas = [
+        nome
+        for nome in ("input_ids", "attention_mask", "token_type_ids")
+        if nome in exemplo
+    ]
+    eixos = {nome: {0: "lote", 1: "sequencia"} for nome in entradas}
+    eixos["last_hidden_state"] = {0: "lote", 1: "sequencia"}
+    with torch.no_grad():
+        torch.onnx.export(
+            rede,
+            ({nome: exemplo[nome] for nome in entradas},),
+            str(destino / ARQUIVO_FP32),
+            input_names=entradas,
+            output_names=["last_hidden_state"],
+            dynamic_axes=eixos,
+            opset_version=VERSAO_OPSET,
+        )
+    tokenizador.backend_tokenizer.save(str(destino / ARQUIVO_TOKENIZADOR))
+    _, limite = carregar_tokenizador(modelo)
+    meta = {
+        "modelo": modelo,
+        "entradas": entradas,
+        # Mesmo corte do sentence-transformers, contando os tokens especiais.
+        "max_tokens": limite + tokenizador.num_special_tokens_to_add(),
+        "pad_id": tokenizador.pad_token_id or 0,
+        "pad_token": tokenizador.pad_token or "[PAD]",
+    }
+    (destino / ARQUIVO_META).write_text(json.dumps(meta), encoding="utf-8")
+    return meta
+
+
+def quantizar_int8(origem: Path, destino: Path) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(str(origem), str(destino), weight_type=QuantType.QInt8)
+
+
+def preparar_modelo(modelo: str, quantizar: bool, pasta: Path = PASTA_ONNX) -> Path:
+    destino = pasta_modelo(modelo, pasta)
+    arquivo = destino / (ARQUIVO_INT8 if quantizar else ARQUIVO_FP32)
+    if arquivo.exists() and (destino / ARQUIVO_META).exists():
+        return arquivo
+    exportado = (destino / ARQUIVO_FP32).exists() and (destino / ARQUIVO_META).exists()
+    with medir("exportar_onnx"):
+        if not exportado:
+            exportar_onnx(modelo, destino)
+        if quantizar:
+            quantizar_int8(destino / ARQUIVO_FP32, arquivo)
+    registrar_evento(
+        "modelo_onnx_exportado", modelo=modelo, arquivo=str(arquivo), int8=quantizar
+    )
+    return arquivo
+
+
+class EmbeddingsOnnx(Embeddings):
+    def __init__(
+        self,
+        modelo: str,
+        threads: int = 0,
+        quantizar: bool = True,
+        pasta: Path = PASTA_ONNX,
+        tamanho_lote: int = TAMANHO_LOTE,
+    ) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        arquivo = preparar_modelo(modelo, quantizar, pasta)
+        meta = json.loads((arquivo.parent / ARQUIVO_META).read_text(encoding="utf-8"))
+        self.modelo = modelo
+        self.entradas: List[str] = meta["entradas"]
+        self.tamanho_lote = tamanho_lote
+        self.tokenizador = Tokenizer.from_file(
+            str(arquivo.parent / ARQUIVO_TOKENIZADOR)
+        )
+        self.tokenizador.enable_truncation(int(meta["max_tokens"]))
+        self.tokenizador.enable_padding(
+            pad_id=int(meta["pad_id"]), pad_token=meta["pad_token"]
+        )
+        opcoes = ort.SessionOptions()
+        opcoes.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opcoes.intra_op_num_threads = threads
+            opcoes.inter_op_num_threads = 1
+        self.sessao = ort.InferenceSession(
+            str(arquivo), opcoes, providers=["CPUExecutionProvider"]
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.codificar(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.codificar([text])[0].tolist()
+
+    def codificar(self, textos: List[str]) -> np.ndarray:
+        vetores: np.ndarray | None = None
+        # Lotes de tamanho parecido desperdicam menos padding.
+        ordem = sorted(range(len(textos)), key=lambda i: len(textos[i]))
+        for inicio in range(0, len(ordem), self.tamanho_lote):
+            indices = ordem[inicio : inicio + self.tamanho_lote]
+            lote = self._codificar_lote([textos[i] for i in indices])
+            if vetores is None:
+                vetores = np.empty((len(textos), lote.shape[1]), dtype=np.float32)
+            vetores[indices] = lote
+        if vetores is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return vetores
+
+    def _codificar_lote(self, textos: List[str]) -> np.ndarray:
+        codificados = self.tokenizador.encode_batch(textos)
+        mascara = np.asarray([c.attention_mask for c in codificados], dtype=np.int64)
+        colunas = {
+            "input_ids": [c.ids for c in codificados],
+            "attention_mask": mascara,
+            "token_type_ids": [c.type_ids for c in codificados],
+        }
+        entradas = {
+            nome: np.asarray(colunas[nome], dtype=np.int64) for nome in self.entradas
+        }
+        saida = self.sessao.run(None, entradas)[0]
+        # Mean pooling pela mascara, como o modelo sentence-transformers, e norma L2.
+        pesos = mascara[:, :, None].astype(np.float32)
+        medias = (saida * pesos).sum(axis=1) / np.clip(pesos.sum(axis=1), 1e-9, None)
+        normas = np.linalg.norm(medias, axis=1, keepdims=True)
+        return (medias / np.clip(normas, 1e-12, None)).astype(np.float32)
@@ -0,0 +1,470 @@
+from __future__ import annotations
+
+import io
+import os
+import re
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from metricas import incrementar, medir
+
+Conteudo = Union[bytes, bytearray, memoryview]
+
+ASSINATURA_OLE2 = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ASSINATURA_ZIP = b"PK\x03\x04"
+ASSINATURA_RTF = b"{\\rtf"
+BOM_UTF8 = b"\xef\xbb\xbf"
+MARCAS_HTML = (b"<html", b"<!doctype html", b"<head", b"<body", b"<meta")
+FORMATOS_SUPORTADOS = (".doc", ".docx")
+# Sobe quando o texto extraido de um mesmo arquivo muda; o indexador reconstroi.
+VERSAO_EXTRACAO = 2
+
+# Compound File Binary (OLE2): setores especiais e entradas de diretorio.
+FIM_CADEIA = 0xFFFFFFFE
+SEM_IRMAO = 0xFFFFFFFF
+TAMANHO_ENTRADA = 128
+ENTRADAS_DIFAT_CABECALHO = 109
+TIPO_FLUXO = 2
+TIPO_RAIZ = 5
+
+# Word 97-2003: FIB e tabela de pecas (Clx) do fluxo WordDocument.
+IDENT_WORD = 0xA5EC
+NFIB_WORD97 = 0x00C1
+FLAG_CRIPTOGRAFADO = 0x0100
+FLAG_TABELA_1 = 0x0200
+INDICE_FC_CLX = 33
+FC_COMPRIMIDO = 0x40000000
+# Marcas de campo do Word: inicio, separador (codigo | resultado) e fim.
+CAMPO_RE = re.compile("[\x13\x14\x15]")
+CARACTERES_WORD = str.maketrans(
+    {
+        "\r": "\n",
+        "\x0b": "\n",
+        "\x0c": "\n",
+        "\x07": "\n",
+        "\x1e": "-",
+        "\xa0": " ",
+        "\x1f": None,
+        "\x01": None,
+        "\x02": None,
+        "\x05": None,
+        "\x08": None,
+    }
+)
+
+CHARSET_RE = re.compile(rb"charset\s*=\s*[\"']?([A-Za-z0-9_.:-]+)", re.IGNORECASE)
+RTF_RE = re.compile(
+    r"\\([a-zA-Z]+)(-?\d+)? ?|\\'([0-9a-fA-F]{2})|\\(.)|([{}])|([^\\{}\r\n]+)",
+    re.DOTALL,
+)
+DESTINOS_RTF_IGNORADOS = frozenset(
+    """
+    fonttbl colortbl stylesheet info pict object header footer headerl headerr
+    headerf footerl footerr footerf datastore themedata colorschememapping
+    latentstyles listtable listoverridetable rsidtbl xmlnstbl generator
+    fldinst filetbl revtbl pgdsctbl
+    """.split()
+)
+SIMBOLOS_RTF = {
+    "par": "\n",
+    "line": "\n",
+    "sect": "\n",
+    "page": "\n",
+    "row": "\n",
+    "cell": "\n",
+    "tab": "\t",
+    "emdash": "\u2014",
+    "endash": "\u2013",
+    "bullet": "\u2022",
+    "lquote": "\u2018",
+    "rquote": "\u2019",
+    "ldblquote": "\u201c",
+    "rdblquote": "\u201d",
+}
+ESCAPES_RTF = {"\\": "\\", "{": "{", "}": "}", "~": " ", "_": "-", "\n": "\n"}
+
+_ambiente_textract_pronto = False
+
+
+def detectar_formato(conteudo: Conteudo) -> str:
+    inicio = bytes(conteudo[:1024])
+    if inicio.startswith(ASSINATURA_OLE2):
+        return "ole2"
+    if inicio.startswith(ASSINATURA_ZIP):
+        return "docx"
+    inicio = inicio[len(BOM_UTF8) :] if inicio.startswith(BOM_UTF8) else inicio
+    inicio = inicio.lstrip()
+    if inicio.startswith(ASSINATURA_RTF):
+        return "rtf"
+    minusculo = inicio.lower()
+    if minusculo.startswith(b"<") and any(m in minusculo for m in MARCAS_HTML):
+        return "html"
+    return "desconhecido"
+
+
+class ArquivoOle2:
+    def __init__(self, conteudo: Conteudo) -> None:
+        self.dados = memoryview(conteudo)
+        if bytes(self.dados[:8]) != ASSINATURA_OLE2:
+            raise ValueError("Arquivo nao e OLE2.")
+        versao, _, deslocamento_setor, deslocamento_mini = struct.unpack_from(
+            "<HHHH", self.dados, 0x1A
+        )
+        self.tamanho_setor = 1 << deslocamento_setor
+        self.tamanho_mini = 1 << deslocamento_mini
+        self.versao = versao
+        (
+            _,
+            primeiro_diretorio,
+            _,
+            self.limite_mini,
+            primeiro_minifat,
+            total_minifat,
+            primeiro_difat,
+            total_difat,
+        ) = struct.unpack_from("<IIIIIIII", self.dados, 0x2C)
+        self.fat = self._ler_fat(primeiro_difat, total_difat)
+        self.entradas = self._ler_diretorio(primeiro_diretorio)
+        raiz = self.entradas[0]
+        self.minifat: List[int] = []
+        self.mini_fluxo = b""
+        if total_minifat:
+            dados = self._ler_cadeia(primeiro_minifat)
+            self.minifat = list(struct.unpack_from(f"<{len(dados) // 4}I", dados))
+            self.mini_fluxo = self._ler_cadeia(raiz["inicio"], raiz["tamanho"])
+
+    def _setor(self, indice: int) -> memoryview:
+        inicio = (indice + 1) * self.tamanho_setor
+        if inicio + self.tamanho_setor > len(self.dados):
+            raise ValueError("Setor fora do arquivo OLE2.")
+        return self.dados[inicio : inicio + self.tamanho_setor]
+
+    def _ler_fat(self, primeiro_difat: int, total_difat: int) -> List[int]:
+        por_setor = self.tamanho_setor // 4
+        setores_fat = list(
+            struct.unpack_from(f"<{ENTRADAS_DIFAT_CABECALHO}I", self.dados, 0x4C)
+        )
+        setor = primeiro_difat
+        for _ in range(total_difat):
+            if setor >= FIM_CADEIA:
+                break
+            entradas = struct.unpack_from(f"<{por_setor}I", self._setor(setor))
+            setores_fat.extend(entradas[:-1])
+            setor = entradas[-1]
+        fat: List[int] = []
+        for setor in setores_fat:
+            if setor < FIM_CADEIA:
+                fat.extend(struct.unpack_from(f"<{por_setor}I", self._setor(setor)))
+        return fat
+
+    def _cadeia(self, inicio: int, fat: List[int]) -> List[int]:
+        setores: List[int] = []
+        setor = inicio
+        while setor < FIM_CADEIA:
+            if setor >= len(fat) or len(setores) > len(fat):
+                raise ValueError("Cadeia de setores OLE2 invalida.")
+            setores.append(setor)
+            setor = fat[setor]
+        return setores
+
+    def _ler_cadeia(self, inicio: int, tamanho: Optional[int] = None) -> bytes:
+        dados = b"".join(self._setor(s) for s in self._cadeia(inicio, self.fat))
+        return dados if tamanho is None else dados[:tamanho]
+
+    def _ler_diretorio(self, primeiro: int) -> List[Dict[str, int | str]]:
+        dados = self._ler_cadeia(primeiro)
+        entradas = []
+        for posicao in range(0, len(dados) - TAMANHO_ENTRADA + 1, TAMANHO_ENTRADA):
+            tamanho_nome, tipo = struct.unpack_from("<HB", dados, posicao + 64)
+            esquerda, direita, filho = struct.unpack_from("<III", dados, posicao + 68)
+            inicio, tamanho = struct.unpack_from("<IQ", dados, posicao + 116)
+            if self.versao == 3:
+                tamanho &= 0xFFFFFFFF
+            nome = dados[posicao : posicao + max(tamanho_nome - 2, 0)]
+            entradas.append(
+                {
+                    "nome": nome.decode("utf-16-le", errors="ignore"),
+                    "tipo": tipo,
+                    "esquerda": esquerda,
+                    "direita": direita,
+                    "filho": filho,
+                    "inicio": inicio,
+                    "tamanho": tamanho,
+                }
+            )
+        if not entradas or entradas[0]["tipo"] != TIPO_RAIZ:
+            raise ValueError("Diretorio OLE2 sem entrada raiz.")
+        return entradas
+
+    def fluxos_raiz(self) -> Dict[str, Dict[str, int | str]]:
+        # So os filhos diretos da raiz; objetos embutidos tem fluxos com o mesmo nome.
+        fluxos: Dict[str, Dict[str, int | str]] = {}
+        pendentes = [self.entradas[0]["filho"]]
+        vistos = set()
+        while pendentes:
+            indice = pendentes.pop()
+            if indice == SEM_IRMAO or indice in vistos or indice >= len(self.entradas):
+                continue
+            vistos.add(indice)
+            entrada = self.entradas[indice]
+            if entrada["tipo"] == TIPO_FLUXO:
+                fluxos[str(entrada["nome"])] = entrada
+            pendentes.extend((entrada["esquerda"], entrada["direita"]))
+        return fluxos
+
+    def ler_fluxo(self, nome: str) -> bytes:
+        entrada = self.fluxos_raiz().get(nome)
+        if entrada is None:
+            raise ValueError(f"Fluxo OLE2 ausente: {nome}")
+        inicio, tamanho = int(entrada["inicio"]), int(entrada["tamanho"])
+        if tamanho >= self.limite_mini:
+            return self._ler_cadeia(inicio, tamanho)
+        mini = self.mini_fluxo
+        dados = b"".join(
+            mini[s * self.tamanho_mini : (s + 1) * self.tamanho_mini]
+            for s in self._cadeia(inicio, self.minifat)
+        )
+        return dados[:tamanho]
+
+
+def remover_campos_word(texto: str) -> str:
+    # Mantem o resultado dos campos (\x14..\x15) e descarta o codigo (\x13..\x14).
+    if "\x13" not in texto:
+        return texto
+    partes: List[str] = []
+    pilha: List[bool] = []
+    anterior = 0
+    for marca in CAMPO_RE.finditer(texto):
+        if True not in pilha:
+            partes.append(texto[anterior : marca.start()])
+        caractere = marca.group()
+        if caractere == "\x13":
+            pilha.append(True)
+        elif caractere == "\x14" and pilha:
+            pilha[-1] = False
+        elif caractere == "\x15" and pilha:
+            pilha.pop()
+        anterior = marca.end()
+    if True not in pilha:
+        partes.append(texto[anterior:])
+    return "".join(partes)
+
+
+def extrair_texto_word97(conteudo: Conteudo) -> str:
+    ole = ArquivoOle2(conteudo)
+    documento = ole.ler_fluxo("WordDocument")
+    ident, nfib = struct.unpack_from("<HH", documento, 0)
+    if ident != IDENT_WORD or nfib < NFIB_WORD97:
+        raise ValueError("Fluxo WordDocument anterior ao Word 97.")
+    flags = struct.unpack_from("<H", documento, 0x0A)[0]
+    if flags & FLAG_CRIPTOGRAFADO:
+        raise ValueError("Documento Word criptografado.")
+    tabela = ole.ler_fluxo("1Table" if flags & FLAG_TABELA_1 else "0Table")
+
+    # FibBase (32 bytes) seguido de blocos com tamanho variavel.
+    posicao = 32
+    csw = struct.unpack_from("<H", documento, posicao)[0]
+    posicao += 2 + csw * 2
+    cslw = struct.unpack_from("<H", documento, posicao)[0]
+    caracteres_texto = struct.unpack_from("<I", documento, posicao + 2 + 3 * 4)[0]
+    posicao += 2 + cslw * 4 + 2
+    fc_clx, lcb_clx = struct.unpack_from(
+        "<II", documento, posicao + INDICE_FC_CLX * 8
+    )
+
+    # Clx: Prc opcionais (0x01) e depois a tabela de pecas (0x02).
+    posicao, fim = fc_clx, fc_clx + lcb_clx
+    while posicao < fim and tabela[posicao] == 1:
+        posicao += 3 + struct.unpack_from("<h", tabela, posicao + 1)[0]
+    if posicao >= fim or tabela[posicao] != 2:
+        raise ValueError("Tabela de pecas do Word ausente.")
+    tamanho = struct.unpack_from("<I", tabela, posicao + 1)[0]
+    posicao += 5
+    pecas = (tamanho - 4) // 12
+    cps = struct.unpack_from(f"<{pecas + 1}I", tabela, posicao)
+    posicao += (pecas + 1) * 4
+
+    partes: List[str] = []
+    for i in range(pecas):
+        inicio_cp, fim_cp = cps[i], min(cps[i + 1], caracteres_texto)
+        if fim_cp <= inicio_cp:
+            continue
+        fc = struct.unpack_from("<I", tabela, posicao + i * 8 + 2)[0]
+        quantidade = fim_cp - inicio_cp
+        if fc & FC_COMPRIMIDO:
+            inicio = (fc & ~FC_COMPRIMIDO) // 2
+            trecho = documento[inicio : inicio + quantidade]
+            partes.append(trecho.decode("cp1252", errors="ignore"))
+        else:
+            trecho = documento[fc : fc + quantidade * 2]
+            partes.append(trecho.decode("utf-16-le", errors="ignore"))
+    return remover_campos_word("".join(partes)).translate(CARACTERES_WORD)
+
+
+def extrair_texto_docx_bytes(conteudo: Conteudo) -> str:
+    from docx import Document
+
+    doc = Document(io.BytesIO(conteudo))
+    return "\n".join(p.text for p in doc.paragraphs)
+
+
+def decodificar_html(conteudo: Conteudo) -> str:
+    dados = bytes(conteudo)
+    if dados.startswith(BOM_UTF8):
+        return dados[len(BOM_UTF8) :].decode("utf-8", errors="ignore")
+    achado = CHARSET_RE.search(dados[:4096])
+    codificacoes = [achado.group(1).decode("ascii")] if achado else []
+    for codificacao in codificacoes + ["utf-8"]:
+        try:
+            return dados.decode(codificacao)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return dados.decode("cp1252", errors="ignore")
+
+
+def extrair_texto_html(conteudo: str) -> str:
+    try:
+        from bs4 import BeautifulSoup
+    except Exception:
+        texto = re.sub(r"<[^>]+>", " ", conteudo)
+        return " ".join(texto.split())
+
+    soup = BeautifulSoup(conteudo, "html.parser")
+    return " ".join(soup.get_text(" ").split())
+
+
+def extrair_texto_rtf(conteudo: Conteudo) -> str:
+    codificacao = "cp1252"
+    partes: List[str] = []
+    pilha: List[Tuple[bool, int]] = []
+    ignorar = False
+    proximo_ignoravel = False
+    unicode_salto = 1
+    pular = 0
+    tokens = RTF_RE.findall(bytes(conteudo).decode("latin-1"))
+    for palavra, numero, hexa, escape, chave, literal in tokens:
+        if pular and not (palavra or chave):
+            # Substitutos ASCII que seguem \uN.
+            if literal:
+                literal, pular = literal[pular:], max(pular - len(literal), 0)
+            else:
+                pular -= 1
+                continue
+        if chave:
+            pular = 0
+            if chave == "{":
+                pilha.append((ignorar, unicode_salto))
+            elif pilha:
+                ignorar, unicode_salto = pilha.pop()
+            continue
+        if escape == "*":
+            proximo_ignoravel = True
+            continue
+        if palavra:
+            pular = 0
+            if proximo_ignoravel or palavra in DESTINOS_RTF_IGNORADOS:
+                ignorar = True
+            proximo_ignoravel = False
+            if palavra == "ansicpg" and numero:
+                codificacao = f"cp{numero}"
+            elif palavra == "uc" and numero:
+                unicode_salto = int(numero)
+            elif ignorar:
+                continue
+            elif palavra == "u" and numero:
+                partes.append(chr(int(numero) % 65536))
+                pular = unicode_salto
+            elif palavra in SIMBOLOS_RTF:
+                partes.append(SIMBOLOS_RTF[palavra])
+            continue
+        proximo_ignoravel = False
+        if ignorar:
+            continue
+        if hexa:
+            partes.append(bytes([int(hexa, 16)]).decode(codificacao, errors="ignore"))
+        elif escape:
+            partes.append(ESCAPES_RTF.get(escape, ""))
+        else:
+            partes.append(literal)
+    return "".join(partes)
+
+
+def configurar_ambiente_textract() -> None:
+    global _ambiente_textract_pronto
+    if _ambiente_textract_pronto:
+        return
+    _ambiente_textract_pronto = True
+    if os.name != "nt":
+        return
+    caminhos_bins = [
+        r"C:\msys64\mingw64\bin",
+        r"C:\msys64\ucrt64\bin",
+        r"C:\msys64\usr\bin",
+    ]
+    path_atual = os.environ.get("PATH", "")
+    for caminho_bin in caminhos_bins:
+        if caminho_bin not in path_atual:
+            path_atual = f"{caminho_bin}{os.pathsep}{path_atual}"
+    os.environ["PATH"] = path_atual
+    if not os.environ.get("HOME"):
+        os.environ["HOME"] = os.environ.get("USERPROFILE", "")
+
+
+def extrair_texto_textract(
+    conteudo: Conteudo, sufixo: str, caminho: Optional[Path] = None
+) -> str:
+    try:
+        import textract
+    except Exception as exc:  # pragma: no cover - dependency error
+        raise RuntimeError("textract nao instalado. Instale requirements.txt.") from exc
+
+    configurar_ambiente_textract()
+    temporario: Optional[Path] = None
+    if caminho is None:
+        # textract so le arquivos; o temporario existe apenas neste fallback.
+        with tempfile.NamedTemporaryFile(suffix=sufixo, delete=False) as tmp:
+            tmp.write(conteudo)
+            temporario = caminho = Path(tmp.name)
+    try:
+        resultado = textract.process(str(caminho))
+        return resultado.decode("utf-8", errors="ignore")
+    except Exception as exc:  # pragma: no cover - external tool error
+        raise RuntimeError(f"Falha ao ler arquivo com textract: {exc}") from exc
+    finally:
+        if temporario is not None:
+            temporario.unlink(missing_ok=True)
+
+
+def extrair_texto_bytes(
+    conteudo: Conteudo, sufixo: str = ".doc", caminho: Optional[Path] = None
+) -> str:
+    formato = detectar_formato(conteudo)
+    metodo = "nativo"
+    with medir(f"extrair_{formato}"):
+        if formato == "docx":
+            texto = extrair_texto_docx_bytes(conteudo)
+        elif formato == "html":
+            texto = extrair_texto_html(decodificar_html(conteudo))
+        elif formato == "rtf":
+            texto = extrair_texto_rtf(conteudo)
+        else:
+            texto = ""
+            if formato == "ole2":
+                try:
+                    texto = extrair_texto_word97(conteudo)
+                except (ValueError, struct.error, IndexError):
+                    texto = ""
+            if not texto.strip():
+                metodo = "textract"
+                texto = extrair_texto_textract(conteudo, sufixo, caminho)
+    incrementar("documentos_extraidos_total", formato=formato, metodo=metodo)
+    return texto
+
+
+def extrair_texto(caminho: Path) -> str:
+    sufixo = caminho.suffix.lower()
+    if sufixo not in FORMATOS_SUPORTADOS:
+        raise RuntimeError("Formato nao suportado. Use .docx ou .doc.")
+    return extrair_texto_bytes(caminho.read_bytes(), sufixo, caminho)
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from configuracao import obter_propriedades
+from metricas import medir, observar
+
+PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "Voce e um assistente de RAG. Responda em portugues simples.",
+        ),
+        (
+            "user",
+            "Responda usando apenas as fontes. Se nao houver evidencia, "
+            "diga que nao encontrou.\n\nPergunta: {consulta}\n\nFontes:\n{fontes}",
+        ),
+    ]
+)
+
+
+def criar_llm_gemini(api_key: str, modelo: str, temperatura: float) -> Any:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        google_api_key=api_key, model=modelo, temperature=temperatura
+    )
+
+
+_fabrica_llm: Callable[[str, str, float], Any] = criar_llm_gemini
+_geradores: Dict[Tuple[str, float, str], "GeradorRespostas"] = {}
+_trava = threading.Lock()
+
+
+def definir_fabrica_llm(fabrica: Callable[[str, str, float], Any]) -> None:
+    global _fabrica_llm
+    with _trava:
+        _fabrica_llm = fabrica
+        _geradores.clear()
+
+
+def montar_mensagens(consulta: str, documentos: List[Document]) -> List[BaseMessage]:
+    fontes = [f"[{i}] {doc.page_content}" for i, doc in enumerate(documentos, start=1)]
+    return PROMPT.format_messages(consulta=consulta, fontes="\n\n".join(fontes))
+
+
+class GeradorRespostas:
+    def __init__(self, llm: Any, modelo: str) -> None:
+        self.llm = llm
+        self.modelo = modelo
+
+    def gerar(self, consulta: str, documentos: List[Document]) -> str:
+        with medir("montar_prompt"):
+            mensagens = montar_mensagens(consulta, documentos)
+        with medir("llm"):
+            resposta = self.llm.invoke(mensagens)
+        return resposta.content.strip()
+
+    def gerar_stream(self, consulta: str, documentos: List[Document]) -> Iterator[str]:
+        with medir("montar_prompt"):
+            mensagens = montar_mensagens(consulta, documentos)
+        inicio = time.perf_counter()
+        primeiro = True
+        with medir("llm"):
+            for pedaco in self.llm.stream(mensagens):
+                if not pedaco.content:
+                    continue
+                if primeiro:
+                    observar("llm_primeiro_token", time.perf_counter() - inicio)
+                    primeiro = False
+                yield pedaco.content
+
+    async def gerar_async(self, consulta: str, documentos: List[Document]) -> str:
+        with medir("montar_prompt"):
+            mensagens = montar_mensagens(consulta, documentos)
+        with medir("llm"):
+            resposta = await self.llm.ainvoke(mensagens)
+        return resposta.content.strip()
+
+    async def gerar_stream_async(
+        self, consulta: str, documentos: List[Document]
+    ) -> AsyncIterator[str]:
+        with medir("montar_prompt"):
+            mensagens = montar_mensagens(consulta, documentos)
+        inicio = time.perf_counter()
+        primeiro = True
+        with medir("llm"):
+            async for pedaco in self.llm.astream(mensagens):
+                if not pedaco.content:
+                    continue
+                if primeiro:
+                    observar("llm_primeiro_token", time.perf_counter() - inicio)
+                    primeiro = False
+                yield pedaco.content
+
+
+def resolver_modelo_llm(modelo_llm: str | None = None) -> str:
+    return (modelo_llm or obter_propriedades().get("GEMINI_MODEL", "")).strip()
+
+
+def obter_gerador(modelo_llm: str | None = None) -> GeradorRespostas:
+    propriedades = obter_propriedades()
+    api_key = propriedades.get("GEMINI_API_KEY", "").strip()
+    modelo = resolver_modelo_llm(modelo_llm)
+    temperatura = propriedades.get("TEMPERATURA", "0.2").strip()
+
+    if not api_key:
+        raise RuntimeError("GEMINI_API_KEY nao encontrado em config.properties.")
+    if not modelo:
+        raise RuntimeError("GEMINI_MODEL nao definido em config.properties.")
+
+    try:
+        temperatura_float = float(temperatura)
+    except ValueError:
+        temperatura_float = 0.2
+
+    # Um cliente por configuracao, reaproveitado entre threads e requisicoes.
+    chave = (modelo, temperatura_float, api_key)
+    gerador = _geradores.get(chave)
+    if gerador is not None:
+        return gerador
+    with _trava:
+        gerador = _geradores.get(chave)
+        if gerador is None:
+            with medir("criar_cliente_llm"):
+                llm = _fabrica_llm(api_key, modelo, temperatura_float)
+            gerador = GeradorRespostas(llm, modelo)
+            _geradores[chave] = gerador
+        return gerador
@@ -1,152 +1,375 @@
 from __future__ import annotations
 
 import argparse
-import io
-import json
-import os
-import tempfile
+import hashlib
+import queue
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterator, List, Tuple, TypeVar
 
 import time
+import numpy as np
 from tqdm import tqdm
 
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-
+import faiss
+from langchain_core.embeddings import Embeddings
+
+from armazenamento import (
+    ARQUIVO_CONFIG,
+    ARQUIVO_MANIFESTO,
+    LIMIAR_COMPACTACAO,
+    EscritorIndice,
+    carregar_json,
+    formato_atual,
+    fracao_removida,
+    ler_config,
+    salvar_json,
+)
+from cache_embeddings import (
+    PASTA_CACHE,
+    CacheEmbeddings,
+    carregar_tokenizador,
+    criar_embeddings,
+)
 from configuracao import carregar_propriedades
 from drive_api import (
-    baixar_arquivo,
     exportar_texto_plano,
     extrair_id_pasta,
     listar_arquivos_pasta,
 )
-from texto_utils import limpar_texto, separar_secoes, fatiar_secoes
+from extracao import VERSAO_EXTRACAO, extrair_texto
+from texto_utils import (
+    MODOS_FATIAMENTO,
+    fatiar_secoes,
+    fatiar_secoes_tokens,
+    limpar_texto,
+    separar_secoes,
+)
+from metricas import cronometrar, medir, rastrear, resumir_etapas
 from observabilidade import registrar_evento
+from opcoes import (
+    CODIFICACOES_VETORES,
+    PARAMETROS_INDICE,
+    adicionar_args_embeddings,
+    adicionar_args_indice,
+    adicionar_args_particoes,
+    adicionar_args_tokens,
+    parametros_dos_args,
+)
+from particoes import ARQUIVO_PARTICOES, nome_particao, particao_do_documento
+from servico_busca import aplicar_parametros_busca
 
+# Amostra para as faixas por dimensao do SQ8.
+PONTOS_TREINO_SQ = 20_000
+# Manifestos gravados antes de um parametro existir equivalem ao seu valor padrao.
+PADROES_MANIFESTO = {
+    "modo_fatiamento": "compativel",
+    "max_tokens": 0,
+    "sobreposicao_tokens": 0,
+    "backend_embeddings": "torch",
+    "codificacao_vetores": "float32",
+    "shards": 1,
+    # Indices anteriores ao leitor Word 97 e ao charset declarado do HTML.
+    "extracao": 1,
+}
 
-def extrair_texto_docx(caminho: Path) -> str:
-    from docx import Document
-
-    doc = Document(str(caminho))
-    return "\n".join(p.text for p in doc.paragraphs)
-
-
-def extrair_texto_docx_bytes(conteudo: bytes) -> str:
-    from docx import Document
+INTERVALO_PARADA_SEG = 0.1
 
-    doc = Document(io.BytesIO(conteudo))
-    return "\n".join(p.text for p in doc.paragraphs)
+T = TypeVar("T")
 
 
-def extrair_texto_html(conteudo: str) -> str:
-    try:
-        from bs4 import BeautifulSoup
-    except Exception:
-        import re
+def iterar_documentos(pasta_entrada: Path) -> List[Path]:
+    return sorted(
+        [p for p in pasta_entrada.rglob("*") if p.suffix.lower() in {".doc", ".docx"}]
+    )
 
-        texto = re.sub(r"<[^>]+>", " ", conteudo)
-        return " ".join(texto.split())
 
-    soup = BeautifulSoup(conteudo, "html.parser")
-    return " ".join(soup.get_text(" ").split())
+def hash_arquivo(caminho: Path) -> str:
+    resumo = hashlib.sha256()
+    with caminho.open("rb") as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b""):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+
+def carregar_manifesto(pasta_indice: Path) -> Dict[str, Any]:
+    return carregar_json(pasta_indice / ARQUIVO_MANIFESTO)
+
+
+def manifesto_compativel(
+    manifesto: Dict[str, Any],
+    config: Dict[str, Any],
+    parametros_construcao: Dict[str, Any],
+) -> bool:
+    if not manifesto or not formato_atual(config):
+        return False
+    if manifesto.get("versao") != config.get("versao"):
+        return False
+    for chave, valor in parametros_construcao.items():
+        if manifesto.get(chave, PADROES_MANIFESTO.get(chave)) != valor:
+            return False
+    return True
+
+
+def comparar_arquivos(
+    documentos: List[Tuple[str, Path, str]],
+    arquivos_anteriores: Dict[str, Dict[str, Any]],
+) -> Tuple[Dict[str, Dict[str, Any]], List[Tuple[str, Path, str]], List[str]]:
+    arquivos_atuais: Dict[str, Dict[str, Any]] = {}
+    pendentes: List[Tuple[str, Path, str]] = []
+    for nome, caminho, resumo in documentos:
+        anterior = arquivos_anteriores.get(nome)
+        if anterior and anterior.get("hash") == resumo:
+            arquivos_atuais[nome] = anterior
+        else:
+            pendentes.append((nome, caminho, resumo))
+
+    ids_removidos = []
+    for nome, dados in arquivos_anteriores.items():
+        if nome not in arquivos_atuais:
+            ids_removidos.extend(dados.get("ids", []))
+    return arquivos_atuais, pendentes, ids_removidos
+
+
+def descricao_faiss(
+    tipo: str, parametros: Dict[str, int], total: int, codificacao: str = "float32"
+) -> str:
+    # k-means precisa de pelo menos tantos pontos quanto centroides.
+    nlist = max(1, min(parametros["nlist"], total))
+    codigo = CODIFICACOES_VETORES[codificacao]
+    if tipo == "flat":
+        return codigo
+    if tipo == "ivf":
+        return f"IVF{nlist},{codigo}"
+    if tipo == "hnsw":
+        return f"HNSW{parametros['m']},{codigo}"
+    if tipo == "ivfpq":
+        nbits = max(1, min(8, int(np.log2(max(total, 2)))))
+        return f"IVF{nlist},PQ{parametros['m']}x{nbits}"
+    raise RuntimeError(f"Tipo de indice nao suportado: {tipo}")
+
+
+def pontos_treino(
+    tipo: str, parametros: Dict[str, int], codificacao: str = "float32"
+) -> int:
+    minimo = PONTOS_TREINO_SQ if codificacao == "sq8" else 0
+    if tipo == "ivf":
+        return max(min(parametros["nlist"] * 39, 100_000), minimo)
+    if tipo == "ivfpq":
+        return min(max(parametros["nlist"], 256) * 39, 100_000)
+    return minimo
+
+
+def vetores_comprimidos(tipo: str, codificacao: str) -> bool:
+    return tipo == "ivfpq" or codificacao != "float32"
+
+
+@cronometrar("treinar_indice")
+def criar_indice_faiss(
+    tipo: str,
+    parametros: Dict[str, int],
+    vetores: np.ndarray,
+    codificacao: str = "float32",
+) -> faiss.Index:
+    dimensao = vetores.shape[1]
+    if tipo == "ivfpq" and dimensao % parametros["m"]:
+        raise RuntimeError(
+            f"--m ({parametros['m']}) precisa dividir a dimensao ({dimensao}) no ivfpq."
+        )
+    descricao = descricao_faiss(tipo, parametros, len(vetores), codificacao)
+    index = faiss.index_factory(dimensao, descricao)
+    if not index.is_trained:
+        index.train(vetores)
+    aplicar_parametros_busca(index, tipo, parametros)
+    return index
+
+
+def iniciar_indice(
+    escritor: EscritorIndice,
+    tipo: str,
+    parametros: Dict[str, int],
+    lotes: List[Tuple[List[Tuple[str, dict]], np.ndarray]],
+    arquivos_atuais: Dict[str, Dict[str, Any]],
+    codificacao: str = "float32",
+) -> None:
+    vetores = np.concatenate([lote[1] for lote in lotes])
+    escritor.iniciar(criar_indice_faiss(tipo, parametros, vetores, codificacao))
+    for trechos, vetores in lotes:
+        adicionar_lote(escritor, trechos, vetores, arquivos_atuais)
+
+
+@cronometrar("adicionar_lote")
+def adicionar_lote(
+    escritor: EscritorIndice,
+    trechos: List[Tuple[str, dict]],
+    vetores: np.ndarray,
+    arquivos_atuais: Dict[str, Dict[str, Any]],
+) -> None:
+    ids = escritor.adicionar([trecho for _, trecho in trechos], vetores)
+    for (nome, _), id_vetor in zip(trechos, ids):
+        arquivos_atuais[nome]["ids"].append(id_vetor)
 
 
-def configurar_ambiente_textract() -> None:
-    caminhos_bins = [
-        r"C:\msys64\mingw64\bin",
-        r"C:\msys64\ucrt64\bin",
-        r"C:\msys64\usr\bin",
-    ]
-    path_atual = os.environ.get("PATH", "")
-    for caminho_bin in caminhos_bins:
-        if caminho_bin not in path_atual:
-            path_atual = f"{caminho_bin};{path_atual}"
-    os.environ["PATH"] = path_atual
-    if not os.environ.get("HOME"):
-        os.environ["HOME"] = os.environ.get("USERPROFILE", "")
-
-
-def extrair_texto_textract_bytes(conteudo: bytes, sufixo: str) -> str:
-    if conteudo.startswith(b"PK\x03\x04"):
-        return extrair_texto_docx_bytes(conteudo)
+def processar_documento(
+    caminho: Path,
+    max_caracteres: int,
+    sobreposicao: int,
+    modo_fatiamento: str = "compativel",
+    max_tokens: int = 0,
+    sobreposicao_tokens: int = 0,
+    modelo: str = "",
+) -> Tuple[List[dict], str]:
     try:
-        import textract
-    except Exception as exc:  # pragma: no cover - dependency error
-        raise RuntimeError("textract nao instalado. Instale requirements.txt.") from exc
+        texto = limpar_texto(extrair_texto(caminho))
+    except Exception as exc:
+        return [], str(exc)
+    secoes = separar_secoes(texto)
+    if max_tokens > 0:
+        tokenizador, _ = carregar_tokenizador(modelo)
+        chunks = fatiar_secoes_tokens(
+            secoes, tokenizador, max_tokens, sobreposicao_tokens
+        )
+        return chunks, ""
+    chunks = fatiar_secoes(
+        secoes,
+        max_caracteres=max_caracteres,
+        sobreposicao=sobreposicao,
+        modo=modo_fatiamento,
+    )
+    return chunks, ""
 
-    configurar_ambiente_textract()
 
-    with tempfile.NamedTemporaryFile(suffix=sufixo, delete=False) as tmp:
-        tmp.write(conteudo)
-        tmp_path = Path(tmp.name)
-    try:
-        resultado = textract.process(str(tmp_path))
-        return resultado.decode("utf-8", errors="ignore")
-    except Exception as exc:  # pragma: no cover - external tool error
-        try:
-            texto = conteudo.decode("utf-8", errors="ignore")
-            if "<html" in texto.lower():
-                return extrair_texto_html(texto)
-        except Exception:
-            pass
-        raise RuntimeError(f"Falha ao ler arquivo com textract: {exc}") from exc
-    finally:
+def processar_documentos(
+    caminhos: List[Path],
+    max_caracteres: int,
+    sobreposicao: int,
+    workers: int = 1,
+    modo_fatiamento: str = "compativel",
+    max_tokens: int = 0,
+    sobreposicao_tokens: int = 0,
+    modelo: str = "",
+) -> Iterator[Tuple[List[dict], str]]:
+    tarefa = partial(
+        processar_documento,
+        max_caracteres=max_caracteres,
+        sobreposicao=sobreposicao,
+        modo_fatiamento=modo_fatiamento,
+        max_tokens=max_tokens,
+        sobreposicao_tokens=sobreposicao_tokens,
+        modelo=modelo,
+    )
+    if workers <= 1 or len(caminhos) <= 1:
+        resultados = map(tarefa, caminhos)
+        yield from tqdm(resultados, total=len(caminhos), desc="Lendo documentos")
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map preserva a ordem de entrada, mantendo ids dos trechos deterministicos.
+        resultados = executor.map(tarefa, caminhos, chunksize=1)
         try:
-            tmp_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-
+            yield from tqdm(resultados, total=len(caminhos), desc="Lendo documentos")
+        finally:
+            # Consumidor parou no meio: cancela os documentos que nao comecaram.
+            resultados.close()
 
-def extrair_texto_textract_arquivo(caminho: Path) -> str:
-    try:
-        import textract
-    except Exception as exc:  # pragma: no cover - dependency error
-        raise RuntimeError("textract nao instalado. Instale requirements.txt.") from exc
 
-    configurar_ambiente_textract()
-    try:
-        resultado = textract.process(str(caminho))
-        return resultado.decode("utf-8", errors="ignore")
-    except Exception as exc:  # pragma: no cover - external tool error
+def gerar_lotes_trechos(
+    pendentes: List[Tuple[str, Path, str]],
+    max_caracteres: int,
+    sobreposicao: int,
+    workers: int,
+    tamanho_lote: int,
+    arquivos_atuais: Dict[str, Dict[str, Any]],
+    falhas: List[Dict[str, str]],
+    modo_fatiamento: str = "compativel",
+    max_tokens: int = 0,
+    sobreposicao_tokens: int = 0,
+    modelo: str = "",
+) -> Iterator[List[Tuple[str, dict]]]:
+    caminhos = [caminho for _, caminho, _ in pendentes]
+    resultados = processar_documentos(
+        caminhos,
+        max_caracteres,
+        sobreposicao,
+        workers,
+        modo_fatiamento,
+        max_tokens,
+        sobreposicao_tokens,
+        modelo,
+    )
+    lote: List[Tuple[str, dict]] = []
+    for (nome, caminho, resumo), (chunks, erro) in zip(pendentes, resultados):
+        if erro:
+            falhas.append({"arquivo": caminho.name, "erro": erro})
+            continue
+        # Criado antes de enfileirar os trechos; os ids entram quando o lote e gravado.
+        arquivos_atuais[nome] = {"hash": resumo, "ids": []}
+        for i, chunk in enumerate(chunks):
+            lote.append(
+                (
+                    nome,
+                    {
+                        "id": f"{caminho.stem}-{i}",
+                        "arquivo": caminho.name,
+                        "titulo": chunk["title"],
+                        "texto": chunk["text"],
+                    },
+                )
+            )
+            if len(lote) >= tamanho_lote:
+                yield lote
+                lote = []
+    if lote:
+        yield lote
+
+
+def em_segundo_plano(itens: Iterator[T], capacidade: int = 2) -> Iterator[T]:
+    fila: queue.Queue = queue.Queue(maxsize=capacidade)
+    parar = threading.Event()
+    fim = object()
+
+    def entregar(registro: Tuple[Any, BaseException | None]) -> bool:
+        # put com timeout: o produtor percebe quando o consumidor desistiu.
+        while not parar.is_set():
+            try:
+                fila.put(registro, timeout=INTERVALO_PARADA_SEG)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produzir() -> None:
         try:
-            texto = caminho.read_text(encoding="utf-8", errors="ignore")
-            if "<html" in texto.lower():
-                return extrair_texto_html(texto)
-        except Exception:
-            pass
-        raise RuntimeError(f"Falha ao ler arquivo com textract: {exc}") from exc
-
-
-
-def extrair_texto(caminho: Path) -> str:
-    sufixo = caminho.suffix.lower()
-    if sufixo == ".docx":
-        return extrair_texto_docx(caminho)
-
-    if sufixo == ".doc":
-        return extrair_texto_textract_arquivo(caminho)
-
-    raise RuntimeError("Formato nao suportado. Use .docx ou .doc.")
-
-
-def extrair_texto_doc_bytes(conteudo: bytes) -> str:
-    with tempfile.NamedTemporaryFile(suffix=".doc", delete=False) as tmp:
-        tmp.write(conteudo)
-        tmp_path = Path(tmp.name)
+            for item in itens:
+                if not entregar((item, None)):
+                    return
+        except BaseException as exc:
+            entregar((fim, exc))
+            return
+        finally:
+            # Fecha a origem tambem quando o consumidor para no meio.
+            fechar = getattr(itens, "close", None)
+            if fechar is not None:
+                fechar()
+        entregar((fim, None))
+
+    produtor = threading.Thread(target=produzir, daemon=True)
+    produtor.start()
     try:
-        return extrair_texto(tmp_path)
+        while True:
+            item, erro = fila.get()
+            if erro is not None:
+                raise erro
+            if item is fim:
+                return
+            yield item
     finally:
-        try:
-            tmp_path.unlink(missing_ok=True)
-        except Exception:
-            pass
-
-
-def iterar_documentos(pasta_entrada: Path) -> List[Path]:
-    return sorted(
-        [p for p in pasta_entrada.rglob("*") if p.suffix.lower() in {".doc", ".docx"}]
-    )
+        parar.set()
+        produtor.join()
 
 
 def criar_indice(
@@ -155,14 +378,98 @@ def criar_indice(
     modelo: str,
     max_caracteres: int,
     sobreposicao: int,
+    reconstruir_tudo: bool = False,
+    workers: int = 1,
+    tamanho_lote: int = 256,
+    pasta_cache: Path | None = PASTA_CACHE,
+    tipo_indice: str = "flat",
+    parametros_indice: Dict[str, int] | None = None,
+    modo_fatiamento: str = "compativel",
+    max_tokens: int = 0,
+    sobreposicao_tokens: int = 0,
+    backend_embeddings: str = "torch",
+    threads_embeddings: int = 0,
+    codificacao_vetores: str = "float32",
+    particao: Tuple[int, int] | None = None,
+    embeddings: Embeddings | None = None,
 ) -> None:
     pasta_entrada = pasta_entrada.resolve()
     pasta_indice.mkdir(parents=True, exist_ok=True)
-
-    modelo_embeddings = HuggingFaceEmbeddings(model_name=modelo)
-    todos_chunks = []
-    falhas = []
+    parametros = dict(PARAMETROS_INDICE, **(parametros_indice or {}))
+    if max_tokens > 0:
+        # Tokens alem do limite do modelo seriam truncados no embedding.
+        _, limite = carregar_tokenizador(modelo)
+        max_tokens = min(max_tokens, limite)
+        sobreposicao_tokens = min(sobreposicao_tokens, max_tokens // 2)
+    else:
+        sobreposicao_tokens = 0
+
+    modelo_embeddings = embeddings or criar_embeddings(
+        modelo, pasta_cache, backend_embeddings, threads_embeddings
+    )
+    shards = particao[1] if particao else 1
+    falhas: List[Dict[str, str]] = []
     inicio = time.time()
+
+    parametros_construcao = {
+        "modelo": modelo,
+        "backend_embeddings": backend_embeddings,
+        "max_caracteres": max_caracteres,
+        "sobreposicao": sobreposicao,
+        "modo_fatiamento": modo_fatiamento,
+        "max_tokens": max_tokens,
+        "sobreposicao_tokens": sobreposicao_tokens,
+        "tipo_indice": tipo_indice,
+        "codificacao_vetores": codificacao_vetores,
+        "shards": shards,
+        "extracao": VERSAO_EXTRACAO,
+        "nlist": parametros["nlist"],
+        "m": parametros["m"],
+    }
+    config = {
+        "modelo": modelo,
+        "backend_embeddings": backend_embeddings,
+        "max_caracteres": max_caracteres,
+        "sobreposicao": sobreposicao,
+        "modo_fatiamento": modo_fatiamento,
+        "max_tokens": max_tokens,
+        "sobreposicao_tokens": sobreposicao_tokens,
+        "tipo_indice": tipo_indice,
+        "codificacao_vetores": codificacao_vetores,
+        "parametros_indice": parametros,
+        "shards": shards,
+    }
+    manifesto = {} if reconstruir_tudo else carregar_manifesto(pasta_indice)
+    config_anterior = ler_config(pasta_indice)
+    incremental = manifesto_compativel(
+        manifesto, config_anterior, parametros_construcao
+    )
+
+    documentos = [
+        (nome, caminho, hash_arquivo(caminho))
+        for nome, caminho in (
+            (caminho.relative_to(pasta_entrada).as_posix(), caminho)
+            for caminho in iterar_documentos(pasta_entrada)
+        )
+        if particao is None or particao_do_documento(nome, shards) == particao[0]
+    ]
+    arquivos_atuais, pendentes, ids_removidos = comparar_arquivos(
+        documentos, manifesto.get("arquivos", {}) if incremental else {}
+    )
+    if incremental and ids_removidos and tipo_indice == "hnsw":
+        # HNSW nao suporta remocao de vetores; refaz tudo.
+        incremental = False
+        arquivos_atuais, pendentes, ids_removidos = comparar_arquivos(documentos, {})
+    removidos = 0.0
+    if incremental:
+        vivos = sum(len(dados["ids"]) for dados in arquivos_atuais.values())
+        removidos = fracao_removida(pasta_indice, config_anterior, vivos)
+    if removidos > LIMIAR_COMPACTACAO:
+        # Refazer tudo compacta ids, offsets e a copia float32; os embeddings dos
+        # documentos sem alteracao saem do cache.
+        incremental = False
+        arquivos_atuais, pendentes, ids_removidos = comparar_arquivos(documentos, {})
+
     registrar_evento(
         "index_inicio",
         pasta_entrada="drive",
@@ -170,66 +477,129 @@ def criar_indice(
         modelo=modelo,
         max_caracteres=max_caracteres,
         sobreposicao=sobreposicao,
+        modo_fatiamento=modo_fatiamento,
+        max_tokens=max_tokens,
+        sobreposicao_tokens=sobreposicao_tokens,
+        backend_embeddings=backend_embeddings,
+        incremental=incremental,
+        fracao_removida=round(removidos, 3),
+        workers=workers,
+        tamanho_lote=tamanho_lote,
+        tipo_indice=tipo_indice,
+        codificacao_vetores=codificacao_vetores,
+        particao=f"{particao[0]}/{shards}" if particao else None,
     )
 
-    for caminho in tqdm(iterar_documentos(pasta_entrada), desc="Lendo documentos"):
-        try:
-            texto = limpar_texto(extrair_texto(caminho))
-        except Exception as exc:
-            falhas.append({"arquivo": caminho.name, "erro": str(exc)})
-            continue
-        secoes = separar_secoes(texto)
-        chunks = fatiar_secoes(
-            secoes, max_caracteres=max_caracteres, sobreposicao=sobreposicao
+    tem_lexico = "lexico_termos" in config_anterior.get("arquivos", {})
+    if incremental and not pendentes and not ids_removidos and tem_lexico:
+        atualizado = dict(config_anterior, **config)
+        if atualizado != config_anterior:
+            salvar_json(pasta_indice / ARQUIVO_CONFIG, atualizado)
+        registrar_evento(
+            "index_fim",
+            pasta_entrada=str(pasta_entrada),
+            pasta_indice=str(pasta_indice),
+            modelo=modelo,
+            total_trechos=config_anterior.get("total_trechos", 0),
+            adicionados=0,
+            removidos=0,
+            duracao_seg=round(time.time() - inicio, 3),
         )
-        for i, chunk in enumerate(chunks):
-            todos_chunks.append(
-                {
-                    "id": f"{caminho.stem}-{i}",
-                    "file_name": caminho.name,
-                    "title": chunk["title"],
-                    "text": chunk["text"],
-                }
-            )
+        return
 
-    if not todos_chunks:
-        registrar_evento("index_vazio", pasta_entrada=str(pasta_entrada))
-        if falhas:
-            registrar_evento(
-                "index_falhas",
-                pasta_entrada=str(pasta_entrada),
-                falhas=falhas,
+    escritor = EscritorIndice(
+        pasta_indice,
+        config_anterior if incremental else None,
+        exatos=vetores_comprimidos(tipo_indice, codificacao_vetores),
+    )
+    escritor.remover(ids_removidos)
+
+    adicionados = 0
+    treino: List[Tuple[List[Tuple[str, dict]], np.ndarray]] = []
+    alvo_treino = pontos_treino(tipo_indice, parametros, codificacao_vetores)
+    lotes = gerar_lotes_trechos(
+        pendentes,
+        max_caracteres,
+        sobreposicao,
+        workers,
+        tamanho_lote,
+        arquivos_atuais,
+        falhas,
+        modo_fatiamento,
+        max_tokens,
+        sobreposicao_tokens,
+        modelo,
+    )
+    with rastrear() as etapas, closing(em_segundo_plano(lotes)) as prontos:
+        for lote in prontos:
+            textos = [trecho["texto"] for _, trecho in lote]
+            with medir("embedding_documentos"):
+                vetores = np.asarray(
+                    modelo_embeddings.embed_documents(textos), dtype=np.float32
+                )
+            adicionados += len(lote)
+            if escritor.index is not None:
+                adicionar_lote(escritor, lote, vetores, arquivos_atuais)
+                continue
+            # Indices treinados (IVF/PQ) acumulam uma amostra antes do primeiro add.
+            treino.append((lote, vetores))
+            if sum(len(t[0]) for t in treino) >= alvo_treino:
+                iniciar_indice(
+                    escritor,
+                    tipo_indice,
+                    parametros,
+                    treino,
+                    arquivos_atuais,
+                    codificacao_vetores,
+                )
+                treino = []
+        if escritor.index is None and treino:
+            iniciar_indice(
+                escritor,
+                tipo_indice,
+                parametros,
+                treino,
+                arquivos_atuais,
+                codificacao_vetores,
             )
-        raise RuntimeError("Nenhum documento indexado. Verifique erros de leitura.")
 
-    textos = [c["text"] for c in todos_chunks]
-    metadados = [
-        {"arquivo": c["file_name"], "titulo": c["title"], "id": c["id"]}
-        for c in todos_chunks
-    ]
-
-    indice = FAISS.from_texts(textos, modelo_embeddings, metadatas=metadados)
-    indice.save_local(str(pasta_indice))
-
-    with open(pasta_indice / "config.json", "w", encoding="utf-8") as f:
-        json.dump(
-            {
-                "modelo": modelo,
-                "max_caracteres": max_caracteres,
-                "sobreposicao": sobreposicao,
-                "total_trechos": len(todos_chunks),
-            },
-            f,
-            ensure_ascii=True,
-            indent=2,
-        )
+        total_trechos = sum(len(dados["ids"]) for dados in arquivos_atuais.values())
+        if escritor.index is None or not total_trechos:
+            escritor.descartar()
+            registrar_evento("index_vazio", pasta_entrada=str(pasta_entrada))
+            if falhas:
+                registrar_evento(
+                    "index_falhas",
+                    pasta_entrada=str(pasta_entrada),
+                    falhas=falhas,
+                )
+            raise RuntimeError("Nenhum documento indexado. Verifique erros de leitura.")
+
+        if isinstance(modelo_embeddings, CacheEmbeddings):
+            modelo_embeddings.salvar()
+
+        config["total_trechos"] = total_trechos
+        with medir("salvar_indice"):
+            escritor.salvar(
+                config,
+                dict(
+                    parametros_construcao,
+                    total_trechos=total_trechos,
+                    arquivos=arquivos_atuais,
+                ),
+            )
 
     registrar_evento(
         "index_fim",
         pasta_entrada=str(pasta_entrada),
         pasta_indice=str(pasta_indice),
         modelo=modelo,
-        total_trechos=len(todos_chunks),
+        total_trechos=total_trechos,
+        adicionados=adicionados,
+        removidos=len(ids_removidos),
+        tipo_indice=tipo_indice,
+        codificacao_vetores=codificacao_vetores,
+        etapas=resumir_etapas(etapas),
         duracao_seg=round(time.time() - inicio, 3),
     )
     if falhas:
@@ -240,6 +610,90 @@ def criar_indice(
         )
 
 
+def remover_particoes_antigas(pasta_indice: Path, em_uso: List[str]) -> None:
+    # Chamada depois de gravar shards.json: nenhum servidor abre mais essas pastas.
+    for pasta in pasta_indice.glob("shard-*"):
+        if pasta.is_dir() and pasta.name not in em_uso:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+def criar_indice_particionado(
+    pasta_entrada: Path,
+    pasta_indice: Path,
+    modelo: str,
+    max_caracteres: int,
+    sobreposicao: int,
+    shards: int = 1,
+    somente: int | None = None,
+    pasta_cache: Path | None = PASTA_CACHE,
+    backend_embeddings: str = "torch",
+    threads_embeddings: int = 0,
+    **opcoes: Any,
+) -> None:
+    comuns = dict(
+        pasta_cache=pasta_cache,
+        backend_embeddings=backend_embeddings,
+        threads_embeddings=threads_embeddings,
+        **opcoes,
+    )
+    if somente is not None and shards <= 1:
+        raise RuntimeError("--shard so vale com --shards maior que 1.")
+    if shards <= 1:
+        criar_indice(
+            pasta_entrada, pasta_indice, modelo, max_caracteres, sobreposicao, **comuns
+        )
+        (pasta_indice / ARQUIVO_PARTICOES).unlink(missing_ok=True)
+        remover_particoes_antigas(pasta_indice, [])
+        return
+    if somente is not None and not 0 <= somente < shards:
+        raise RuntimeError(f"--shard precisa estar entre 0 e {shards - 1}.")
+
+    pasta_entrada = pasta_entrada.resolve()
+    contagem = [0] * shards
+    for caminho in iterar_documentos(pasta_entrada):
+        nome = caminho.relative_to(pasta_entrada).as_posix()
+        contagem[particao_do_documento(nome, shards)] += 1
+    # Um modelo so para todas as particoes; cada uma segue o proprio manifesto e
+    # as que nao tiveram documentos alterados nao sao regravadas.
+    embeddings = criar_embeddings(
+        modelo, pasta_cache, backend_embeddings, threads_embeddings
+    )
+    for particao in range(shards):
+        if not contagem[particao] or somente not in (None, particao):
+            continue
+        criar_indice(
+            pasta_entrada,
+            pasta_indice / nome_particao(particao),
+            modelo,
+            max_caracteres,
+            sobreposicao,
+            particao=(particao, shards),
+            embeddings=embeddings,
+            **comuns,
+        )
+
+    # Particoes sem documentos ou gravadas com outro --shards ficam de fora (e sao
+    # apagadas depois de gravar a lista).
+    pastas = [
+        nome_particao(particao)
+        for particao in range(shards)
+        if contagem[particao]
+        and ler_config(pasta_indice / nome_particao(particao)).get("shards") == shards
+    ]
+    lista = {"shards": shards, "pastas": pastas}
+    # Regravar a lista sem mudanca faria os servidores recarregarem todas as particoes.
+    if carregar_json(pasta_indice / ARQUIVO_PARTICOES) != lista:
+        salvar_json(pasta_indice / ARQUIVO_PARTICOES, lista)
+    remover_particoes_antigas(pasta_indice, pastas)
+    registrar_evento(
+        "index_particoes",
+        pasta_indice=str(pasta_indice),
+        shards=shards,
+        reindexada=somente,
+        pastas=pastas,
+    )
+
+
 def ler_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Indexador RAG simples")
     parser.add_argument("--input", default="data/raw", help="Pasta com .doc/.docx")
@@ -251,17 +705,64 @@ def ler_args() -> argparse.Namespace:
     )
     parser.add_argument("--max-caracteres", type=int, default=1200)
     parser.add_argument("--sobreposicao", type=int, default=200)
+    parser.add_argument(
+        "--modo-fatiamento",
+        choices=MODOS_FATIAMENTO,
+        default="compativel",
+        help="compativel repete o fatiamento original; frases corta em fim de "
+        "frase ou palavra e aplica a sobreposicao",
+    )
+    adicionar_args_tokens(parser)
+    adicionar_args_embeddings(parser)
+    parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        help="Ignora o manifesto e reindexa todos os documentos",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processos para extracao e fatiamento dos documentos",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Trechos por lote de embeddings",
+    )
+    parser.add_argument(
+        "--cache-embeddings",
+        default=str(PASTA_CACHE),
+        help="Pasta do cache de embeddings (vazio desativa)",
+    )
+    adicionar_args_indice(parser)
+    adicionar_args_particoes(parser)
     return parser.parse_args()
 
 
 def main() -> None:
     args = ler_args()
-    criar_indice(
+    criar_indice_particionado(
         Path(args.input),
         Path(args.index_dir),
         args.model,
         args.max_caracteres,
         args.sobreposicao,
+        shards=args.shards,
+        somente=args.shard,
+        reconstruir_tudo=args.full_rebuild,
+        workers=args.workers,
+        tamanho_lote=args.batch_size,
+        pasta_cache=Path(args.cache_embeddings) if args.cache_embeddings else None,
+        tipo_indice=args.index_type,
+        parametros_indice=parametros_dos_args(args),
+        modo_fatiamento=args.modo_fatiamento,
+        max_tokens=args.max_tokens,
+        sobreposicao_tokens=args.sobreposicao_tokens,
+        backend_embeddings=args.backend_embeddings,
+        threads_embeddings=args.threads_embeddings,
+        codificacao_vetores=args.codificacao_vetores,
     )
 
 
@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+from configuracao import carregar_propriedades
+
+PREFIXO = "rag_"
+LIMITES_SEGUNDOS = tuple(
+    base * 10**expoente for expoente in range(-4, 2) for base in (1.0, 2.5, 5.0)
+)
+QUANTIS = (0.5, 0.95, 0.99)
+AMOSTRAS_QUANTIS = 1024
+
+F = TypeVar("F", bound=Callable[..., Any])
+Rotulos = Tuple[Tuple[str, str], ...]
+
+_etapas: ContextVar[Dict[str, float] | None] = ContextVar("etapas", default=None)
+_ativas: bool | None = None
+
+
+def metricas_ativas() -> bool:
+    global _ativas
+    if _ativas is None:
+        valor = carregar_propriedades().get("METRICAS_ATIVAS", "true")
+        _ativas = valor.strip().lower() not in ("0", "false", "nao", "off")
+    return _ativas
+
+
+def ativar_metricas(ativas: bool) -> None:
+    global _ativas
+    _ativas = ativas
+
+
+class Histograma:
+    def __init__(self) -> None:
+        self.contagens = [0] * (len(LIMITES_SEGUNDOS) + 1)
+        self.soma = 0.0
+        self.total = 0
+        self.amostras: List[float] = []
+        self._proxima = 0
+
+    def observar(self, valor: float) -> None:
+        self.contagens[bisect_left(LIMITES_SEGUNDOS, valor)] += 1
+        self.soma += valor
+        self.total += 1
+        # Janela circular das ultimas medicoes para p50/p95/p99.
+        if len(self.amostras) < AMOSTRAS_QUANTIS:
+            self.amostras.append(valor)
+        else:
+            self.amostras[self._proxima] = valor
+            self._proxima = (self._proxima + 1) % AMOSTRAS_QUANTIS
+
+    def quantis(self) -> Dict[float, float]:
+        ordenadas = sorted(self.amostras)
+        if not ordenadas:
+            return {}
+        ultima = len(ordenadas) - 1
+        return {q: ordenadas[min(int(q * len(ordenadas)), ultima)] for q in QUANTIS}
+
+
+class RegistroMetricas:
+    def __init__(self) -> None:
+        self._trava = threading.Lock()
+        self.duracoes: Dict[str, Histograma] = {}
+        self.contadores: Dict[str, Dict[Rotulos, float]] = {}
+        self.medidores: Dict[str, Dict[Rotulos, float]] = {}
+
+    def observar(self, etapa: str, duracao: float) -> None:
+        with self._trava:
+            histograma = self.duracoes.get(etapa)
+            if histograma is None:
+                histograma = self.duracoes[etapa] = Histograma()
+            histograma.observar(duracao)
+
+    def incrementar(self, nome: str, quantidade: float, rotulos: Rotulos) -> None:
+        with self._trava:
+            serie = self.contadores.setdefault(nome, {})
+            serie[rotulos] = serie.get(rotulos, 0) + quantidade
+
+    def definir(self, nome: str, valor: float, rotulos: Rotulos) -> None:
+        with self._trava:
+            self.medidores.setdefault(nome, {})[rotulos] = valor
+
+    def exportar(self) -> str:
+        with self._trava:
+            linhas: List[str] = []
+            nome = f"{PREFIXO}etapa_duracao_segundos"
+            if self.duracoes:
+                linhas.append(f"# TYPE {nome} histogram")
+            for etapa, histograma in sorted(self.duracoes.items()):
+                acumulado = 0
+                limites = [str(limite) for limite in LIMITES_SEGUNDOS] + ["+Inf"]
+                for limite, contagem in zip(limites, histograma.contagens):
+                    acumulado += contagem
+                    rotulos = formatar_rotulos((("etapa", etapa), ("le", limite)))
+                    linhas.append(f"{nome}_bucket{rotulos} {acumulado}")
+                rotulos = formatar_rotulos((("etapa", etapa),))
+                linhas.append(f"{nome}_sum{rotulos} {histograma.soma:.6f}")
+                linhas.append(f"{nome}_count{rotulos} {histograma.total}")
+
+            nome_quantil = f"{PREFIXO}etapa_quantil_segundos"
+            if self.duracoes:
+                linhas.append(f"# TYPE {nome_quantil} gauge")
+            for etapa, histograma in sorted(self.duracoes.items()):
+                for quantil, valor in histograma.quantis().items():
+                    rotulos = formatar_rotulos(
+                        (("etapa", etapa), ("quantil", str(quantil)))
+                    )
+                    linhas.append(f"{nome_quantil}{rotulos} {valor:.6f}")
+
+            for tipo, series in (
+                ("counter", self.contadores),
+                ("gauge", self.medidores),
+            ):
+                for nome_serie, valores in sorted(series.items()):
+                    linhas.append(f"# TYPE {PREFIXO}{nome_serie} {tipo}")
+                    for rotulos, valor in sorted(valores.items()):
+                        rotulos_texto = formatar_rotulos(rotulos)
+                        linhas.append(f"{PREFIXO}{nome_serie}{rotulos_texto} {valor:g}")
+        return "\n".join(linhas) + "\n"
+
+
+def formatar_rotulos(rotulos: Rotulos) -> str:
+    if not rotulos:
+        return ""
+    partes = []
+    for chave, valor in rotulos:
+        valor = valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+        partes.append(f'{chave}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+registro = RegistroMetricas()
+
+
+class _Medicao:
+    __slots__ = ("etapa", "inicio")
+
+    def __init__(self, etapa: str) -> None:
+        self.etapa = etapa
+        self.inicio = 0.0
+
+    def __enter__(self) -> "_Medicao":
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo: Any, valor: Any, rastro: Any) -> bool:
+        duracao = time.perf_counter() - self.inicio
+        registro.observar(self.etapa, duracao)
+        if tipo is not None and not issubclass(tipo, GeneratorExit):
+            registro.incrementar("erros_total", 1, (("etapa", self.etapa),))
+        etapas = _etapas.get()
+        if etapas is not None:
+            etapas[self.etapa] = etapas.get(self.etapa, 0.0) + duracao
+        return False
+
+
+class _MedicaoNula:
+    def __enter__(self) -> "_MedicaoNula":
+        return self
+
+    def __exit__(self, tipo: Any, valor: Any, rastro: Any) -> bool:
+        return False
+
+
+_NULA = _MedicaoNula()
+
+
+def medir(etapa: str) -> _Medicao | _MedicaoNula:
+    return _Medicao(etapa) if metricas_ativas() else _NULA
+
+
+def cronometrar(etapa: str) -> Callable[[F], F]:
+    def decorador(funcao: F) -> F:
+        @wraps(funcao)
+        def envolvida(*args: Any, **kwargs: Any) -> Any:
+            if not metricas_ativas():
+                return funcao(*args, **kwargs)
+            with _Medicao(etapa):
+                return funcao(*args, **kwargs)
+
+        return envolvida
+
+    return decorador
+
+
+@contextmanager
+def rastrear() -> Iterator[Dict[str, float]]:
+    etapas = _etapas.get()
+    if etapas is not None:
+        # Rastreamento aninhado soma as etapas no rastreamento externo.
+        yield etapas
+        return
+    etapas = {}
+    token = _etapas.set(etapas)
+    try:
+        yield etapas
+    finally:
+        _etapas.reset(token)
+
+
+def resumir_etapas(etapas: Dict[str, float]) -> Dict[str, float]:
+    return {etapa: round(duracao, 4) for etapa, duracao in etapas.items()}
+
+
+def observar(etapa: str, duracao: float) -> None:
+    if metricas_ativas():
+        registro.observar(etapa, duracao)
+
+
+def incrementar(nome: str, quantidade: float = 1, **rotulos: str) -> None:
+    if quantidade and metricas_ativas():
+        registro.incrementar(nome, quantidade, tuple(sorted(rotulos.items())))
+
+
+def definir(nome: str, valor: float, **rotulos: str) -> None:
+    if metricas_ativas():
+        registro.definir(nome, valor, tuple(sorted(rotulos.items())))
+
+
+def exportar_prometheus() -> str:
+    return registro.exportar()
@@ -1,18 +1,253 @@
 from __future__ import annotations
 
+import atexit
 import json
+import multiprocessing.util
+import os
+import queue
+import random
+import threading
 import time
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+from configuracao import carregar_propriedades
+
+PASTA_LOGS = Path("logs")
+ARQUIVO_METRICAS = "metrics.jsonl"
+TAMANHO_MAXIMO = 20 * 1024 * 1024
+BACKUPS = 5
+TAMANHO_LOTE = 256
+INTERVALO_SEG = 0.5
+CAPACIDADE_FILA = 10_000
+
+_FIM = object()
+_escritor: EscritorMetricas | None = None
+_pid = 0
+_amostragem: Dict[str, float] | None = None
+_trava = threading.Lock()
+
+
+def ler_amostragem(valor: str) -> Dict[str, float]:
+    taxas = {}
+    for parte in valor.split(","):
+        evento, _, taxa = parte.partition(":")
+        if evento.strip() and taxa.strip():
+            taxas[evento.strip()] = min(max(float(taxa), 0.0), 1.0)
+    return taxas
+
+
+def configurar_amostragem(taxas: Dict[str, float]) -> None:
+    global _amostragem
+    _amostragem = dict(taxas)
+
+
+def taxa_amostragem(evento: str) -> float:
+    global _amostragem
+    if _amostragem is None:
+        propriedades = carregar_propriedades()
+        _amostragem = ler_amostragem(propriedades.get("METRICAS_AMOSTRAGEM", ""))
+    return _amostragem.get(evento, 1.0)
+
+
+class EscritorMetricas:
+    def __init__(
+        self,
+        caminho: Path,
+        tamanho_maximo: int = TAMANHO_MAXIMO,
+        backups: int = BACKUPS,
+        tamanho_lote: int = TAMANHO_LOTE,
+        intervalo_seg: float = INTERVALO_SEG,
+        capacidade: int = CAPACIDADE_FILA,
+    ) -> None:
+        self.caminho = caminho
+        self.tamanho_maximo = tamanho_maximo
+        self.backups = backups
+        self.tamanho_lote = tamanho_lote
+        self.intervalo_seg = intervalo_seg
+        self.descartados = 0
+        self._fila: queue.Queue = queue.Queue(capacidade)
+        self._trava = threading.Lock()
+        # Trava propria do contador: quem registra nunca espera a gravacao em disco.
+        self._trava_descartados = threading.Lock()
+        self._fd: int | None = None
+        self._inode = 0
+        self._encerrado = False
+        self._thread = threading.Thread(
+            target=self._executar, name="escritor-metricas", daemon=True
+        )
+        self._thread.start()
+
+    def registrar(self, linha: str) -> None:
+        if self._encerrado:
+            self._gravar([linha])
+            return
+        try:
+            self._fila.put_nowait(linha)
+        except queue.Full:
+            # Nunca bloqueia quem registra; a perda e contada e registrada depois.
+            with self._trava_descartados:
+                self.descartados += 1
+
+    def descarregar(self) -> None:
+        # Como Queue.join, mas desiste se o escritor morreu e nao vai esvaziar a fila.
+        with self._fila.all_tasks_done:
+            while self._fila.unfinished_tasks and self._thread.is_alive():
+                self._fila.all_tasks_done.wait(0.1)
+
+    def encerrar(self) -> None:
+        if self._encerrado:
+            return
+        try:
+            self._fila.put(_FIM, timeout=1)
+            self._thread.join(timeout=5)
+        except queue.Full:
+            pass
+        self._encerrado = True
+        if self._thread.is_alive():
+            # O escritor ainda grava o que retirou; o resto da fila continua com ele.
+            return
+        restantes = []
+        while True:
+            try:
+                item = self._fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _FIM:
+                restantes.append(item)
+        self._gravar(restantes)
+
+    def _executar(self) -> None:
+        fim = False
+        while not fim:
+            lote: List[str] = []
+            item = self._fila.get()
+            retirados = 1
+            prazo = time.monotonic() + self.intervalo_seg
+            while True:
+                if item is _FIM:
+                    fim = True
+                    break
+                lote.append(item)
+                restante = prazo - time.monotonic()
+                if len(lote) >= self.tamanho_lote or restante <= 0:
+                    break
+                try:
+                    item = self._fila.get(timeout=restante)
+                except queue.Empty:
+                    break
+                retirados += 1
+            try:
+                self._gravar(lote)
+            except OSError:
+                # Lote perdido (disco cheio, sem permissao...) entra na contagem.
+                with self._trava_descartados:
+                    self.descartados += len(lote)
+            finally:
+                for _ in range(retirados):
+                    self._fila.task_done()
+
+    def _gravar(self, linhas: List[str]) -> None:
+        with self._trava_descartados:
+            descartados, self.descartados = self.descartados, 0
+        if descartados:
+            registro = {
+                "evento": "metricas_descartadas",
+                "ts": time.time(),
+                "quantidade": descartados,
+            }
+            linhas = linhas + [json.dumps(registro) + "\n"]
+        if not linhas:
+            return
+        dados = "".join(linhas).encode("utf-8")
+        with self._trava:
+            # Um write por lote em O_APPEND: processos nao intercalam linhas parciais.
+            try:
+                fd = self._abrir()
+                os.write(fd, dados)
+            except OSError:
+                # A contagem retirada acima nao foi gravada: volta para o proximo lote.
+                with self._trava_descartados:
+                    self.descartados += descartados
+                raise
+            if os.fstat(fd).st_size >= self.tamanho_maximo:
+                self._rotacionar()
+
+    def _abrir(self) -> int:
+        try:
+            inode = self.caminho.stat().st_ino
+        except FileNotFoundError:
+            inode = 0
+        if self._fd is not None and inode == self._inode:
+            return self._fd
+        # Primeiro uso ou outro processo rotacionou o arquivo.
+        self._fechar()
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        modo = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+        self._fd = os.open(self.caminho, modo, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+        return self._fd
+
+    def _fechar(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _rotacionar(self) -> None:
+        self._fechar()
+        nome = self.caminho.name
+        for i in range(self.backups - 1, 0, -1):
+            anterior = self.caminho.with_name(f"{nome}.{i}")
+            if anterior.exists():
+                os.replace(anterior, self.caminho.with_name(f"{nome}.{i + 1}"))
+        if self.backups > 0:
+            os.replace(self.caminho, self.caminho.with_name(f"{nome}.1"))
+        else:
+            self.caminho.unlink()
+
+
+def obter_escritor() -> EscritorMetricas:
+    global _escritor, _pid
+    escritor = _escritor
+    if escritor is not None and _pid == os.getpid():
+        return escritor
+    with _trava:
+        # Apos fork a thread do escritor nao existe no processo filho.
+        if _escritor is None or _pid != os.getpid():
+            _escritor = EscritorMetricas(
+                (PASTA_LOGS / ARQUIVO_METRICAS).resolve(),
+                TAMANHO_MAXIMO,
+                BACKUPS,
+                TAMANHO_LOTE,
+                INTERVALO_SEG,
+                CAPACIDADE_FILA,
+            )
+            _pid = os.getpid()
+            # Processos do multiprocessing saem sem atexit; o Finalize cobre esse caso.
+            multiprocessing.util.Finalize(
+                _escritor, _escritor.encerrar, exitpriority=10
+            )
+        return _escritor
+
+
+def descarregar_metricas() -> None:
+    if _escritor is not None and _pid == os.getpid():
+        _escritor.descarregar()
+
+
+@atexit.register
+def encerrar_metricas() -> None:
+    if _escritor is not None and _pid == os.getpid():
+        _escritor.encerrar()
 
 
 def registrar_evento(evento: str, **campos: Any) -> None:
+    taxa = taxa_amostragem(evento)
+    if taxa < 1.0:
+        if random.random() >= taxa:
+            return
+        campos["amostragem"] = taxa
+
     registro: Dict[str, Any] = {"evento": evento, "ts": time.time()}
     registro.update(campos)
-
-    pasta_logs = Path("logs")
-    pasta_logs.mkdir(parents=True, exist_ok=True)
-    arquivo_metricas = pasta_logs / "metrics.jsonl"
-
-    with arquivo_metricas.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(registro, ensure_ascii=True) + "\n")
+    obter_escritor().registrar(json.dumps(registro, ensure_ascii=True) + "\n")
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import argparse
+from typing import Dict
+
+# Opcoes de linha de comando e seus valores validos, sem dependencias pesadas:
+# o pipeline monta os subcomandos sem importar FAISS, LangChain ou modelos.
+MODOS_BUSCA = ("vector", "bm25", "hybrid")
+BACKENDS_EMBEDDINGS = ("torch", "onnx")
+TIPOS_INDICE = ("flat", "ivf", "hnsw", "ivfpq")
+PARAMETROS_INDICE = {
+    "nlist": 100,
+    "m": 32,
+    "nprobe": 8,
+    "ef_search": 64,
+    "repontuar": 4,
+}
+# Codigo de cada vetor no index_factory; ivfpq ja comprime com PQ.
+CODIFICACOES_VETORES = {"float32": "Flat", "float16": "SQfp16", "sq8": "SQ8"}
+
+
+def inteiro_positivo(valor: str) -> int:
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"inteiro invalido: {valor}") from None
+    if numero < 1:
+        raise argparse.ArgumentTypeError(f"deve ser >= 1: {valor}")
+    return numero
+
+
+def adicionar_args_tokens(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=0,
+        help="Fatia por tokens do tokenizador do modelo (limitado ao maximo do "
+        "modelo); 0 usa --max-caracteres",
+    )
+    parser.add_argument(
+        "--sobreposicao-tokens",
+        type=int,
+        default=16,
+        help="Tokens repetidos entre trechos com --max-tokens",
+    )
+
+
+def adicionar_args_embeddings(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--backend-embeddings",
+        choices=BACKENDS_EMBEDDINGS,
+        default="torch",
+        help="torch usa sentence-transformers; onnx usa ONNX Runtime int8 em CPU. "
+        "As consultas seguem o backend gravado no indice",
+    )
+    parser.add_argument(
+        "--threads-embeddings",
+        type=int,
+        default=0,
+        help="Threads do ONNX Runtime (0 usa o padrao)",
+    )
+
+
+def adicionar_args_indice(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--index-type", choices=TIPOS_INDICE, default="flat")
+    parser.add_argument(
+        "--codificacao-vetores",
+        choices=tuple(CODIFICACOES_VETORES),
+        default="float32",
+        help="float16 (2x menor) ou sq8 (4x menor, quantizacao escalar int8). "
+        "Vetores comprimidos guardam uma copia float32 em disco para repontuar",
+    )
+    parser.add_argument(
+        "--nlist", type=int, default=PARAMETROS_INDICE["nlist"], help="Listas IVF"
+    )
+    parser.add_argument(
+        "--m",
+        type=int,
+        default=PARAMETROS_INDICE["m"],
+        help="HNSW: vizinhos por no; IVFPQ: subquantizadores",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=PARAMETROS_INDICE["nprobe"],
+        help="Listas IVF visitadas por consulta",
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        default=PARAMETROS_INDICE["ef_search"],
+        help="Candidatos HNSW por consulta",
+    )
+    parser.add_argument(
+        "--repontuar",
+        type=int,
+        default=PARAMETROS_INDICE["repontuar"],
+        help="Com vetores comprimidos, busca k x N candidatos e reordena pela "
+        "distancia float32 exata (0 ou 1 desliga)",
+    )
+
+
+def adicionar_args_particoes(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Particiona o indice por documento em N subpastas buscadas em "
+        "paralelo; cada particao e um indice completo",
+    )
+    parser.add_argument(
+        "--shard",
+        type=int,
+        default=None,
+        help="Com --shards, reindexa so esta particao (0 a N-1)",
+    )
+
+
+def parametros_dos_args(args: argparse.Namespace) -> Dict[str, int]:
+    return {
+        "nlist": args.nlist,
+        "m": args.m,
+        "nprobe": args.nprobe,
+        "ef_search": args.ef_search,
+        "repontuar": args.repontuar,
+    }
+
+
+def adicionar_args_consulta(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--index-dir", default="index", help="Pasta do indice")
+    parser.add_argument(
+        "--model",
+        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+        help="Modelo de embeddings",
+    )
+    entrada = parser.add_mutually_exclusive_group(required=True)
+    entrada.add_argument("--consulta")
+    entrada.add_argument(
+        "--arquivo-consultas",
+        default="",
+        help="Arquivo JSONL ou CSV com uma consulta por linha (campo consulta)",
+    )
+    parser.add_argument("--limite", type=int, default=5)
+    parser.add_argument("--modo", choices=MODOS_BUSCA, default="vector")
+    parser.add_argument("--modelo-llm", default="")
+    parser.add_argument(
+        "--saida",
+        default="resultados.jsonl",
+        help="Arquivo JSONL de saida do modo --arquivo-consultas",
+    )
+    parser.add_argument(
+        "--tamanho-lote",
+        type=inteiro_positivo,
+        default=64,
+        help="Consultas por chamada de embeddings e busca no modo em lote",
+    )
+    parser.add_argument(
+        "--concorrencia-llm",
+        type=inteiro_positivo,
+        default=4,
+        help="Respostas da LLM geradas em paralelo no modo em lote",
+    )
+    parser.add_argument(
+        "--sem-llm",
+        action="store_true",
+        help="No modo em lote, grava so as fontes sem gerar respostas",
+    )
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import hashlib
+import heapq
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple, TypeVar
+
+import numpy as np
+from langchain_core.documents import Document
+
+from armazenamento import IndiceTrechos, carregar_json
+from busca_lexical import fundir_rrf, idf_conjunto
+from metricas import medir
+
+ARQUIVO_PARTICOES = "shards.json"
+# Id global = posicao da particao * DESLOCAMENTO_ID + id local da particao.
+DESLOCAMENTO_ID = 1 << 40
+
+T = TypeVar("T")
+# Distancias e ids (consultas x k) da busca vetorial; ids e notas do BM25.
+ResultadoVetorial = Tuple[np.ndarray, np.ndarray]
+ResultadoLexico = Tuple[List[int], List[float]]
+
+_executor: ThreadPoolExecutor | None = None
+_trava = threading.Lock()
+
+
+def nome_particao(particao: int) -> str:
+    return f"shard-{particao:02d}"
+
+
+def particao_do_documento(nome: str, total: int) -> int:
+    # Hash estavel do caminho relativo: o documento fica sempre na mesma particao.
+    resumo = hashlib.md5(nome.encode("utf-8")).hexdigest()
+    return int(resumo[:8], 16) % total
+
+
+def ler_particoes(pasta_indice: Path) -> List[str]:
+    return list(carregar_json(pasta_indice / ARQUIVO_PARTICOES).get("pastas", []))
+
+
+def obter_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _trava:
+        if _executor is None:
+            # FAISS e numpy soltam o GIL: as particoes buscam em nucleos diferentes.
+            _executor = ThreadPoolExecutor(
+                max_workers=os.cpu_count() or 4, thread_name_prefix="particao"
+            )
+        return _executor
+
+
+def fundir_vetores(
+    resultados: Sequence[ResultadoVetorial],
+    deslocamentos: Sequence[int],
+    limite: int,
+) -> ResultadoVetorial:
+    consultas = len(resultados[0][1])
+    distancias = np.full(
+        (consultas, limite), np.finfo(np.float32).max, dtype=np.float32
+    )
+    rotulos = np.full((consultas, limite), -1, dtype=np.int64)
+    for linha in range(consultas):
+        listas = []
+        for (dist, ids), deslocamento in zip(resultados, deslocamentos):
+            validos = ids[linha] >= 0
+            globais = ids[linha][validos] + deslocamento
+            listas.append(zip(dist[linha][validos].tolist(), globais.tolist()))
+        # Cada particao ja devolve a lista ordenada: o heap so intercala o top-k.
+        melhores = islice(heapq.merge(*listas), limite)
+        for coluna, (distancia, id_global) in enumerate(melhores):
+            distancias[linha, coluna] = distancia
+            rotulos[linha, coluna] = id_global
+    return distancias, rotulos
+
+
+def fundir_notas(
+    resultados: Sequence[ResultadoLexico],
+    deslocamentos: Sequence[int],
+    limite: int,
+) -> List[int]:
+    listas = [
+        zip(notas, [i + deslocamento for i in ids])
+        for (ids, notas), deslocamento in zip(resultados, deslocamentos)
+    ]
+    # As particoes pontuam com o mesmo IDF global (idf_conjunto): as notas comparam.
+    melhores = heapq.merge(*listas, key=lambda par: par[0], reverse=True)
+    return [id_global for _, id_global in islice(melhores, limite)]
+
+
+class IndiceParticionado:
+    def __init__(
+        self, pasta_indice: Path, nomes: List[str], particoes: List[IndiceTrechos]
+    ) -> None:
+        if not particoes:
+            raise RuntimeError(f"Nenhuma particao listada em {pasta_indice}.")
+        self.pasta_indice = pasta_indice
+        self.nomes = nomes
+        self.particoes = particoes
+        self.deslocamentos = [i * DESLOCAMENTO_ID for i in range(len(particoes))]
+        # Backend e modelo sao os mesmos em todas as particoes.
+        self.config: Dict[str, Any] = particoes[0].config
+        self.versao = "+".join(particao.versao for particao in particoes)
+
+    @property
+    def total(self) -> int:
+        return sum(particao.total for particao in self.particoes)
+
+    def trecho(self, id_global: int) -> Dict[str, Any]:
+        posicao, id_vetor = divmod(id_global, DESLOCAMENTO_ID)
+        return self.particoes[posicao].trecho(id_vetor)
+
+    def documento(self, id_global: int) -> Document:
+        posicao, id_vetor = divmod(id_global, DESLOCAMENTO_ID)
+        return self.particoes[posicao].documento(id_vetor)
+
+    def _em_paralelo(self, funcao: Callable[[IndiceTrechos], T]) -> List[T]:
+        if len(self.particoes) == 1:
+            return [funcao(self.particoes[0])]
+        executor = obter_executor()
+        with medir("busca_particoes"):
+            futuros = [executor.submit(funcao, particao) for particao in self.particoes]
+            return [futuro.result() for futuro in futuros]
+
+    def buscar_vetores(self, vetores: np.ndarray, limite: int) -> ResultadoVetorial:
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        resultados = self._em_paralelo(
+            lambda particao: particao.buscar_vetores(vetores, limite)
+        )
+        return fundir_vetores(resultados, self.deslocamentos, limite)
+
+    def buscar(self, vetores: np.ndarray, limite: int) -> List[List[Document]]:
+        _, ids = self.buscar_vetores(vetores, limite)
+        return [[self.documento(int(i)) for i in linha if i >= 0] for linha in ids]
+
+    def idf(self, consulta: str) -> Dict[str, float]:
+        lexicos = [p.lexico for p in self.particoes if p.lexico is not None]
+        return idf_conjunto(lexicos, consulta)
+
+    def buscar_lexico(self, consulta: str, limite: int) -> List[int]:
+        idf = self.idf(consulta)
+        resultados = self._em_paralelo(
+            lambda particao: particao.buscar_lexico_notas(consulta, limite, idf)
+        )
+        return fundir_notas(resultados, self.deslocamentos, limite)
+
+    def buscar_hibrido(
+        self,
+        vetores: np.ndarray,
+        consultas: List[str],
+        limite: int,
+        candidatos: int,
+    ) -> List[List[Document]]:
+        vetores = np.ascontiguousarray(vetores, dtype=np.float32)
+        idfs = [self.idf(consulta) for consulta in consultas]
+
+        # Uma tarefa por particao faz a busca vetorial do lote e o BM25 de cada
+        # consulta; a fusao RRF roda sobre as listas globais.
+        def buscar_particao(
+            particao: IndiceTrechos,
+        ) -> Tuple[ResultadoVetorial, List[ResultadoLexico]]:
+            vetoriais = particao.buscar_vetores(vetores, candidatos)
+            lexicos = [
+                particao.buscar_lexico_notas(consulta, candidatos, idf)
+                for consulta, idf in zip(consultas, idfs)
+            ]
+            return vetoriais, lexicos
+
+        resultados = self._em_paralelo(buscar_particao)
+        _, ids = fundir_vetores(
+            [vetoriais for vetoriais, _ in resultados], self.deslocamentos, candidatos
+        )
+        documentos = []
+        for posicao, linha in enumerate(ids):
+            vetoriais = [int(i) for i in linha if i >= 0]
+            lexicos = fundir_notas(
+                [lexicos[posicao] for _, lexicos in resultados],
+                self.deslocamentos,
+                candidatos,
+            )
+            fundidos = fundir_rrf([vetoriais, lexicos], limite)
+            documentos.append([self.documento(i) for i in fundidos])
+        return documentos
@@ -3,21 +3,36 @@ from __future__ import annotations
 import argparse
 from pathlib import Path
 
-from baixar import baixar_pasta_drive
-from consultar import buscar, formatar_fontes, gerar_resposta
 from configuracao import carregar_propriedades
-from indexar import criar_indice
+from daemon import (
+    adicionar_args_cliente,
+    adicionar_args_daemon,
+    consultar_daemon,
+    servir,
+)
+from opcoes import (
+    adicionar_args_consulta,
+    adicionar_args_embeddings,
+    adicionar_args_indice,
+    adicionar_args_particoes,
+    adicionar_args_tokens,
+    parametros_dos_args,
+)
+from texto_utils import MODOS_FATIAMENTO
 
 
 def ler_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-        description="Pipeline RAG simples (baixar, indexar, consultar)"
+        description="Pipeline RAG simples (baixar, indexar, consultar, daemon)"
     )
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     baixar_parser = subparsers.add_parser("baixar", help="Baixar documentos")
     baixar_parser.add_argument("--folder-url", default="", help="URL da pasta do Drive")
     baixar_parser.add_argument("--output", default="data/raw", help="Pasta de destino")
+    baixar_parser.add_argument(
+        "--workers", type=int, default=8, help="Downloads simultaneos"
+    )
 
     indexar_parser = subparsers.add_parser("indexar", help="Indexar documentos")
     indexar_parser.add_argument("--index-dir", default="index", help="Pasta do indice")
@@ -29,48 +44,105 @@ def ler_args() -> argparse.Namespace:
     )
     indexar_parser.add_argument("--max-caracteres", type=int, default=1200)
     indexar_parser.add_argument("--sobreposicao", type=int, default=200)
+    indexar_parser.add_argument(
+        "--modo-fatiamento",
+        choices=MODOS_FATIAMENTO,
+        default="compativel",
+        help="compativel repete o fatiamento original; frases corta em fim de "
+        "frase ou palavra e aplica a sobreposicao",
+    )
+    adicionar_args_tokens(indexar_parser)
+    adicionar_args_embeddings(indexar_parser)
     indexar_parser.add_argument("--drive-url", default="")
+    indexar_parser.add_argument(
+        "--full-rebuild",
+        action="store_true",
+        help="Ignora o manifesto e reindexa todos os documentos",
+    )
+    indexar_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processos para extracao e fatiamento dos documentos",
+    )
+    indexar_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="Trechos por lote de embeddings",
+    )
+    indexar_parser.add_argument(
+        "--cache-embeddings",
+        default="cache/embeddings",
+        help="Pasta do cache de embeddings (vazio desativa)",
+    )
+    adicionar_args_indice(indexar_parser)
+    adicionar_args_particoes(indexar_parser)
 
     consultar_parser = subparsers.add_parser("consultar", help="Consultar indice")
-    consultar_parser.add_argument("--index-dir", default="index", help="Pasta do indice")
-    consultar_parser.add_argument(
-        "--model",
-        default="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-        help="Modelo de embeddings",
+    adicionar_args_consulta(consultar_parser)
+    adicionar_args_cliente(consultar_parser)
+
+    daemon_parser = subparsers.add_parser(
+        "daemon", help="Manter modelo e indice carregados para consultar"
     )
-    consultar_parser.add_argument("--consulta", required=True)
-    consultar_parser.add_argument("--limite", type=int, default=5)
-    consultar_parser.add_argument("--modelo-llm", default="")
+    adicionar_args_daemon(daemon_parser)
 
     return parser.parse_args()
 
 
 def main() -> None:
     args = ler_args()
+    # Cada subcomando importa so o que usa: baixar nao carrega FAISS, LangChain ou
+    # modelos, e consultar com daemon ativo nao carrega nada disso no cliente.
 
     if args.command == "baixar":
+        from baixar import baixar_pasta_drive
+
         propriedades = carregar_propriedades()
         url_pasta = args.folder_url.strip() or propriedades.get("DRIVE_URL", "").strip()
         if not url_pasta:
             raise RuntimeError("DRIVE_URL nao configurada em config.properties.")
-        baixar_pasta_drive(url_pasta, Path(args.output))
+        baixar_pasta_drive(url_pasta, Path(args.output), args.workers)
         return
 
     if args.command == "indexar":
-        criar_indice(
+        from indexar import criar_indice_particionado
+
+        criar_indice_particionado(
             Path(args.input),
             Path(args.index_dir),
             args.model,
             args.max_caracteres,
             args.sobreposicao,
+            shards=args.shards,
+            somente=args.shard,
+            reconstruir_tudo=args.full_rebuild,
+            workers=args.workers,
+            tamanho_lote=args.batch_size,
+            pasta_cache=Path(args.cache_embeddings) if args.cache_embeddings else None,
+            tipo_indice=args.index_type,
+            parametros_indice=parametros_dos_args(args),
+            modo_fatiamento=args.modo_fatiamento,
+            max_tokens=args.max_tokens,
+            sobreposicao_tokens=args.sobreposicao_tokens,
+            backend_embeddings=args.backend_embeddings,
+            threads_embeddings=args.threads_embeddings,
+            codificacao_vetores=args.codificacao_vetores,
         )
         return
 
     if args.command == "consultar":
-        resultados = buscar(args.consulta, Path(args.index_dir), args.model, args.limite)
-        resposta = gerar_resposta(args.consulta, resultados, args.modelo_llm)
-        print(resposta)
-        print("\nFontes:\n" + formatar_fontes(resultados))
+        saida = None if args.sem_daemon else consultar_daemon(Path(args.socket), args)
+        if saida is None:
+            from consultar import processar_consulta
+
+            saida = processar_consulta(args)
+        print(saida)
+        return
+
+    if args.command == "daemon":
+        servir(Path(args.socket), Path(args.index_dir), args.model)
         return
 
 
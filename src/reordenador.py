@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.documents import Document
+
+from metricas import incrementar, medir
+from texto_utils import normalizar_pergunta
+
+MODELO_PADRAO = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+CANDIDATOS = 50
+NOTA_MINIMA = 0.05
+ORCAMENTO_TOKENS = 1500
+TAMANHO_LOTE = 32
+MAX_TOKENS_PAR = 256
+MAX_NOTAS_CACHE = 50_000
+
+
+def criar_cross_encoder(modelo: str, max_tokens: int) -> Any:
+    from sentence_transformers import CrossEncoder
+
+    return CrossEncoder(modelo, max_length=max_tokens, device="cpu")
+
+
+class Reordenador:
+    def __init__(
+        self,
+        modelo: str = MODELO_PADRAO,
+        candidatos: int = CANDIDATOS,
+        nota_minima: float = NOTA_MINIMA,
+        orcamento_tokens: int = ORCAMENTO_TOKENS,
+        tamanho_lote: int = TAMANHO_LOTE,
+        max_notas: int = MAX_NOTAS_CACHE,
+    ) -> None:
+        self.nome_modelo = modelo
+        self.candidatos = candidatos
+        self.nota_minima = nota_minima
+        self.orcamento_tokens = orcamento_tokens
+        self.tamanho_lote = tamanho_lote
+        self.max_notas = max_notas
+        self._modelo: Any = None
+        self._notas: OrderedDict[Tuple[str, str, str], float] = OrderedDict()
+        self._trava = threading.Lock()
+        # O tokenizador rapido do HF nao aceita uso concorrente ("Already
+        # borrowed"): predict e contagem de tokens passam um de cada vez.
+        self._trava_modelo = threading.Lock()
+
+    @property
+    def modelo(self) -> Any:
+        with self._trava:
+            if self._modelo is None:
+                with medir("carregar_reordenador"):
+                    self._modelo = criar_cross_encoder(self.nome_modelo, MAX_TOKENS_PAR)
+            return self._modelo
+
+    def pontuar_lote(
+        self, consultas: List[str], candidatos: List[List[Document]], versao: str = ""
+    ) -> List[List[float]]:
+        notas: List[List[float]] = [[0.0] * len(docs) for docs in candidatos]
+        ausentes: Dict[Tuple[str, str, str], List[Tuple[int, int]]] = {}
+        pares: List[Tuple[str, str]] = []
+        with self._trava:
+            for i, (consulta, documentos) in enumerate(zip(consultas, candidatos)):
+                resumo = hashlib.sha1(
+                    normalizar_pergunta(consulta).encode("utf-8")
+                ).hexdigest()
+                for j, doc in enumerate(documentos):
+                    chave = (versao, resumo, str(doc.metadata.get("id", doc.id)))
+                    nota = self._notas.get(chave)
+                    if nota is not None:
+                        self._notas.move_to_end(chave)
+                        notas[i][j] = nota
+                        continue
+                    if chave not in ausentes:
+                        pares.append((consulta, doc.page_content))
+                    ausentes.setdefault(chave, []).append((i, j))
+        total = sum(len(docs) for docs in candidatos)
+        incrementar("reordenacao_cache_total", total - len(pares), resultado="acerto")
+        incrementar("reordenacao_cache_total", len(pares), resultado="falha")
+        if not pares:
+            return notas
+
+        modelo = self.modelo
+        with self._trava_modelo, medir("reordenar_modelo"):
+            # Todos os pares das consultas do lote passam num predict so.
+            novas = modelo.predict(
+                pares, batch_size=self.tamanho_lote, show_progress_bar=False
+            )
+        with self._trava:
+            for (chave, posicoes), nota in zip(ausentes.items(), novas.tolist()):
+                for i, j in posicoes:
+                    notas[i][j] = nota
+                self._notas[chave] = nota
+            while len(self._notas) > self.max_notas:
+                self._notas.popitem(last=False)
+        return notas
+
+    def contar_tokens(self, textos: List[str]) -> List[int]:
+        if not textos:
+            return []
+        modelo = self.modelo
+        with self._trava_modelo:
+            codificado = modelo.tokenizer(
+                textos,
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )
+        return [len(ids) for ids in codificado["input_ids"]]
+
+    def selecionar(
+        self, documentos: List[Document], notas: List[float], limite: int
+    ) -> List[Document]:
+        ordem = sorted(range(len(documentos)), key=lambda i: notas[i], reverse=True)
+        # O melhor candidato fica mesmo abaixo da nota: a LLM decide se ha evidencia.
+        aprovados = [
+            i for n, i in enumerate(ordem) if n == 0 or notas[i] >= self.nota_minima
+        ][:limite]
+        incrementar(
+            "reordenacao_descartados_total",
+            min(len(ordem), limite) - len(aprovados),
+            motivo="nota",
+        )
+        tokens = self.contar_tokens([documentos[i].page_content for i in aprovados])
+        selecionados: List[Document] = []
+        usados = 0
+        for i, quantidade in zip(aprovados, tokens):
+            if selecionados and usados + quantidade > self.orcamento_tokens:
+                incrementar("reordenacao_descartados_total", motivo="orcamento")
+                continue
+            usados += quantidade
+            documento = documentos[i]
+            documento.metadata["nota_reordenacao"] = round(notas[i], 4)
+            selecionados.append(documento)
+        return selecionados
+
+    def reordenar_lote(
+        self,
+        consultas: List[str],
+        candidatos: List[List[Document]],
+        limite: int,
+        versao: str = "",
+    ) -> List[List[Document]]:
+        with medir("reordenar"):
+            notas = self.pontuar_lote(consultas, candidatos, versao)
+            return [
+                self.selecionar(documentos, notas_consulta, limite)
+                for documentos, notas_consulta in zip(candidatos, notas)
+            ]
@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from armazenamento import (
+    ARQUIVO_CONFIG,
+    IndiceTrechos,
+    converter_legado,
+    formato_atual,
+    ler_config,
+)
+from cache_embeddings import CacheEmbeddings, criar_embeddings
+from configuracao import obter_propriedades
+from metricas import definir, incrementar, medir
+from observabilidade import registrar_evento
+from particoes import ARQUIVO_PARTICOES, IndiceParticionado, ler_particoes
+from reordenador import (
+    CANDIDATOS,
+    NOTA_MINIMA,
+    ORCAMENTO_TOKENS,
+    Reordenador,
+)
+
+# config.json e regravado por ultimo pelo indexador e aponta para os arquivos da versao.
+ARQUIVOS_INDICE = (ARQUIVO_CONFIG, ARQUIVO_PARTICOES)
+CANDIDATOS_POR_RESULTADO = 4
+JANELA_AGRUPAMENTO_SEG = 0.005
+MAX_LOTE_AGRUPAMENTO = 32
+# Limite de espera por um pedido agrupado; evita bloquear o chamador para sempre.
+TIMEOUT_AGRUPAMENTO_SEG = 60.0
+
+_embeddings: Dict[Tuple[str, str], Embeddings] = {}
+_servicos: Dict[Tuple[str, str], "ServicoBusca"] = {}
+_trava = threading.Lock()
+
+
+def obter_embeddings(modelo: str, backend: str = "torch") -> Embeddings:
+    with _trava:
+        embeddings = _embeddings.get((modelo, backend))
+        if embeddings is None:
+            threads = obter_propriedades().get("EMBEDDINGS_THREADS", "0")
+            embeddings = criar_embeddings(
+                modelo, backend=backend, threads=int(threads or 0)
+            )
+            _embeddings[(modelo, backend)] = embeddings
+        return embeddings
+
+
+def aplicar_parametros_busca(
+    index: faiss.Index, tipo: str, parametros: Dict[str, Any]
+) -> None:
+    espaco = faiss.ParameterSpace()
+    if tipo in ("ivf", "ivfpq") and parametros.get("nprobe"):
+        espaco.set_index_parameter(index, "nprobe", int(parametros["nprobe"]))
+    if tipo == "hnsw" and parametros.get("ef_search"):
+        espaco.set_index_parameter(index, "efSearch", int(parametros["ef_search"]))
+
+
+def abrir_indice(pasta_indice: Path, config: Dict[str, Any]) -> IndiceTrechos:
+    indice = IndiceTrechos(pasta_indice, config)
+    aplicar_parametros_busca(
+        indice.index,
+        config.get("tipo_indice", "flat"),
+        config.get("parametros_indice", {}),
+    )
+    return indice
+
+
+def abrir_particoes(
+    pasta_indice: Path, anterior: IndiceTrechos | IndiceParticionado | None = None
+) -> IndiceParticionado:
+    abertas: Dict[str, IndiceTrechos] = {}
+    if isinstance(anterior, IndiceParticionado):
+        abertas = dict(zip(anterior.nomes, anterior.particoes))
+    particoes = []
+    nomes = ler_particoes(pasta_indice)
+    for nome in nomes:
+        config = ler_config(pasta_indice / nome)
+        particao = abertas.get(nome)
+        # Reindexar uma particao so reabre ela; as demais seguem mapeadas.
+        if particao is None or particao.config != config:
+            particao = abrir_indice(pasta_indice / nome, config)
+        particoes.append(particao)
+    return IndiceParticionado(pasta_indice, nomes, particoes)
+
+
+def assinatura_indice(pasta_indice: Path) -> Tuple[Tuple[str, int, int], ...]:
+    assinatura = []
+    # Cada particao regrava o proprio config.json ao ser reindexada.
+    nomes = list(ARQUIVOS_INDICE) + [
+        f"{nome}/{ARQUIVO_CONFIG}" for nome in ler_particoes(pasta_indice)
+    ]
+    for nome in nomes:
+        try:
+            stat = (pasta_indice / nome).stat()
+        except FileNotFoundError:
+            continue
+        assinatura.append((nome, stat.st_mtime_ns, stat.st_size))
+    return tuple(assinatura)
+
+
+class PedidoBusca:
+    __slots__ = ("consulta", "limite", "modo", "vetor", "futuro")
+
+    def __init__(
+        self, consulta: str, limite: int, modo: str, vetor: np.ndarray | None
+    ) -> None:
+        self.consulta = consulta
+        self.limite = limite
+        self.modo = modo
+        self.vetor = vetor
+        self.futuro: Future = Future()
+
+
+class AgrupadorBuscas:
+    def __init__(
+        self,
+        servico: "ServicoBusca",
+        janela_seg: float = JANELA_AGRUPAMENTO_SEG,
+        max_lote: int = MAX_LOTE_AGRUPAMENTO,
+    ) -> None:
+        self.servico = servico
+        self.janela_seg = janela_seg
+        self.max_lote = max_lote
+        self._fila: queue.Queue = queue.Queue()
+        self._trava = threading.Lock()
+        self._pid = 0
+
+    def vetorizar(self, consulta: str) -> np.ndarray:
+        # limite 0: o pedido so precisa do vetor, sem busca no indice.
+        return self._enviar(PedidoBusca(consulta, 0, "vector", None))
+
+    def buscar(
+        self, consulta: str, limite: int, modo: str, vetor: np.ndarray | None
+    ) -> List[Document]:
+        return self._enviar(PedidoBusca(consulta, limite, modo, vetor))
+
+    def _enviar(self, pedido: PedidoBusca) -> Any:
+        self._iniciar()
+        self._fila.put(pedido)
+        with medir("busca_agrupada"):
+            return pedido.futuro.result(timeout=TIMEOUT_AGRUPAMENTO_SEG)
+
+    def _iniciar(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._trava:
+            # Apos fork a thread do agrupador nao existe no processo filho.
+            if self._pid != os.getpid():
+                self._fila = queue.Queue()
+                threading.Thread(
+                    target=self._executar, name="agrupador-buscas", daemon=True
+                ).start()
+                self._pid = os.getpid()
+
+    def _executar(self) -> None:
+        fila = self._fila
+        while True:
+            pedidos = [fila.get()]
+            while len(pedidos) < self.max_lote and not fila.empty():
+                pedidos.append(fila.get_nowait())
+            # Pedido sozinho (fila vazia) sai na hora; a janela so espera por mais
+            # quando ja chegaram pedidos juntos, isto e, sob carga.
+            prazo = time.monotonic() + self.janela_seg if len(pedidos) > 1 else 0
+            while len(pedidos) < self.max_lote:
+                restante = prazo - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    pedidos.append(fila.get(timeout=restante))
+                except queue.Empty:
+                    break
+            self._processar(pedidos)
+
+    def _processar(self, pedidos: List[PedidoBusca]) -> None:
+        try:
+            self._processar_lote(pedidos)
+        except Exception as exc:
+            # Uma falha fora das buscas nao pode deixar pedidos sem resposta nem
+            # derrubar a unica thread do agrupador.
+            incrementar("erros_total", etapa="busca_agrupada")
+            for pedido in pedidos:
+                if not pedido.futuro.done():
+                    pedido.futuro.set_exception(exc)
+
+    def _processar_lote(self, pedidos: List[PedidoBusca]) -> None:
+        incrementar("busca_agrupada_lotes_total")
+        incrementar("busca_agrupada_pedidos_total", len(pedidos))
+        definir("busca_agrupada_ultimo_lote", len(pedidos))
+        with medir("busca_agrupada_lote"):
+            sem_vetor = [
+                pedido
+                for pedido in pedidos
+                if pedido.vetor is None and pedido.modo != "bm25"
+            ]
+            if sem_vetor:
+                try:
+                    vetores = self.servico.vetorizar_lote(
+                        [pedido.consulta for pedido in sem_vetor]
+                    )
+                except Exception as exc:
+                    for pedido in sem_vetor:
+                        pedido.futuro.set_exception(exc)
+                    pedidos = [pedido for pedido in pedidos if not pedido.futuro.done()]
+                else:
+                    for pedido, vetor in zip(sem_vetor, vetores):
+                        pedido.vetor = vetor
+
+            grupos: Dict[Tuple[int, str], List[PedidoBusca]] = {}
+            for pedido in pedidos:
+                if pedido.limite == 0:
+                    pedido.futuro.set_result(pedido.vetor)
+                else:
+                    grupos.setdefault((pedido.limite, pedido.modo), []).append(pedido)
+
+            for (limite, modo), grupo in grupos.items():
+                try:
+                    vetores = None
+                    if modo != "bm25":
+                        vetores = np.stack([pedido.vetor for pedido in grupo])
+                    resultados = self.servico.buscar_vetores(
+                        [pedido.consulta for pedido in grupo], vetores, limite, modo
+                    )
+                except Exception as exc:
+                    for pedido in grupo:
+                        pedido.futuro.set_exception(exc)
+                    continue
+                for pedido, documentos in zip(grupo, resultados):
+                    pedido.futuro.set_result(documentos)
+
+
+class ServicoBusca:
+    def __init__(
+        self,
+        pasta_indice: Path,
+        modelo: str,
+        intervalo_verificacao: float = 1.0,
+        janela_agrupamento_seg: float = 0.0,
+        max_lote_agrupamento: int = MAX_LOTE_AGRUPAMENTO,
+        reordenador: Reordenador | None = None,
+    ) -> None:
+        self.pasta_indice = pasta_indice
+        self.modelo = modelo
+        self.intervalo_verificacao = intervalo_verificacao
+        # Consultas simultaneas dentro da janela viram um encode e um search so.
+        self.agrupador: AgrupadorBuscas | None = None
+        if janela_agrupamento_seg > 0 and max_lote_agrupamento > 1:
+            self.agrupador = AgrupadorBuscas(
+                self, janela_agrupamento_seg, max_lote_agrupamento
+            )
+        # Com reordenador, a busca traz mais candidatos e o cross-encoder escolhe.
+        self.reordenador = reordenador
+        self._trava = threading.Lock()
+        self._indice: IndiceTrechos | IndiceParticionado | None = None
+        self._assinatura: Tuple[Tuple[str, int, int], ...] = ()
+        self._verificado_em = 0.0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        # A consulta usa o mesmo backend que gerou os vetores do indice.
+        backend = self.indice().config.get("backend_embeddings", "torch")
+        return obter_embeddings(self.modelo, backend)
+
+    def indice(self) -> IndiceTrechos | IndiceParticionado:
+        indice = self._indice
+        agora = time.monotonic()
+        recente = agora - self._verificado_em < self.intervalo_verificacao
+        if indice is not None and recente:
+            return indice
+
+        assinatura = assinatura_indice(self.pasta_indice)
+        if indice is not None and assinatura == self._assinatura:
+            self._verificado_em = agora
+            return indice
+
+        with self._trava:
+            if self._indice is None or assinatura != self._assinatura:
+                self._carregar(assinatura)
+            self._verificado_em = time.monotonic()
+            return self._indice
+
+    def _carregar(self, assinatura: Tuple[Tuple[str, int, int], ...]) -> None:
+        inicio = time.time()
+        try:
+            if (self.pasta_indice / ARQUIVO_PARTICOES).exists():
+                with medir("carregar_indice"):
+                    indice = abrir_particoes(self.pasta_indice, self._indice)
+            else:
+                config = ler_config(self.pasta_indice)
+                if not formato_atual(config):
+                    config = converter_legado(
+                        self.pasta_indice, obter_embeddings(self.modelo)
+                    )
+                    registrar_evento(
+                        "indice_convertido", pasta_indice=str(self.pasta_indice)
+                    )
+                    assinatura = assinatura_indice(self.pasta_indice)
+                with medir("carregar_indice"):
+                    indice = abrir_indice(self.pasta_indice, config)
+        except Exception as exc:
+            # Indice pode estar sendo regravado; mantem a versao anterior se houver.
+            registrar_evento(
+                "indice_falha_carga",
+                pasta_indice=str(self.pasta_indice),
+                erro=str(exc),
+            )
+            if self._indice is None:
+                raise
+            return
+
+        if assinatura_indice(self.pasta_indice) == assinatura:
+            self._assinatura = assinatura
+        recarga = self._indice is not None
+        self._indice = indice
+        definir("indice_trechos", indice.total, pasta_indice=str(self.pasta_indice))
+        registrar_evento(
+            "indice_carregado",
+            pasta_indice=str(self.pasta_indice),
+            modelo_embeddings=self.modelo,
+            recarga=recarga,
+            versao=indice.versao,
+            total_trechos=indice.total,
+            duracao_seg=round(time.time() - inicio, 3),
+        )
+
+    def vetorizar(self, consulta: str) -> np.ndarray:
+        if self.agrupador is not None:
+            return self.agrupador.vetorizar(consulta)
+        return self.vetorizar_lote([consulta])[0]
+
+    def vetorizar_lote(self, consultas: List[str]) -> np.ndarray:
+        embeddings = self.embeddings
+        with medir("embedding_consulta"):
+            if len(consultas) == 1:
+                vetores = [embeddings.embed_query(consultas[0])]
+            elif isinstance(embeddings, CacheEmbeddings):
+                vetores = embeddings.embed_consultas(consultas)
+            else:
+                vetores = embeddings.embed_documents(consultas)
+        return np.asarray(vetores, dtype=np.float32)
+
+    def buscar(
+        self,
+        consulta: str,
+        limite: int,
+        modo: str = "vector",
+        vetor: np.ndarray | None = None,
+    ) -> List[Document]:
+        if self.agrupador is not None:
+            return self.agrupador.buscar(consulta, limite, modo, vetor)
+        vetores = None
+        if modo != "bm25":
+            if vetor is None:
+                vetores = self.vetorizar_lote([consulta])
+            else:
+                vetores = np.asarray(vetor, dtype=np.float32).reshape(1, -1)
+        return self.buscar_vetores([consulta], vetores, limite, modo)[0]
+
+    def buscar_lote(
+        self, consultas: List[str], limite: int, modo: str = "vector"
+    ) -> List[List[Document]]:
+        vetores = None
+        if modo != "bm25":
+            vetores = self.vetorizar_lote(consultas)
+        return self.buscar_vetores(consultas, vetores, limite, modo)
+
+    def buscar_vetores(
+        self,
+        consultas: List[str],
+        vetores: np.ndarray | None,
+        limite: int,
+        modo: str,
+    ) -> List[List[Document]]:
+        indice = self.indice()
+        final = limite
+        if self.reordenador is not None:
+            limite = max(limite, self.reordenador.candidatos)
+        if vetores is None:
+            resultados = [
+                [indice.documento(i) for i in indice.buscar_lexico(consulta, limite)]
+                for consulta in consultas
+            ]
+        elif modo == "hybrid":
+            candidatos = max(limite * CANDIDATOS_POR_RESULTADO, 20)
+            resultados = indice.buscar_hibrido(vetores, consultas, limite, candidatos)
+        else:
+            resultados = indice.buscar(vetores, limite)
+        if self.reordenador is None:
+            return resultados
+        return self.reordenador.reordenar_lote(
+            consultas, resultados, final, indice.versao
+        )
+
+
+def criar_reordenador(propriedades: Dict[str, str]) -> Reordenador | None:
+    modelo = propriedades.get("REORDENAR_MODELO", "").strip()
+    if not modelo:
+        return None
+    return Reordenador(
+        modelo,
+        candidatos=int(propriedades.get("REORDENAR_CANDIDATOS", CANDIDATOS)),
+        nota_minima=float(propriedades.get("REORDENAR_NOTA_MINIMA", NOTA_MINIMA)),
+        orcamento_tokens=int(
+            propriedades.get("REORDENAR_ORCAMENTO_TOKENS", ORCAMENTO_TOKENS)
+        ),
+    )
+
+
+def obter_servico(pasta_indice: Path, modelo: str) -> ServicoBusca:
+    chave = (str(pasta_indice.resolve()), modelo)
+    with _trava:
+        servico = _servicos.get(chave)
+        if servico is None:
+            propriedades = obter_propriedades()
+            janela_ms = propriedades.get(
+                "BUSCA_AGRUPAR_JANELA_MS", str(JANELA_AGRUPAMENTO_SEG * 1000)
+            )
+            max_lote = propriedades.get("BUSCA_AGRUPAR_MAX", str(MAX_LOTE_AGRUPAMENTO))
+            servico = ServicoBusca(
+                pasta_indice,
+                modelo,
+                janela_agrupamento_seg=float(janela_ms) / 1000,
+                max_lote_agrupamento=int(max_lote),
+                reordenador=criar_reordenador(propriedades),
+            )
+            _servicos[chave] = servico
+        return servico
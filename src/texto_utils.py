@@ -1,7 +1,25 @@
 from __future__ import annotations
 
 import re
-from typing import List, Tuple
+import unicodedata
+from bisect import bisect_left
+from typing import Any, Iterator, List, Tuple
+
+PALAVRAS_VAZIAS = frozenset(
+    """
+    a o as os ao aos um uma uns umas de da do das dos em na no nas nos por pela
+    pelo pelas pelos para com sem e ou que se como mas mais ja nao sua seu suas
+    seus este esta estes estas esse essa esses essas isso isto ele ela eles elas
+    entre sobre ate quando qual quais ser sao foi tem ha
+    """.split()
+)
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+TITULO_RE = re.compile(r"^(clausula|capitulo|secao|titulo)\b", re.IGNORECASE)
+FINS_DE_FRASE = (". ", "? ", "! ", "; ", ": ")
+FIM_FRASE_RE = re.compile(r"[.?!;:](?= )|(?=\n)")
+ESPACO_RE = re.compile(r"\s")
+MODOS_FATIAMENTO = ("compativel", "frases")
+LOTE_TOKENIZACAO = 256
 
 
 def limpar_texto(texto: str) -> str:
@@ -12,76 +30,407 @@ def limpar_texto(texto: str) -> str:
 
 
 def separar_secoes(texto: str) -> List[Tuple[str, str]]:
-    linhas = [linha.strip() for linha in texto.split("\n")]
     secoes: List[Tuple[str, str]] = []
     titulo_atual = "Sem titulo"
     linhas_atuais: List[str] = []
-
-    def flush():
-        nonlocal linhas_atuais, titulo_atual
-        conteudo = "\n".join([l for l in linhas_atuais if l])
-        if conteudo:
-            secoes.append((titulo_atual, conteudo))
-        linhas_atuais = []
-
-    heading_re = re.compile(
-        r"^(clausula|capitulo|secao|titulo)\b", re.IGNORECASE
-    )
-
-    for linha in linhas:
+    for linha in texto.split("\n"):
+        linha = linha.strip()
         if not linha:
-            linhas_atuais.append("")
             continue
-        e_titulo = bool(heading_re.match(linha)) or (
-            len(linha) <= 80 and linha.isupper()
-        )
-        if e_titulo:
-            flush()
+        if TITULO_RE.match(linha) or (len(linha) <= 80 and linha.isupper()):
+            if linhas_atuais:
+                secoes.append((titulo_atual, "\n".join(linhas_atuais)))
+                linhas_atuais = []
             titulo_atual = linha
         else:
             linhas_atuais.append(linha)
-
-    flush()
+    if linhas_atuais:
+        secoes.append((titulo_atual, "\n".join(linhas_atuais)))
     return secoes or [("Sem titulo", texto)]
 
 
+def aparar(texto: str, inicio: int, fim: int) -> Tuple[int, int]:
+    while inicio < fim and texto[inicio].isspace():
+        inicio += 1
+    while fim > inicio and texto[fim - 1].isspace():
+        fim -= 1
+    return inicio, fim
+
+
+def paragrafos(texto: str) -> Iterator[Tuple[int, int]]:
+    # Mesmo resultado de re.split(r"\n{2,}") + strip, sem copiar os paragrafos.
+    inicio = 0
+    while True:
+        separador = texto.find("\n\n", inicio)
+        fim = len(texto) if separador < 0 else separador
+        trecho = aparar(texto, inicio, fim)
+        if trecho[0] < trecho[1]:
+            yield trecho
+        if separador < 0:
+            return
+        inicio = separador + 2
+
+
+def ponto_corte(texto: str, inicio: int, limite: int) -> int:
+    # Prefere fim de frase na metade final do espaco; senao, fim de palavra.
+    metade = inicio + (limite - inicio) // 2
+    fim_frase = max(
+        max(texto.rfind(sinal, metade, limite + 1) for sinal in FINS_DE_FRASE) + 1,
+        texto.rfind("\n", metade + 1, limite + 1),
+    )
+    if fim_frase > metade:
+        return fim_frase
+    espaco = max(
+        texto.rfind(" ", inicio + 1, limite + 1),
+        texto.rfind("\n", inicio + 1, limite + 1),
+    )
+    return espaco if espaco > inicio else -1
+
+
+def inicio_sobreposicao(texto: str, inicio: int, fim: int) -> int:
+    achado = FIM_FRASE_RE.search(texto, inicio, fim)
+    if achado is not None:
+        inicio = achado.end()
+    elif inicio > 0 and not texto[inicio - 1].isspace():
+        espaco = ESPACO_RE.search(texto, inicio, fim)
+        inicio = espaco.start() if espaco is not None else fim
+    return aparar(texto, inicio, fim)[0]
+
+
+class FatiadorTrechos:
+    def __init__(
+        self,
+        max_caracteres: int = 1200,
+        sobreposicao: int = 200,
+        modo: str = "compativel",
+    ) -> None:
+        if modo not in MODOS_FATIAMENTO:
+            raise ValueError(f"Modo de fatiamento invalido: {modo}")
+        self.max_caracteres = max_caracteres
+        self.sobreposicao = sobreposicao
+        self.modo = modo
+        self.trechos: List[dict] = []
+        # Partes do trecho atual como [texto, inicio, fim, paragrafo]; a string
+        # do trecho so e montada ao emitir.
+        self._partes: List[List[Any]] = []
+        self._tamanho = 0
+        self._titulo = ""
+        self._so_sobreposicao = False
+        self._paragrafo = 0
+
+    def adicionar_secao(self, titulo: str, conteudo: str) -> None:
+        if self.modo == "compativel":
+            self._adicionar_compativel(titulo, conteudo)
+            return
+        for inicio, fim in paragrafos(conteudo):
+            self._paragrafo += 1
+            self._adicionar_frases(titulo, conteudo, inicio, fim)
+
+    def finalizar(self) -> List[dict]:
+        self._emitir()
+        self._limpar()
+        return self.trechos
+
+    def _adicionar_compativel(self, titulo: str, texto: str) -> None:
+        maximo = self.max_caracteres
+        for inicio, fim in paragrafos(texto):
+            tamanho = fim - inicio
+            total = self._tamanho + 2 + tamanho if self._partes else tamanho
+            if total > maximo:
+                self._emitir()
+                if tamanho > maximo:
+                    # Corte fixo com passo max - sobreposicao, como no fatiamento
+                    # original.
+                    for posicao in range(inicio, fim, maximo - self.sobreposicao):
+                        parte = texto[posicao : min(posicao + maximo, fim)]
+                        self.trechos.append({"title": titulo, "text": parte})
+                    continue
+                total = tamanho
+            self._partes.append([texto, inicio, fim, 0])
+            self._tamanho = total
+            self._titulo = titulo
+
+    def _adicionar_frases(
+        self, titulo: str, texto: str, inicio: int, fim: int
+    ) -> None:
+        if self._tamanho_com(texto, inicio, fim) <= self.max_caracteres:
+            self._anexar(titulo, texto, inicio, fim)
+            return
+        if fim - inicio <= self.max_caracteres:
+            self._emitir()
+            if self._tamanho_com(texto, inicio, fim) > self.max_caracteres:
+                self._limpar()
+            self._anexar(titulo, texto, inicio, fim)
+            return
+
+        posicao = inicio
+        while posicao < fim:
+            livre = self.max_caracteres - (
+                self._tamanho_com(texto, posicao, fim) - (fim - posicao)
+            )
+            if fim - posicao <= livre:
+                self._anexar(titulo, texto, posicao, fim)
+                return
+            corte = ponto_corte(texto, posicao, posicao + livre) if livre > 0 else -1
+            if corte <= posicao:
+                # Sem ponto de corte no espaco livre: fecha o trecho e tenta num novo,
+                # primeiro com a sobreposicao e depois sem ela.
+                if self._partes and not self._so_sobreposicao:
+                    self._emitir()
+                    continue
+                if self._partes:
+                    self._limpar()
+                    continue
+                # Palavra maior que o trecho inteiro: nao ha como evitar o corte.
+                corte = posicao + self.max_caracteres
+            self._anexar(titulo, texto, *aparar(texto, posicao, corte))
+            self._emitir()
+            posicao = aparar(texto, corte, fim)[0]
+
+    def _tamanho_com(self, texto: str, inicio: int, fim: int) -> int:
+        if not self._partes:
+            return fim - inicio
+        ultima = self._partes[-1]
+        if ultima[0] is texto and ultima[3] == self._paragrafo:
+            return self._tamanho + fim - ultima[2]
+        return self._tamanho + 2 + fim - inicio
+
+    def _anexar(self, titulo: str, texto: str, inicio: int, fim: int) -> None:
+        tamanho = self._tamanho_com(texto, inicio, fim)
+        ultima = self._partes[-1] if self._partes else None
+        if ultima is not None and ultima[0] is texto and ultima[3] == self._paragrafo:
+            # Continuacao do mesmo paragrafo: o espaco original entre as frases fica.
+            ultima[2] = fim
+        else:
+            self._partes.append([texto, inicio, fim, self._paragrafo])
+        self._tamanho = tamanho
+        self._titulo = titulo
+        self._so_sobreposicao = False
+
+    def _emitir(self) -> None:
+        if not self._partes or self._so_sobreposicao:
+            return
+        if len(self._partes) == 1:
+            origem, inicio, fim, _ = self._partes[0]
+            texto = origem[inicio:fim]
+        else:
+            texto = "\n\n".join(
+                origem[inicio:fim] for origem, inicio, fim, _ in self._partes
+            )
+        self.trechos.append({"title": self._titulo or "Sem titulo", "text": texto})
+        if self.modo == "frases":
+            self._sobrepor()
+        else:
+            self._limpar()
+
+    def _sobrepor(self) -> None:
+        texto, inicio, fim, paragrafo = self._partes[-1]
+        if self.sobreposicao <= 0 or self._tamanho <= self.sobreposicao:
+            self._limpar()
+            return
+        corte = inicio
+        if fim - inicio > self.sobreposicao:
+            corte = inicio_sobreposicao(texto, fim - self.sobreposicao, fim)
+        if corte >= fim:
+            self._limpar()
+            return
+        self._partes = [[texto, corte, fim, paragrafo]]
+        self._tamanho = fim - corte
+        self._so_sobreposicao = True
+
+    def _limpar(self) -> None:
+        self._partes = []
+        self._tamanho = 0
+        self._so_sobreposicao = False
+
+
 def fatiar_secoes(
     secoes: List[Tuple[str, str]],
     max_caracteres: int = 1200,
     sobreposicao: int = 200,
+    modo: str = "compativel",
 ) -> List[dict]:
-    chunks: List[dict] = []
-    buffer = ""
-    buffer_titulo = ""
-
-    def flush():
-        nonlocal buffer
-        if buffer.strip():
-            chunks.append(
-                {"title": buffer_titulo or "Sem titulo", "text": buffer.strip()}
+    fatiador = FatiadorTrechos(max_caracteres, sobreposicao, modo)
+    for titulo, conteudo in secoes:
+        fatiador.adicionar_secao(titulo, conteudo)
+    return fatiador.finalizar()
+
+
+class FatiadorTokens:
+    def __init__(
+        self, tokenizador: Any, max_tokens: int, sobreposicao: int = 0
+    ) -> None:
+        if max_tokens <= 0:
+            raise ValueError("max_tokens deve ser positivo")
+        self.tokenizador = tokenizador
+        self.max_tokens = max_tokens
+        self.sobreposicao = max(0, min(sobreposicao, max_tokens // 2))
+        self.trechos: List[dict] = []
+        # Partes como [texto, inicio, fim, paragrafo, inicios dos tokens].
+        self._partes: List[List[Any]] = []
+        self._tokens = 0
+        self._titulo = ""
+        self._so_sobreposicao = False
+        self._paragrafo = 0
+
+    def adicionar_secoes(self, secoes: List[Tuple[str, str]]) -> None:
+        itens = [
+            (titulo, conteudo, inicio, fim)
+            for titulo, conteudo in secoes
+            for inicio, fim in paragrafos(conteudo)
+        ]
+        for posicao in range(0, len(itens), LOTE_TOKENIZACAO):
+            lote = itens[posicao : posicao + LOTE_TOKENIZACAO]
+            # Uma chamada por lote: o tokenizador rapido processa a lista em paralelo.
+            codificado = self.tokenizador(
+                [conteudo[inicio:fim] for _, conteudo, inicio, fim in lote],
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                return_attention_mask=False,
+                return_token_type_ids=False,
             )
-            if sobreposicao > 0 and len(buffer) > sobreposicao:
-                buffer = buffer[-sobreposicao:]
-            else:
-                buffer = ""
+            for (titulo, conteudo, inicio, fim), deslocamentos in zip(
+                lote, codificado["offset_mapping"]
+            ):
+                inicios = [inicio + comeco for comeco, _ in deslocamentos]
+                self._paragrafo += 1
+                self._adicionar_paragrafo(titulo, conteudo, inicio, fim, inicios)
 
-    for titulo, conteudo in secoes:
-        paragrafos = [p.strip() for p in re.split(r"\n{2,}", conteudo) if p.strip()]
-        for p in paragrafos:
-            candidato = (buffer + "\n\n" + p).strip() if buffer else p
-            if len(candidato) > max_caracteres:
-                flush()
-                if len(p) > max_caracteres:
-                    for i in range(0, len(p), max_caracteres - sobreposicao):
-                        parte = p[i : i + max_caracteres]
-                        chunks.append({"title": titulo, "text": parte})
-                    buffer = ""
-                else:
-                    buffer = p
-                    buffer_titulo = titulo
-            else:
-                buffer = candidato
-                buffer_titulo = titulo
-
-    flush()
-    return chunks
+    def finalizar(self) -> List[dict]:
+        self._emitir()
+        self._limpar()
+        return self.trechos
+
+    def _adicionar_paragrafo(
+        self, titulo: str, texto: str, inicio: int, fim: int, inicios: List[int]
+    ) -> None:
+        tokens = len(inicios)
+        if self._tokens + tokens <= self.max_tokens:
+            self._anexar(titulo, texto, inicio, fim, inicios)
+            return
+        if tokens <= self.max_tokens:
+            self._emitir()
+            if self._tokens + tokens > self.max_tokens:
+                self._limpar()
+            self._anexar(titulo, texto, inicio, fim, inicios)
+            return
+
+        posicao = inicio
+        while posicao < fim:
+            primeiro = bisect_left(inicios, posicao)
+            livre = self.max_tokens - self._tokens
+            if len(inicios) - primeiro <= livre:
+                self._anexar(titulo, texto, posicao, fim, inicios)
+                return
+            corte = -1
+            if livre > 0:
+                # O corte fica antes do primeiro token que nao cabe.
+                limite = inicios[primeiro + livre]
+                corte = ponto_corte(texto, posicao, limite)
+            if corte <= posicao:
+                if self._partes and not self._so_sobreposicao:
+                    self._emitir()
+                    continue
+                if self._partes:
+                    self._limpar()
+                    continue
+                # Palavra com mais tokens que o trecho: corta entre tokens.
+                corte = inicios[primeiro + self.max_tokens]
+            self._anexar(titulo, texto, *aparar(texto, posicao, corte), inicios)
+            self._emitir()
+            posicao = aparar(texto, corte, fim)[0]
+
+    def _anexar(
+        self, titulo: str, texto: str, inicio: int, fim: int, inicios: List[int]
+    ) -> None:
+        self._tokens += bisect_left(inicios, fim) - bisect_left(inicios, inicio)
+        ultima = self._partes[-1] if self._partes else None
+        if ultima is not None and ultima[3] == self._paragrafo:
+            ultima[2] = fim
+        else:
+            self._partes.append([texto, inicio, fim, self._paragrafo, inicios])
+        self._titulo = titulo
+        self._so_sobreposicao = False
+
+    def _emitir(self) -> None:
+        if not self._partes or self._so_sobreposicao:
+            return
+        texto = "\n\n".join(
+            origem[inicio:fim] for origem, inicio, fim, _, _ in self._partes
+        )
+        self.trechos.append({"title": self._titulo or "Sem titulo", "text": texto})
+        self._sobrepor()
+
+    def _sobrepor(self) -> None:
+        texto, inicio, fim, paragrafo, inicios = self._partes[-1]
+        if self.sobreposicao <= 0 or self._tokens <= self.sobreposicao:
+            self._limpar()
+            return
+        primeiro = bisect_left(inicios, inicio)
+        ultimo = bisect_left(inicios, fim)
+        corte = inicio
+        if ultimo - primeiro > self.sobreposicao:
+            corte = inicio_sobreposicao(texto, inicios[ultimo - self.sobreposicao], fim)
+        if corte >= fim:
+            self._limpar()
+            return
+        self._partes = [[texto, corte, fim, paragrafo, inicios]]
+        self._tokens = ultimo - bisect_left(inicios, corte)
+        self._so_sobreposicao = True
+
+    def _limpar(self) -> None:
+        self._partes = []
+        self._tokens = 0
+        self._so_sobreposicao = False
+
+
+def fatiar_secoes_tokens(
+    secoes: List[Tuple[str, str]],
+    tokenizador: Any,
+    max_tokens: int,
+    sobreposicao: int = 0,
+) -> List[dict]:
+    fatiador = FatiadorTokens(tokenizador, max_tokens, sobreposicao)
+    fatiador.adicionar_secoes(secoes)
+    return fatiador.finalizar()
+
+
+def remover_acentos(texto: str) -> str:
+    decomposto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def normalizar_pergunta(texto: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", remover_acentos(texto).lower()))
+
+
+def reduzir_plural(token: str) -> str:
+    if len(token) <= 3 or not token.endswith("s"):
+        return token
+    if token.endswith(("oes", "aes")):
+        return token[:-3] + "ao"
+    if token.endswith("ais"):
+        return token[:-2] + "l"
+    if token.endswith("eis"):
+        return token[:-3] + "el"
+    if token.endswith("ns"):
+        return token[:-2] + "m"
+    if token.endswith(("ss", "us", "is")):
+        return token
+    return token[:-1]
+
+
+def tokenizar(texto: str) -> List[str]:
+    tokens: List[str] = []
+    for token in TOKEN_RE.findall(remover_acentos(texto).lower()):
+        if token in PALAVRAS_VAZIAS:
+            continue
+        if token.isalpha():
+            tokens.append(reduzir_plural(token))
+            continue
+        tokens.append(token)
+        # Codigos como "5.2.1" ou "AUTO-123" tambem casam pelas partes.
+        partes = re.split(r"[./-]", token)
+        if len(partes) > 1:
+            tokens.extend(p for p in partes if p not in PALAVRAS_VAZIAS)
+    return tokens
@@ -1,15 +1,29 @@
 from __future__ import annotations
 
 import json
+import time
 from pathlib import Path
-from typing import Any, Dict, List
-
-from flask import Flask, jsonify, render_template_string, request
-
-from consultar import buscar, gerar_resposta, montar_fontes
+from typing import Any, Dict, Iterator, List
+
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    render_template_string,
+    request,
+    stream_with_context,
+)
+
+from consultar import responder, responder_em_partes
+from metricas import exportar_prometheus, incrementar, medir, rastrear, resumir_etapas
+from observabilidade import registrar_evento
+from servico_busca import obter_servico
 
 app = Flask(__name__)
 
+PASTA_INDICE = Path("index")
+MODELO_EMBEDDINGS = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
 
 HTML = """
 <!doctype html>
@@ -57,24 +71,58 @@ HTML = """
         chat.scrollTop = chat.scrollHeight;
       }
 
+      function lerEvento(bloco) {
+        let evento = "message";
+        const dados = [];
+        bloco.split("\n").forEach((linha) => {
+          if (linha.startsWith("event:")) evento = linha.slice(6).trim();
+          if (linha.startsWith("data:")) dados.push(linha.slice(5).trim());
+        });
+        return { evento, dados: JSON.parse(dados.join("\n") || "null") };
+      }
+
       form.addEventListener("submit", async (e) => {
         e.preventDefault();
         const texto = input.value.trim();
         if (!texto) return;
         addMsg("Voce: " + texto, "user");
         input.value = "";
-        const resp = await fetch("/chat", {
+        const resp = await fetch("/chat/stream", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify({ mensagem: texto })
         });
-        const data = await resp.json();
-        if (data.erro) {
+        if (!resp.ok) {
+          const data = await resp.json();
           addMsg("Erro: " + data.erro, "bot");
           return;
         }
-        addMsg("Resposta: " + data.resposta, "bot");
-        (data.fontes || []).forEach(addFonte);
+        let fontes = [];
+        let resposta = null;
+        let buffer = "";
+        const leitor = resp.body.getReader();
+        const decoder = new TextDecoder();
+        while (true) {
+          const { value, done } = await leitor.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let fim;
+          while ((fim = buffer.indexOf("\n\n")) >= 0) {
+            const { evento, dados } = lerEvento(buffer.slice(0, fim));
+            buffer = buffer.slice(fim + 2);
+            if (evento === "fontes") fontes = dados;
+            if (evento === "token") {
+              if (!resposta) {
+                addMsg("Resposta: ", "bot");
+                resposta = chat.lastChild;
+              }
+              resposta.textContent += dados;
+              chat.scrollTop = chat.scrollHeight;
+            }
+            if (evento === "erro") addMsg("Erro: " + dados, "bot");
+          }
+        }
+        fontes.forEach(addFonte);
       });
     </script>
   </body>
@@ -98,24 +146,78 @@ def chat() -> Any:
     if not mensagem:
         return jsonify({"erro": "Mensagem vazia."}), 400
 
-    try:
-        documentos = buscar(
-            mensagem,
-            Path("index"),
-            "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            5,
-        )
-        resposta = gerar_resposta(mensagem, documentos, None)
-        fontes = montar_fontes(documentos)
-        return jsonify(
-            {
-                "resposta": limpar_saida(resposta),
-                "fontes": fontes,
-            }
+    inicio = time.time()
+    with rastrear() as etapas, medir("chat"):
+        try:
+            resposta, fontes, cache = responder(
+                mensagem, PASTA_INDICE, MODELO_EMBEDDINGS, 5
+            )
+        except Exception as exc:
+            incrementar("erros_total", etapa="chat")
+            return jsonify({"erro": str(exc)}), 500
+    registrar_evento(
+        "chat_fim",
+        cache=cache,
+        etapas=resumir_etapas(etapas),
+        duracao_seg=round(time.time() - inicio, 3),
+    )
+    return jsonify(
+        {
+            "resposta": limpar_saida(resposta),
+            "fontes": fontes,
+        }
+    )
+
+
+def evento_sse(evento: str, dados: Any) -> str:
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+
+@app.post("/chat/stream")
+def chat_stream() -> Any:
+    payload: Dict[str, Any] = request.get_json(force=True) or {}
+    mensagem = str(payload.get("mensagem", "")).strip()
+    if not mensagem:
+        return jsonify({"erro": "Mensagem vazia."}), 400
+
+    def gerar() -> Iterator[str]:
+        inicio = time.time()
+        cache = ""
+        with rastrear() as etapas, medir("chat_stream"):
+            try:
+                for tipo, valor in responder_em_partes(
+                    mensagem, PASTA_INDICE, MODELO_EMBEDDINGS, 5
+                ):
+                    if tipo == "token":
+                        valor = limpar_saida(valor)
+                    if tipo == "fim":
+                        cache = valor
+                        valor = {"cache": valor}
+                    yield evento_sse(tipo, valor)
+            except Exception as exc:
+                incrementar("erros_total", etapa="chat_stream")
+                yield evento_sse("erro", str(exc))
+                return
+        registrar_evento(
+            "chat_fim",
+            stream=True,
+            cache=cache,
+            etapas=resumir_etapas(etapas),
+            duracao_seg=round(time.time() - inicio, 3),
         )
-    except Exception as exc:
-        return jsonify({"erro": str(exc)}), 500
+
+    return Response(
+        stream_with_context(gerar()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(exportar_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
+    obter_servico(PASTA_INDICE, MODELO_EMBEDDINGS).indice()
     app.run(host="127.0.0.1", port=5000, debug=False)
@@ -0,0 +1,420 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from consultar import buscar, consultar_cache, montar_fontes
+from gerador_respostas import obter_gerador
+from metricas import (
+    definir,
+    exportar_prometheus,
+    incrementar,
+    medir,
+    rastrear,
+    resumir_etapas,
+)
+from observabilidade import descarregar_metricas, registrar_evento
+from servico_busca import MAX_LOTE_AGRUPAMENTO, obter_servico
+from web import HTML, MODELO_EMBEDDINGS, PASTA_INDICE, evento_sse, limpar_saida
+
+LIMITE_FONTES = 5
+MAX_EM_ANDAMENTO = 512
+TIMEOUT_SEG = 60.0
+WORKERS_BUSCA = MAX_LOTE_AGRUPAMENTO
+PRAZO_ENCERRAMENTO_SEG = 30.0
+TAMANHO_MAXIMO_CORPO = 64 * 1024
+
+Receber = Callable[[], Awaitable[Dict[str, Any]]]
+Enviar = Callable[[Dict[str, Any]], Awaitable[None]]
+Cabecalhos = List[Tuple[bytes, bytes]]
+
+CABECALHOS_SSE: Cabecalhos = [
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+
+class ErroRequisicao(Exception):
+    def __init__(self, status: int, mensagem: str) -> None:
+        super().__init__(mensagem)
+        self.status = status
+
+
+async def ler_corpo(receber: Receber, limite: int) -> bytes:
+    partes = []
+    tamanho = 0
+    while True:
+        mensagem = await receber()
+        if mensagem["type"] == "http.disconnect":
+            raise ErroRequisicao(400, "Conexao encerrada pelo cliente.")
+        corpo = mensagem.get("body", b"")
+        tamanho += len(corpo)
+        if tamanho > limite:
+            raise ErroRequisicao(413, "Requisicao muito grande.")
+        partes.append(corpo)
+        if not mensagem.get("more_body", False):
+            return b"".join(partes)
+
+
+def ler_mensagem(corpo: bytes) -> str:
+    try:
+        payload = json.loads(corpo or b"{}")
+    except ValueError:
+        raise ErroRequisicao(400, "JSON invalido.") from None
+    if not isinstance(payload, dict):
+        raise ErroRequisicao(400, "JSON invalido.")
+    mensagem = str(payload.get("mensagem", "")).strip()
+    if not mensagem:
+        raise ErroRequisicao(400, "Mensagem vazia.")
+    return mensagem
+
+
+async def iniciar_resposta(
+    enviar: Enviar, status: int, tipo: str, cabecalhos: Cabecalhos | None = None
+) -> None:
+    await enviar(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", tipo.encode())] + (cabecalhos or []),
+        }
+    )
+
+
+async def enviar_corpo(enviar: Enviar, corpo: bytes, fim: bool = True) -> None:
+    await enviar({"type": "http.response.body", "body": corpo, "more_body": not fim})
+
+
+async def enviar_resposta(
+    enviar: Enviar,
+    status: int,
+    corpo: bytes,
+    tipo: str,
+    cabecalhos: Cabecalhos | None = None,
+) -> None:
+    await iniciar_resposta(enviar, status, tipo, cabecalhos)
+    await enviar_corpo(enviar, corpo)
+
+
+async def enviar_json(
+    enviar: Enviar,
+    status: int,
+    dados: Dict[str, Any],
+    cabecalhos: Cabecalhos | None = None,
+) -> None:
+    corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+    await enviar_resposta(
+        enviar, status, corpo, "application/json; charset=utf-8", cabecalhos
+    )
+
+
+class AppChatAsync:
+    def __init__(
+        self,
+        pasta_indice: Path = PASTA_INDICE,
+        modelo_embeddings: str = MODELO_EMBEDDINGS,
+        max_em_andamento: int = MAX_EM_ANDAMENTO,
+        timeout_seg: float = TIMEOUT_SEG,
+        workers_busca: int = WORKERS_BUSCA,
+        prazo_encerramento_seg: float = PRAZO_ENCERRAMENTO_SEG,
+    ) -> None:
+        self.pasta_indice = pasta_indice
+        self.modelo_embeddings = modelo_embeddings
+        self.max_em_andamento = max_em_andamento
+        self.timeout_seg = timeout_seg
+        self.workers_busca = workers_busca
+        self.prazo_encerramento_seg = prazo_encerramento_seg
+        self.em_andamento = 0
+        self.encerrando = False
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def __call__(
+        self, escopo: Dict[str, Any], receber: Receber, enviar: Enviar
+    ) -> None:
+        if escopo["type"] == "lifespan":
+            await self._ciclo_de_vida(receber, enviar)
+            return
+        if escopo["type"] != "http":
+            return
+
+        rota = (escopo["method"], escopo["path"])
+        if rota == ("GET", "/"):
+            await enviar_resposta(
+                enviar, 200, HTML.encode("utf-8"), "text/html; charset=utf-8"
+            )
+        elif rota == ("GET", "/metrics"):
+            await enviar_resposta(
+                enviar,
+                200,
+                exportar_prometheus().encode("utf-8"),
+                "text/plain; version=0.0.4",
+            )
+        elif rota in (("POST", "/chat"), ("POST", "/chat/stream")):
+            await self._chat(receber, enviar, rota[1] == "/chat/stream")
+        else:
+            await enviar_json(enviar, 404, {"erro": "Rota nao encontrada."})
+
+    async def iniciar(self) -> None:
+        self.encerrando = False
+        servico = obter_servico(self.pasta_indice, self.modelo_embeddings)
+        await self._executar(servico.indice)
+
+    async def encerrar(self) -> None:
+        # Novas requisicoes recebem 503; as em andamento tem ate o prazo para terminar.
+        self.encerrando = True
+        prazo = time.monotonic() + self.prazo_encerramento_seg
+        while self.em_andamento and time.monotonic() < prazo:
+            await asyncio.sleep(0.05)
+        registrar_evento("web_encerrada", pendentes=self.em_andamento)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        descarregar_metricas()
+
+    async def _ciclo_de_vida(self, receber: Receber, enviar: Enviar) -> None:
+        while True:
+            mensagem = await receber()
+            if mensagem["type"] == "lifespan.startup":
+                try:
+                    await self.iniciar()
+                except Exception as exc:
+                    await enviar(
+                        {"type": "lifespan.startup.failed", "message": str(exc)}
+                    )
+                    return
+                await enviar({"type": "lifespan.startup.complete"})
+            elif mensagem["type"] == "lifespan.shutdown":
+                await self.encerrar()
+                await enviar({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _executar(self, funcao: Callable[..., Any], *args: Any) -> Any:
+        # Embedding e FAISS seguram CPU: rodam num pool limitado, fora do loop.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers_busca, thread_name_prefix="web-busca"
+            )
+        contexto = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, contexto.run, funcao, *args)
+
+    async def _chat(self, receber: Receber, enviar: Enviar, transmitir: bool) -> None:
+        if self.encerrando or self.em_andamento >= self.max_em_andamento:
+            motivo = "encerrando" if self.encerrando else "sobrecarga"
+            incrementar("requisicoes_rejeitadas_total", motivo=motivo)
+            await enviar_json(
+                enviar,
+                503,
+                {"erro": "Servidor ocupado, tente novamente."},
+                [(b"retry-after", b"1")],
+            )
+            return
+
+        self.em_andamento += 1
+        definir("requisicoes_em_andamento", self.em_andamento)
+        try:
+            try:
+                mensagem = ler_mensagem(
+                    await ler_corpo(receber, TAMANHO_MAXIMO_CORPO)
+                )
+            except ErroRequisicao as exc:
+                await enviar_json(enviar, exc.status, {"erro": str(exc)})
+                return
+            if transmitir:
+                await self._chat_stream(mensagem, enviar)
+            else:
+                await self._chat_json(mensagem, enviar)
+        finally:
+            self.em_andamento -= 1
+            definir("requisicoes_em_andamento", self.em_andamento)
+
+    async def _chat_json(self, mensagem: str, enviar: Enviar) -> None:
+        inicio = time.time()
+        with rastrear() as etapas, medir("chat"):
+            try:
+                resposta, fontes, cache = await asyncio.wait_for(
+                    self._responder(mensagem), self.timeout_seg
+                )
+            except asyncio.TimeoutError:
+                incrementar("erros_total", etapa="chat_timeout")
+                await enviar_json(enviar, 504, {"erro": "Tempo limite excedido."})
+                return
+            except Exception as exc:
+                incrementar("erros_total", etapa="chat")
+                await enviar_json(enviar, 500, {"erro": str(exc)})
+                return
+        registrar_evento(
+            "chat_fim",
+            assincrono=True,
+            cache=cache,
+            etapas=resumir_etapas(etapas),
+            duracao_seg=round(time.time() - inicio, 3),
+        )
+        await enviar_json(
+            enviar, 200, {"resposta": limpar_saida(resposta), "fontes": fontes}
+        )
+
+    async def _chat_stream(self, mensagem: str, enviar: Enviar) -> None:
+        await iniciar_resposta(
+            enviar, 200, "text/event-stream; charset=utf-8", CABECALHOS_SSE
+        )
+        inicio = time.time()
+        with rastrear() as etapas, medir("chat_stream"):
+            try:
+                cache = await asyncio.wait_for(
+                    self._transmitir(mensagem, enviar), self.timeout_seg
+                )
+            except Exception as exc:
+                if isinstance(exc, asyncio.TimeoutError):
+                    incrementar("erros_total", etapa="chat_timeout")
+                    erro = "Tempo limite excedido."
+                else:
+                    incrementar("erros_total", etapa="chat_stream")
+                    erro = str(exc)
+                # Se o cliente ja desconectou nao ha para quem avisar.
+                with suppress(OSError):
+                    await enviar_corpo(enviar, evento_sse("erro", erro).encode())
+                return
+        registrar_evento(
+            "chat_fim",
+            assincrono=True,
+            stream=True,
+            cache=cache,
+            etapas=resumir_etapas(etapas),
+            duracao_seg=round(time.time() - inicio, 3),
+        )
+        with suppress(OSError):
+            await enviar_corpo(enviar, b"")
+
+    async def _responder(self, mensagem: str) -> Tuple[str, List[dict], str]:
+        partes: List[str] = []
+        fontes: List[dict] = []
+        cache = ""
+        async for tipo, valor in self._responder_em_partes(mensagem, False):
+            if tipo == "fontes":
+                fontes = valor
+            elif tipo == "token":
+                partes.append(valor)
+            else:
+                cache = valor
+        return "".join(partes), fontes, cache
+
+    async def _transmitir(self, mensagem: str, enviar: Enviar) -> str:
+        cache = ""
+        async for tipo, valor in self._responder_em_partes(mensagem):
+            if tipo == "token":
+                valor = limpar_saida(valor)
+            if tipo == "fim":
+                cache = valor
+                valor = {"cache": valor}
+            await enviar_corpo(enviar, evento_sse(tipo, valor).encode(), fim=False)
+        return cache
+
+    async def _responder_em_partes(
+        self, mensagem: str, transmitir: bool = True
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        consultada = await self._executar(
+            consultar_cache,
+            mensagem,
+            self.pasta_indice,
+            self.modelo_embeddings,
+            LIMITE_FONTES,
+        )
+        if consultada.entrada is not None:
+            yield "fontes", consultada.entrada.fontes
+            yield "token", consultada.entrada.resposta
+            yield "fim", consultada.resultado
+            return
+
+        documentos = await self._executar(
+            buscar,
+            mensagem,
+            self.pasta_indice,
+            self.modelo_embeddings,
+            LIMITE_FONTES,
+            "vector",
+            consultada.vetor,
+        )
+        fontes = montar_fontes(documentos)
+        yield "fontes", fontes
+        gerador = obter_gerador()
+        if transmitir:
+            partes = []
+            async for parte in gerador.gerar_stream_async(mensagem, documentos):
+                partes.append(parte)
+                yield "token", parte
+            resposta = "".join(partes).strip()
+        else:
+            resposta = await gerador.gerar_async(mensagem, documentos)
+            yield "token", resposta
+        consultada.guardar(resposta, fontes)
+        yield "fim", consultada.resultado
+
+
+app = AppChatAsync()
+
+
+def ler_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Servidor de chat RAG assincrono (ASGI)"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--index-dir", default=str(PASTA_INDICE), help="Pasta do indice"
+    )
+    parser.add_argument(
+        "--max-em-andamento",
+        type=int,
+        default=MAX_EM_ANDAMENTO,
+        help="Requisicoes de chat simultaneas antes de responder 503",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=TIMEOUT_SEG,
+        help="Tempo maximo por requisicao de chat, em segundos",
+    )
+    parser.add_argument(
+        "--workers-busca",
+        type=int,
+        default=WORKERS_BUSCA,
+        help="Threads para embedding e busca (consultas simultaneas viram um lote)",
+    )
+    parser.add_argument(
+        "--prazo-encerramento",
+        type=float,
+        default=PRAZO_ENCERRAMENTO_SEG,
+        help="Segundos para concluir requisicoes em andamento ao encerrar",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = ler_args()
+    import uvicorn
+
+    servidor = AppChatAsync(
+        pasta_indice=Path(args.index_dir),
+        max_em_andamento=args.max_em_andamento,
+        timeout_seg=args.timeout,
+        workers_busca=args.workers_busca,
+        prazo_encerramento_seg=args.prazo_encerramento,
+    )
+    uvicorn.run(
+        servidor,
+        host=args.host,
+        port=args.port,
+        timeout_graceful_shutdown=int(args.prazo_encerramento),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import baixar  # noqa: E402
+import drive_api  # noqa: E402
+
+CONTEUDO = bytes(range(256)) * 64
+
+
+class ManipuladorDrive(BaseHTTPRequestHandler):
+    arquivos: dict = {}
+    falhas_429 = 0
+    pedidos: list = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def responder(self, status: int, corpo: bytes, **cabecalhos: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(corpo)))
+        for chave, valor in cabecalhos.items():
+            self.send_header(chave.replace("_", "-"), valor)
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        faixa = self.headers.get("Range")
+        type(self).pedidos.append((url.path, faixa))
+        if type(self).falhas_429:
+            type(self).falhas_429 -= 1
+            self.responder(429, b"", Retry_After="0")
+            return
+        if url.path == "/files":
+            itens = [item for item, _ in type(self).arquivos.values()]
+            corpo = json.dumps({"files": itens}).encode()
+            self.responder(200, corpo, Content_Type="application/json")
+            return
+        _, conteudo = type(self).arquivos[url.path.rsplit("/", 1)[-1]]
+        assert parse_qs(url.query) == {"alt": ["media"]}
+        if not faixa:
+            self.responder(200, conteudo)
+            return
+        inicio = int(faixa[len("bytes=") : -1])
+        if inicio >= len(conteudo):
+            self.responder(416, b"")
+            return
+        faixa = f"bytes {inicio}-{len(conteudo) - 1}/{len(conteudo)}"
+        self.responder(206, conteudo[inicio:], Content_Range=faixa)
+
+
+def item_drive(arquivo_id: str, nome: str, conteudo: bytes) -> dict:
+    return {
+        "id": arquivo_id,
+        "name": nome,
+        "size": str(len(conteudo)),
+        "md5Checksum": hashlib.md5(conteudo).hexdigest(),
+        "modifiedTime": "2024-05-01T12:00:00.000Z",
+    }
+
+
+@pytest.fixture
+def servidor(monkeypatch):
+    ManipuladorDrive.arquivos = {}
+    ManipuladorDrive.falhas_429 = 0
+    ManipuladorDrive.pedidos = []
+    http = ThreadingHTTPServer(("127.0.0.1", 0), ManipuladorDrive)
+    thread = threading.Thread(target=http.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(
+        drive_api, "URL_API_DRIVE", f"http://127.0.0.1:{http.server_port}/files"
+    )
+    monkeypatch.setattr(baixar, "registrar_evento", lambda *args, **kwargs: None)
+    yield ManipuladorDrive
+    http.shutdown()
+    http.server_close()
+
+
+def test_repete_apos_429(servidor, tmp_path):
+    item = item_drive("a1", "a.doc", CONTEUDO)
+    servidor.arquivos["a1"] = (item, CONTEUDO)
+    servidor.falhas_429 = 2
+
+    destino = tmp_path / "a.doc"
+    tamanho = drive_api.baixar_para_arquivo(item, destino, drive_api.criar_sessao())
+
+    assert tamanho == len(CONTEUDO)
+    assert destino.read_bytes() == CONTEUDO
+    assert len(servidor.pedidos) == 3
+
+
+def test_retoma_part_com_range(servidor, tmp_path):
+    item = item_drive("a1", "a.doc", CONTEUDO)
+    servidor.arquivos["a1"] = (item, CONTEUDO)
+    destino = tmp_path / "a.doc"
+    drive_api.arquivo_parcial(item, destino).write_bytes(CONTEUDO[:1000])
+
+    drive_api.baixar_para_arquivo(item, destino, drive_api.criar_sessao())
+
+    assert destino.read_bytes() == CONTEUDO
+    assert servidor.pedidos == [("/files/a1", "bytes=1000-")]
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_part_corrompido_baixa_do_zero(servidor, tmp_path):
+    item = item_drive("a1", "a.doc", CONTEUDO)
+    servidor.arquivos["a1"] = (item, CONTEUDO)
+    destino = tmp_path / "a.doc"
+    # .part do tamanho certo mas com outro conteudo: o 416 nao pode aceita-lo.
+    drive_api.arquivo_parcial(item, destino).write_bytes(b"x" * len(CONTEUDO))
+
+    drive_api.baixar_para_arquivo(item, destino, drive_api.criar_sessao())
+
+    assert destino.read_bytes() == CONTEUDO
+    assert servidor.pedidos == [
+        ("/files/a1", f"bytes={len(CONTEUDO)}-"),
+        ("/files/a1", None),
+    ]
+
+
+def test_pula_arquivo_sem_alteracao(servidor, tmp_path):
+    novo = CONTEUDO[::-1]
+    servidor.arquivos["a1"] = (item_drive("a1", "a.doc", CONTEUDO), CONTEUDO)
+    servidor.arquivos["b2"] = (item_drive("b2", "b.doc", novo), novo)
+    url = "https://drive.google.com/drive/folders/pasta"
+
+    baixar.baixar_pasta_drive(url, tmp_path, workers=2)
+    servidor.pedidos.clear()
+    baixar.baixar_pasta_drive(url, tmp_path, workers=2)
+
+    assert (tmp_path / "a.doc").read_bytes() == CONTEUDO
+    assert (tmp_path / "b.doc").read_bytes() == novo
+    assert servidor.pedidos == [("/files", None)]